@@ -0,0 +1,395 @@
+"""ASGI entry point.
+
+    python asgi.py --port 8000                           # uvicorn, one process
+    SMART_ASSETS_SECRET_KEY=... uvicorn asgi:create_app --factory --workers 4   # one model per worker
+
+The JSON login and prediction endpoints are served natively on the event
+loop, with password hashing and inference offloaded to bounded thread
+pools; every other route is handed to the Flask app (see WSGIBridge).
+At most MAX_CONCURRENCY requests are in progress at once.
+
+uvicorn's --workers start the app separately in each process, so each
+would make up its own session key: SMART_ASSETS_SECRET_KEY must be set
+for logins to work across them (see wsgi.py).
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from itsdangerous import BadSignature
+from werkzeug.http import dump_cookie, parse_cookie
+
+logger = logging.getLogger('asgi')
+
+# Requests in progress at once; further requests wait up to QUEUE_TIMEOUT seconds, then get a 503
+MAX_CONCURRENCY = int(os.environ.get('SMART_ASSETS_MAX_CONCURRENCY', 256))
+QUEUE_TIMEOUT = 5.0
+# Password hashes running at once; each scrypt hash also holds about 32 MB
+HASH_THREADS = int(os.environ.get('SMART_ASSETS_HASH_THREADS', os.cpu_count() or 1))
+INFERENCE_THREADS = int(os.environ.get('SMART_ASSETS_INFERENCE_THREADS', os.cpu_count() or 1))
+# Threads running Flask for every route that isn't served natively
+WSGI_THREADS = 32
+
+MAX_JSON_BODY = 64 * 1024
+# Request bodies larger than this are spooled to disk before they reach Flask
+SPOOL_SIZE = 1 << 20
+# Response bytes read from a Flask iterator per trip to the thread pool
+RESPONSE_BATCH = 64 * 1024
+
+
+class ClientDisconnect(Exception):
+    pass
+
+
+async def read_body(receive, limit=None, spool=None):
+    """The request body as bytes, or written into the file `spool`."""
+    chunks, size, more = [], 0, True
+    while more:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnect()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit is not None and size > limit:
+            raise ValueError('Request body too large')
+        if spool is not None:
+            spool.write(chunk)
+        else:
+            chunks.append(chunk)
+        more = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode()), *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def client_address(scope, proxy_hops=0):
+    """The client IP, read from X-Forwarded-For when behind `proxy_hops` trusted proxies.
+
+    Matches werkzeug's ProxyFix(x_for=proxy_hops) on the Flask side: the
+    address is the one `proxy_hops` entries from the right, and a header
+    with fewer entries than that is ignored.
+    """
+    if proxy_hops:
+        forwarded = ','.join(value.decode('latin-1') for key, value in scope['headers']
+                             if key == b'x-forwarded-for')
+        addresses = [address.strip() for address in forwarded.split(',') if address.strip()]
+        if len(addresses) >= proxy_hops:
+            return addresses[-proxy_hops]
+    return scope['client'][0] if scope.get('client') else None
+
+
+class FlaskSessions:
+    """Reads and writes Flask's signed session cookie, so a login on either app counts on both."""
+
+    def __init__(self, app):
+        self.app = app
+        self.interface = app.session_interface
+        self.serializer = self.interface.get_signing_serializer(app)
+        self.cookie_name = self.interface.get_cookie_name(app)
+        self.max_age = int(app.permanent_session_lifetime.total_seconds())
+
+    def load(self, scope):
+        value = parse_cookie(header(scope, b'cookie') or '').get(self.cookie_name)
+        if not value:
+            return {}
+        try:
+            return self.serializer.loads(value, max_age=self.max_age)
+        except BadSignature:
+            return {}
+
+    def cookie_header(self, data):
+        app = self.app
+        cookie = dump_cookie(self.cookie_name, self.serializer.dumps(dict(data)),
+                             domain=self.interface.get_cookie_domain(app),
+                             path=self.interface.get_cookie_path(app),
+                             secure=self.interface.get_cookie_secure(app),
+                             httponly=self.interface.get_cookie_httponly(app),
+                             samesite=self.interface.get_cookie_samesite(app))
+        return (b'set-cookie', cookie.encode('latin-1'))
+
+
+class WSGIBridge:
+    """Runs a WSGI app for ASGI requests on a pool of threads.
+
+    Unlike a bridge that funnels every call through one thread, requests
+    here run in parallel, up to `threads` at a time. The body is buffered
+    (spooled to disk when large) before the app is called; the response is
+    streamed back in batches of RESPONSE_BATCH bytes.
+    """
+
+    def __init__(self, app, threads=WSGI_THREADS):
+        self.app = app
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    def environ(self, scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1] or 80),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for key, value in scope['headers']:
+            name = key.decode('latin-1').upper().replace('-', '_')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value.decode('latin-1')
+                continue
+            name = 'HTTP_' + name
+            value = value.decode('latin-1')
+            environ[name] = f'{environ[name]},{value}' if name in environ else value
+        return environ
+
+    @staticmethod
+    def _next_batch(iterator):
+        chunks, size = [], 0
+        for chunk in iterator:
+            if chunk:
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= RESPONSE_BATCH:
+                    return b''.join(chunks), False
+        return b''.join(chunks), True
+
+    def _start(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            return lambda data: None
+
+        result = self.app(environ, start_response)
+        iterator = iter(result)
+        try:
+            body, done = self._next_batch(iterator)
+        except BaseException:
+            getattr(result, 'close', lambda: None)()
+            raise
+        return result, iterator, response, body, done
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        try:
+            await read_body(receive, spool=body)
+            body.seek(0)
+            result, iterator, response, chunk, done = await loop.run_in_executor(
+                self.pool, self._start, self.environ(scope, body))
+            try:
+                await send({'type': 'http.response.start', 'status': response['status'],
+                            'headers': response['headers']})
+                while not done:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                    chunk, done = await loop.run_in_executor(self.pool, self._next_batch, iterator)
+                await send({'type': 'http.response.body', 'body': chunk})
+            finally:
+                # Runs Flask's teardown (and closes streamed generators) off the event loop
+                if hasattr(result, 'close'):
+                    await loop.run_in_executor(self.pool, result.close)
+        finally:
+            body.close()
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+
+class AsyncApp:
+    """ASGI app: native async JSON endpoints in front of the Flask app."""
+
+    def __init__(self, flask_app, max_concurrency=MAX_CONCURRENCY, hash_threads=HASH_THREADS,
+                 inference_threads=INFERENCE_THREADS, wsgi_threads=WSGI_THREADS):
+        import vinnie
+        self.vinnie = vinnie
+        self.sessions = FlaskSessions(flask_app)
+        self.fallback = WSGIBridge(flask_app, wsgi_threads)
+        self.hash_pool = ThreadPoolExecutor(max_workers=hash_threads, thread_name_prefix='hash')
+        self.inference_pool = ThreadPoolExecutor(max_workers=inference_threads, thread_name_prefix='inference')
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.rejected = 0
+        self._slots = None
+        self.routes = {
+            ('POST', '/api/login'): self.login,
+            ('POST', '/api/predict'): self.predict,
+        }
+
+    async def run(self, pool, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        if self._slots is None:
+            # Created lazily so it binds to the server's event loop
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        acquired = False
+        try:
+            async with asyncio.timeout(QUEUE_TIMEOUT):
+                await self._slots.acquire()
+                acquired = True
+        except TimeoutError:
+            # The deadline can pass just as acquire() returns; don't keep that slot
+            if acquired:
+                self._slots.release()
+            self.rejected += 1
+            return await send_json(send, 503, {'error': 'Server busy'}, [(b'retry-after', b'1')])
+        self.in_flight += 1
+        try:
+            handler = self.routes.get((scope['method'], scope['path']))
+            if handler is None:
+                return await self.fallback(scope, receive, send)
+            started = time.perf_counter()
+            status = await handler(scope, receive, send)
+            self.vinnie.metrics.request_duration.observe(time.perf_counter() - started, scope['path'],
+                                                         scope['method'], str(status))
+        except ClientDisconnect:
+            pass
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_json(self, receive, send):
+        try:
+            data = json.loads(await read_body(receive, limit=MAX_JSON_BODY) or b'{}')
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            await send_json(send, 400, {'error': 'Expected a JSON object of at most 64 KB'})
+            return None
+        return data
+
+    async def login(self, scope, receive, send):
+        vinnie = self.vinnie
+        data = await self.read_json(receive, send)
+        if data is None:
+            return 400
+        username = str(data.get('username', '')).strip()
+        password = str(data.get('password', '')).strip()
+        if not username or not password:
+            await send_json(send, 400, {'error': 'username and password are required'})
+            return 400
+
+        ip_address = client_address(scope, vinnie.PROXY_HOPS)
+        # Short blocking calls (throttle state, audit insert) use the loop's default executor
+        wait = await self.run(None, vinnie.throttle_login, ip_address, username)
+        if wait:
+            await send_json(send, 429, {'error': 'Too many login attempts'},
+                            [(b'retry-after', str(wait).encode())])
+            return 429
+        # The user lookup and the deliberately slow hash run together on the hash pool
+        user, valid = await self.run(self.hash_pool, vinnie.check_login, username, password)
+        await self.run(None, vinnie.finish_login, user, username, ip_address,
+                       header(scope, b'user-agent') or 'Unknown', valid)
+        if not valid:
+            await send_json(send, 401, {'error': 'Invalid username or password'})
+            return 401
+        session = self.sessions.load(scope)
+        session.update(vinnie.session_for(user))
+        await send_json(send, 200, {'username': user['username'], 'is_admin': session['is_admin']},
+                        [self.sessions.cookie_header(session)])
+        return 200
+
+    async def predict(self, scope, receive, send):
+        vinnie = self.vinnie
+        session = self.sessions.load(scope)
+        if 'user_id' not in session:
+            await send_json(send, 401, {'error': 'Authentication required'})
+            return 401
+        data = await self.read_json(receive, send)
+        if data is None:
+            return 400
+        try:
+            listing = vinnie.parse_listing(data)
+            estimate, version = await self.run(self.inference_pool, vinnie.predict_listing,
+                                               session['user_id'], listing, 'async')
+        except (ValueError, vinnie.UnknownCategoryError) as e:
+            await send_json(send, 400, {'error': str(e)})
+            return 400
+        except Exception as e:
+            logger.exception("Error making prediction: %s", e)
+            await send_json(send, 500, {'error': 'Prediction failed'})
+            return 500
+        await send_json(send, 200, vinnie.estimate_json(estimate, version))
+        return 200
+
+    def close(self):
+        import db
+        for pool in (self.hash_pool, self.inference_pool):
+            pool.shutdown(wait=False)
+        self.fallback.close()
+        db.stop_write_behind()
+
+
+def create_app(preload_model=True, write_behind=True, secret_key_shared=False, **options):
+    """Initialize the Flask app (see wsgi.create_app) and wrap it in an AsyncApp."""
+    import wsgi
+    app = AsyncApp(wsgi.create_app(preload_model=preload_model, write_behind=write_behind,
+                                   secret_key_shared=secret_key_shared), **options)
+    import vinnie
+    vinnie.metrics.registry.gauge('smart_assets_async_in_flight', 'Requests in progress in the async app.',
+                                  lambda: app.in_flight)
+    vinnie.metrics.registry.gauge('smart_assets_async_rejected', 'Requests refused with 503 by the async app.',
+                                  lambda: app.rejected)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run Smart Assets on an ASGI server (uvicorn).')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-concurrency', type=int, default=MAX_CONCURRENCY)
+    parser.add_argument('--hash-threads', type=int, default=HASH_THREADS)
+    parser.add_argument('--inference-threads', type=int, default=INFERENCE_THREADS)
+    parser.add_argument('--access-log', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit('The async server needs uvicorn: pip install uvicorn')
+    app = create_app(secret_key_shared=True,  # a single process
+                     max_concurrency=args.max_concurrency, hash_threads=args.hash_threads,
+                     inference_threads=args.inference_threads)
+    uvicorn.run(app, host=args.host, port=args.port, access_log=args.access_log, log_level='info')
@@ -0,0 +1,186 @@
+import os
+import sys
+import gzip
+import json
+import hashlib
+import logging
+import argparse
+import mimetypes
+import threading
+from typing import NamedTuple
+
+try:
+    import brotli
+except ImportError:  # optional; clients then get gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+
+URL_PREFIX = '/assets'
+# A fingerprinted URL always names the same bytes, so browsers may keep it for a year
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Types worth compressing, and the size below which it isn't worth it
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+MIN_COMPRESS_BYTES = 256
+# Preferred content codings, best first
+ENCODINGS = ('br', 'gzip')
+
+
+class Asset(NamedTuple):
+    """One static file with its fingerprinted name and encoded bodies."""
+    path: str
+    url_path: str
+    digest: str
+    mimetype: str
+    mtime: float
+    variants: dict  # content coding ('identity', 'gzip', 'br') -> bytes
+
+
+def fingerprinted(path, digest):
+    """css/app.css -> css/app.<digest>.css"""
+    root, ext = os.path.splitext(path)
+    return f'{root}.{digest}{ext}'
+
+
+def load_asset(static_dir, path):
+    """Read one file and compress it at the highest levels; this is done once per file."""
+    full_path = os.path.join(static_dir, path)
+    with open(full_path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    variants = {'identity': data}
+    if mimetype.startswith(COMPRESSIBLE) and len(data) >= MIN_COMPRESS_BYTES:
+        variants['gzip'] = gzip.compress(data, compresslevel=9, mtime=0)
+        if brotli is not None:
+            variants['br'] = brotli.compress(data, quality=11)
+    return Asset(path, fingerprinted(path, digest), digest, mimetype, os.path.getmtime(full_path), variants)
+
+
+class StaticAssets:
+    """Files under static/, held in memory with a content fingerprint and precompressed bodies.
+
+    Templates link to url(path), which names the file by the hash of its
+    contents, so it can be cached forever and a changed file gets a new URL.
+    Everything is loaded when the app is created, before a prefork server
+    forks its workers. With auto_reload on (development), a file that
+    changed on disk is reloaded the next time its URL is built.
+    """
+
+    def __init__(self, static_dir=STATIC_DIR, auto_reload=False):
+        self.static_dir = static_dir
+        self.auto_reload = auto_reload
+        self._assets = {}
+        self._by_url = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        assets = {}
+        for root, dirs, files in os.walk(self.static_dir):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                path = os.path.relpath(os.path.join(root, name), self.static_dir).replace(os.sep, '/')
+                assets[path] = load_asset(self.static_dir, path)
+        with self._lock:
+            self._assets = assets
+            self._by_url = {asset.url_path: asset for asset in assets.values()}
+        return assets
+
+    def _reload(self, asset):
+        try:
+            mtime = os.path.getmtime(os.path.join(self.static_dir, asset.path))
+        except OSError:
+            return asset
+        if mtime == asset.mtime:
+            return asset
+        fresh = load_asset(self.static_dir, asset.path)
+        with self._lock:
+            self._assets[asset.path] = fresh
+            self._by_url[fresh.url_path] = fresh
+        return fresh
+
+    def get(self, path):
+        asset = self._assets.get(path)
+        if asset is not None and self.auto_reload:
+            asset = self._reload(asset)
+        return asset
+
+    def url(self, path):
+        """URL of the current version of static/<path>."""
+        asset = self.get(path)
+        if asset is None:
+            logger.warning("Static asset %s not found", path)
+            return f'/static/{path}'
+        return f'{URL_PREFIX}/{asset.url_path}'
+
+    def lookup(self, url_path):
+        """(asset, current) for a requested name.
+
+        `current` is False when the fingerprint is out of date, e.g. a page
+        cached before a deploy; that request gets today's file without the
+        long-lived cache headers.
+        """
+        asset = self._by_url.get(url_path)
+        if asset is not None:
+            current = self._assets.get(asset.path) is asset
+            return (asset, True) if current else (self._assets.get(asset.path), False)
+        root, ext = os.path.splitext(url_path)
+        asset = self._assets.get(root.rpartition('.')[0] + ext)
+        return asset, False
+
+    def stats(self):
+        """Bytes of each asset per content coding."""
+        return {path: {coding: len(body) for coding, body in asset.variants.items()}
+                for path, asset in sorted(self._assets.items())}
+
+
+def choose_encoding(asset, accept_encodings):
+    """Best precompressed variant the client accepts (werkzeug Accept object)."""
+    for coding in ENCODINGS:
+        if coding in asset.variants and accept_encodings[coding]:
+            return coding
+    return 'identity'
+
+
+def init_app(app, static_dir=STATIC_DIR, auto_reload=True):
+    """Serve static/ under URL_PREFIX and add asset_url() to templates."""
+    from flask import Response, abort, request
+
+    assets = StaticAssets(static_dir, auto_reload=auto_reload)
+
+    def serve(filename):
+        asset, current = assets.lookup(filename)
+        if asset is None:
+            abort(404)
+        coding = choose_encoding(asset, request.accept_encodings)
+        response = Response(asset.variants[coding], mimetype=asset.mimetype)
+        if coding != 'identity':
+            response.headers['Content-Encoding'] = coding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = IMMUTABLE if current else 'no-cache'
+        response.set_etag(f'{asset.digest}-{coding}')
+        return response.make_conditional(request)
+
+    app.add_url_rule(URL_PREFIX + '/<path:filename>', 'assets', serve)
+    app.add_template_global(assets.url, 'asset_url')
+    app.extensions['static_assets'] = assets
+    return assets
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='List static assets with their fingerprinted names and sizes.')
+    parser.add_argument('--static-dir', default=STATIC_DIR, help='directory to read')
+    args = parser.parse_args()
+
+    assets = StaticAssets(args.static_dir)
+    report = {path: {'url': f'{URL_PREFIX}/{assets.get(path).url_path}', 'bytes': sizes}
+              for path, sizes in assets.stats().items()}
+    report['brotli'] = brotli is not None
+    json.dump(report, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,170 @@
+import io
+import csv
+import json
+
+import numpy as np
+import pandas as pd
+
+import forest_eval
+from features import FEATURE_COLUMNS
+
+# Input columns for a batch, in the order the model expects them
+BATCH_COLUMNS = list(FEATURE_COLUMNS)
+# Estimate columns, in the order predict_batch stores them
+ESTIMATE_COLUMNS = ['predicted_price', 'predicted_std', 'interval_low', 'interval_high']
+OUTPUT_COLUMNS = ['row'] + BATCH_COLUMNS + ESTIMATE_COLUMNS + ['error']
+
+# Rows scored per predictor.predict call
+CHUNK_SIZE = 5000
+# Upper bound on rows accepted in one request
+MAX_BATCH_ROWS = 200000
+
+
+class BatchInputError(ValueError):
+    """Raised when a batch request can't be parsed at all."""
+
+
+def read_batch(data, content_type):
+    """Parse a JSON or CSV request body into a DataFrame of BATCH_COLUMNS.
+
+    JSON may be a list of row objects or {"rows": [...]}. Anything whose
+    content type mentions csv is read as CSV with a header row.
+    """
+    content_type = (content_type or '').lower()
+    try:
+        if 'csv' in content_type:
+            frame = pd.read_csv(io.BytesIO(data), dtype={'location': str, 'property_type': str},
+                                skipinitialspace=True)
+        else:
+            payload = json.loads(data or b'null')
+            if isinstance(payload, dict):
+                payload = payload.get('rows')
+            if not isinstance(payload, list):
+                raise BatchInputError('Expected a JSON list of rows or an object with a "rows" list')
+            not_objects = [i for i, row in enumerate(payload) if not isinstance(row, dict)]
+            if not_objects:
+                raise BatchInputError(f'Every row must be a JSON object; row {not_objects[0]} is not')
+            frame = pd.DataFrame.from_records(payload)
+    except (ValueError, pd.errors.ParserError) as e:
+        if isinstance(e, BatchInputError):
+            raise
+        raise BatchInputError(f'Could not parse request body: {e}')
+
+    missing = [col for col in BATCH_COLUMNS if col not in frame.columns]
+    if missing:
+        raise BatchInputError(f'Missing columns: {", ".join(missing)}')
+    if len(frame) > MAX_BATCH_ROWS:
+        raise BatchInputError(f'Too many rows ({len(frame)}); the limit is {MAX_BATCH_ROWS}')
+    return frame[BATCH_COLUMNS].reset_index(drop=True)
+
+
+def encode_batch(frame, schema):
+    """Validate and encode a batch column-wise with the model's FeatureSchema.
+
+    Returns (X, errors) where X is an (n, 5) float array in model feature
+    order and errors is an object array holding a message for every invalid
+    row and None for valid ones.
+    """
+    X = schema.encode(pd.to_numeric(frame['bedrooms'], errors='coerce').to_numpy(dtype=float),
+                      pd.to_numeric(frame['bathrooms'], errors='coerce').to_numpy(dtype=float),
+                      pd.to_numeric(frame['size_sqft'], errors='coerce').to_numpy(dtype=float),
+                      frame['location'].astype(str).str.strip().to_numpy(dtype=str),
+                      frame['property_type'].astype(str).str.strip().to_numpy(dtype=str))
+    return X, schema.validate(X)
+
+
+def predict_batch(frame, bundle, chunk_size=CHUNK_SIZE):
+    """Score a batch chunk by chunk.
+
+    Yields (start, chunk, estimates, errors) per chunk; estimates is an
+    (n, 4) array in ESTIMATE_COLUMNS order, NaN for rows that failed
+    validation. The trees are evaluated once per chunk, and the price and
+    interval both come from that one pass.
+    """
+    for start in range(0, len(frame), chunk_size):
+        chunk = frame.iloc[start:start + chunk_size]
+        X, errors = encode_batch(chunk, bundle.schema)
+        estimates = np.full((len(chunk), len(ESTIMATE_COLUMNS)), np.nan)
+        valid = errors == None  # noqa: E711 - elementwise comparison on an object array
+        if valid.any():
+            dist = forest_eval.tree_distribution(forest_eval.tree_values(bundle.predictor, X[valid]))
+            estimates[valid, 0] = dist.mean
+            estimates[valid, 1] = dist.std
+            estimates[valid, 2] = dist.quantiles[:, 0]
+            estimates[valid, 3] = dist.quantiles[:, -1]
+        yield start, chunk, estimates, errors
+
+
+def result_rows(start, chunk, estimates, errors):
+    """Turn one scored chunk into output dicts, one per input row."""
+    records = chunk.to_dict('records')
+    values = estimates.tolist()
+    for offset, record in enumerate(records):
+        error = errors[offset]
+        record = {key: (None if pd.isna(value) else value) for key, value in record.items()}
+        record['row'] = start + offset
+        for column, value in zip(ESTIMATE_COLUMNS, values[offset]):
+            record[column] = None if error else value
+        record['error'] = error
+        yield record
+
+
+def stream_json(chunks, summary):
+    """Stream results as one JSON document; `summary` is filled as rows are written."""
+    yield '{"predictions": ['
+    first = True
+    for scored in chunks:
+        parts = []
+        for record in result_rows(*scored):
+            summary['rows'] += 1
+            summary['errors' if record['error'] else 'predicted'] += 1
+            parts.append(json.dumps(record, default=_json_default))
+        if parts:
+            yield ('' if first else ',') + ','.join(parts)
+            first = False
+    yield '], "summary": ' + json.dumps(summary) + '}'
+
+
+def stream_csv(chunks, summary):
+    """Stream results as CSV with a header row."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=OUTPUT_COLUMNS)
+    writer.writeheader()
+    for scored in chunks:
+        for record in result_rows(*scored):
+            summary['rows'] += 1
+            summary['errors' if record['error'] else 'predicted'] += 1
+            writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def record_predictions(user_id, chunks, write):
+    """Pass scored chunks through, calling write(rows) with each chunk's predictions table rows first.
+
+    Recording chunk by chunk, before the chunk is sent, means a client
+    that disconnects part-way (or an error in a later chunk) still leaves
+    an audit row for every prediction it was given.
+    """
+    for start, chunk, estimates, errors in chunks:
+        valid = np.flatnonzero(errors == None)  # noqa: E711
+        if len(valid):
+            rows = chunk.iloc[valid]
+            write(list(zip(
+                [user_id] * len(valid),
+                rows['location'].astype(str).str.strip(),
+                rows['property_type'].astype(str).str.strip(),
+                pd.to_numeric(rows['bedrooms']).astype(int).tolist(),
+                pd.to_numeric(rows['bathrooms']).astype(int).tolist(),
+                pd.to_numeric(rows['size_sqft']).astype(float).tolist(),
+                *estimates[valid].T.tolist(),
+            )))
+        yield start, chunk, estimates, errors
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
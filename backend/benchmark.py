@@ -0,0 +1,639 @@
+import os
+import sys
+import json
+import time
+import re
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import LabelEncoder
+
+from constants import KENYAN_COUNTIES, PROPERTY_TYPES
+
+BENCH_USER = ('bench', 'bench-password')
+
+# Pages whose transfer size is reported, name -> path (all but login and signup need a session)
+PAGES = {
+    'login': '/login',
+    'signup': '/signup',
+    'dashboard': '/',
+    'predict': '/predict',
+    'add_property': '/add-property',
+    'model_status': '/ml/status',
+}
+STYLESHEET_LINK = re.compile(r'<link rel="stylesheet" href="(/[^"]+)"')
+
+
+def synthetic_rows(n, seed=0):
+    """Random listings with a price that depends on every feature."""
+    rng = np.random.default_rng(seed)
+    bedrooms = rng.integers(1, 7, n)
+    bathrooms = np.minimum(bedrooms, rng.integers(1, 5, n))
+    size_sqft = rng.uniform(300, 6000, n).round(0)
+    location = rng.integers(0, len(KENYAN_COUNTIES), n)
+    property_type = rng.integers(0, len(PROPERTY_TYPES), n)
+    price = (size_sqft * 1500 + bedrooms * 400000 + bathrooms * 150000
+             + location * 60000 + property_type * 250000 + rng.normal(0, 3e5, n))
+    return bedrooms, bathrooms, size_sqft, location, property_type, np.maximum(price, 1e5)
+
+
+def build_stand_in(encoders_dir, n_estimators=50, max_depth=10, n_rows=20000, seed=0, mmap=True):
+    """Write a synthetic forest and encoders with the production file names and feature layout.
+
+    With mmap the memory-mapped export is written too, as retrain.py does.
+    """
+    import model_store
+    from model_registry import MODEL_FILE, LOCATION_ENCODER_FILE, PROPERTY_ENCODER_FILE
+    os.makedirs(encoders_dir, exist_ok=True)
+    location_encoder = LabelEncoder().fit(KENYAN_COUNTIES)
+    property_encoder = LabelEncoder().fit(PROPERTY_TYPES)
+    bedrooms, bathrooms, size_sqft, location, property_type, price = synthetic_rows(n_rows, seed)
+    # Integer codes here are positions in the vocabularies; map them to encoder codes
+    location_codes = location_encoder.transform(np.asarray(KENYAN_COUNTIES)[location])
+    property_codes = property_encoder.transform(np.asarray(PROPERTY_TYPES)[property_type])
+    X = np.column_stack([bedrooms, bathrooms, size_sqft, location_codes, property_codes])
+    model = RandomForestRegressor(n_estimators=n_estimators, max_depth=max_depth,
+                                  min_samples_leaf=3, random_state=seed, n_jobs=-1).fit(X, price)
+    model.set_params(n_jobs=None)
+    joblib.dump(model, os.path.join(encoders_dir, MODEL_FILE), compress=3)
+    joblib.dump(location_encoder, os.path.join(encoders_dir, LOCATION_ENCODER_FILE))
+    joblib.dump(property_encoder, os.path.join(encoders_dir, PROPERTY_ENCODER_FILE))
+    if mmap:
+        model_store.export(model, location_encoder, property_encoder,
+                           os.path.join(encoders_dir, model_store.MMAP_DIR))
+
+
+def random_form(rng):
+    return {
+        'location': rng.choice(KENYAN_COUNTIES),
+        'property_type': rng.choice(PROPERTY_TYPES),
+        'bedrooms': str(rng.randint(1, 6)),
+        'bathrooms': str(rng.randint(1, 4)),
+        'size_sqft': str(rng.randint(300, 6000)),
+    }
+
+
+def summarize(latencies, elapsed):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'requests': int(len(latencies)),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(float(latencies.mean()), 4),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 4),
+        'p90_ms': round(float(np.percentile(latencies, 90)), 4),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 4),
+        'max_ms': round(float(latencies.max()), 4),
+    }
+
+
+def run_sequential(call, iterations, warmup=10):
+    for i in range(min(warmup, iterations)):
+        call(i)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(warmup, warmup + iterations):
+        t0 = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def run_concurrent(make_call, workers, iterations):
+    """Drive `iterations` calls per worker from `workers` threads; make_call(worker) returns call(i)."""
+    calls = [make_call(w) for w in range(workers)]
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(workers)
+
+    def worker(call):
+        local = []
+        barrier.wait()
+        for i in range(iterations):
+            t0 = time.perf_counter()
+            call(i)
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(worker, calls))
+    result = summarize(latencies, time.perf_counter() - started)
+    result['workers'] = workers
+    return result
+
+
+class Bench:
+    """The app under test and its scenarios.
+
+    Runs against a synthetic stand-in forest and a fresh database in a
+    temporary directory, so it works in a checkout where the real artifacts
+    are still Git LFS pointers.
+    """
+
+    def __init__(self, workdir, trees, depth, mmap=True):
+        encoders_dir = os.path.join(workdir, 'Encoders')
+        # The app modules read these at import time, so set them before importing any
+        os.environ['SMART_ASSETS_ENCODERS_DIR'] = encoders_dir
+        os.environ['SMART_ASSETS_DB'] = os.path.join(workdir, 'bench.db')
+        # Scenarios log in far more often than the login throttle allows
+        os.environ['SMART_ASSETS_LOGIN_THROTTLE'] = '0'
+        build_stand_in(encoders_dir, n_estimators=trees, max_depth=depth, mmap=mmap)
+        import wsgi
+        import vinnie
+        import db
+        self.vinnie = vinnie
+        self.db = db
+        self.app = wsgi.create_app(secret_key_shared=True)
+        self.app.config['TESTING'] = True
+        db.create_user('Bench User', 'bench@example.com', *BENCH_USER)
+
+    def client(self, login=True):
+        client = self.app.test_client()
+        if login:
+            response = client.post('/login', data={'username': BENCH_USER[0], 'password': BENCH_USER[1]})
+            assert response.status_code == 302, 'benchmark login failed'
+        return client
+
+    def predict_price_call(self, seed=0):
+        rng = random.Random(seed)
+        inputs = [random_form(rng) for _ in range(1000)]
+
+        def call(i):
+            f = inputs[i % len(inputs)]
+            self.vinnie.predict_price(int(f['bedrooms']), int(f['bathrooms']), float(f['size_sqft']),
+                                      f['location'], f['property_type'])
+        return call
+
+    def predict_route_call(self, seed=0):
+        client = self.client()
+        rng = random.Random(seed)
+        inputs = [random_form(rng) for _ in range(1000)]
+
+        def call(i):
+            response = client.post('/predict', data=inputs[i % len(inputs)])
+            assert response.status_code == 200
+        return call
+
+    def page_call(self, path):
+        client = self.client()
+
+        def call(i):
+            response = client.get(path)
+            assert response.status_code == 200
+        return call
+
+    def page_weight(self):
+        """Bytes sent for each page on a first visit and on a repeat visit.
+
+        Stylesheets are fetched as a browser would (accepting br and gzip) and
+        count towards repeat visits only when they may not be cached.
+        """
+        client = self.client()
+        pages = {}
+        for name, path in PAGES.items():
+            response = client.get(path)
+            assert response.status_code == 200, name
+            html = response.get_data(as_text=True)
+            stylesheet_bytes = uncached_bytes = 0
+            for href in STYLESHEET_LINK.findall(html):
+                sheet = client.get(href, headers={'Accept-Encoding': 'br, gzip'})
+                assert sheet.status_code == 200, href
+                stylesheet_bytes += len(sheet.data)
+                if 'max-age=0' in sheet.headers.get('Cache-Control', 'max-age=0'):
+                    uncached_bytes += len(sheet.data)
+            html_bytes = len(response.data)
+            pages[name] = {
+                'html_bytes': html_bytes,
+                'stylesheet_bytes': stylesheet_bytes,
+                'first_visit_bytes': html_bytes + stylesheet_bytes,
+                'repeat_visit_bytes': html_bytes + uncached_bytes,
+            }
+        return pages
+
+    def login_call(self, seed=0, success=True):
+        client = self.client(login=False)
+        password = BENCH_USER[1] if success else 'wrong-password'
+
+        def call(i):
+            response = client.post('/login', data={'username': BENCH_USER[0], 'password': password})
+            assert response.status_code == (302 if success else 200)
+        return call
+
+    def add_property_call(self, seed=0):
+        client = self.client()
+        rng = random.Random(seed)
+
+        def call(i):
+            data = random_form(rng)
+            data['price'] = str(rng.randint(1000000, 50000000))
+            response = client.post('/add-property', data=data)
+            assert response.status_code == 302
+        return call
+
+    def scenarios(self):
+        """Name -> (kind, factory). Factories take a seed and return call(i)."""
+        return {
+            'predict_price': ('sequential', self.predict_price_call),
+            'route_predict': ('sequential', self.predict_route_call),
+            'route_login': ('sequential', self.login_call),
+            'route_login_failed': ('sequential', lambda seed=0: self.login_call(seed, success=False)),
+            'route_add_property': ('sequential', self.add_property_call),
+            'route_dashboard': ('sequential', lambda seed=0: self.page_call('/')),
+            'route_predict_page': ('sequential', lambda seed=0: self.page_call('/predict')),
+            'concurrent_predict': ('concurrent', self.predict_route_call),
+            'concurrent_login': ('concurrent', self.login_call),
+            'concurrent_add_property': ('concurrent', self.add_property_call),
+        }
+
+
+def _memory_kb(pid):
+    """(rss, pss) of a process in kB, from /proc/<pid>/smaps_rollup (Linux only)."""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:'):
+                values[parts[0]] = int(parts[1])
+    return values['Rss:'], values['Pss:']
+
+
+def _child_pids(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return [int(p) for p in f.read().split()]
+
+
+def _free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure_serving(workers, preload=True, timeout=120):
+    """Start serve.py, wait for every worker to be ready and total the memory of all processes.
+
+    PSS charges each shared page to the processes sharing it proportionally,
+    so its total is the real memory cost of the server; RSS counts shared
+    pages once per process.
+    """
+    port = _free_port()
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serve.py'),
+               '--workers', str(workers), '--port', str(port)]
+    if not preload:
+        command.append('--no-preload')
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True)
+    try:
+        ready = 0
+        for line in process.stderr:
+            if 'Worker' in line and 'ready' in line:
+                ready += 1
+                if ready == workers:
+                    break
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError('serve.py did not become ready')
+        ready_seconds = time.perf_counter() - started
+        time.sleep(0.5)
+        pids = [process.pid] + _child_pids(process.pid)
+        rss, pss = map(sum, zip(*(_memory_kb(pid) for pid in pids)))
+    finally:
+        process.terminate()
+        process.wait()
+    return {
+        'workers': workers,
+        'preload': preload,
+        'ready_seconds': round(ready_seconds, 3),
+        'rss_mb': round(rss / 1024, 1),
+        'pss_mb': round(pss / 1024, 1),
+    }
+
+
+# One process each: the threaded sync server against the event loop with thread pools
+LOAD_SERVERS = {
+    'sync': ['serve.py', '--workers', '1'],
+    'async': ['asgi.py'],
+}
+
+
+def start_server(name, port, timeout=120):
+    """Start one of LOAD_SERVERS on `port` and wait until it answers."""
+    import http.client
+    script, *args = LOAD_SERVERS[name]
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), script),
+               *args, '--port', str(port)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline and process.poll() is None:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/login')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{script} did not start (asgi.py needs uvicorn)')
+
+
+class HTTPClient:
+    """Keep-alive JSON client that carries the session cookie."""
+
+    def __init__(self, port):
+        import http.client
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookie = None
+
+    def post_json(self, path, payload):
+        import http.client
+        headers = {'Content-Type': 'application/json'}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        try:
+            self.connection.request('POST', path, body=json.dumps(payload), headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            # The server closed an idle keep-alive connection; reconnect once
+            self.connection.close()
+            self.connection.request('POST', path, body=json.dumps(payload), headers=headers)
+            response = self.connection.getresponse()
+        response.read()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return response.status
+
+    def login(self):
+        status = self.post_json('/api/login', {'username': BENCH_USER[0], 'password': BENCH_USER[1]})
+        assert status == 200, f'benchmark login failed ({status})'
+
+
+def http_call(port, endpoint, seed=0):
+    """call(i) for POST /api/predict or /api/login against a running server."""
+    client = HTTPClient(port)
+    client.login()
+    if endpoint == 'login':
+        credentials = {'username': BENCH_USER[0], 'password': BENCH_USER[1]}
+
+        def call(i):
+            assert client.post_json('/api/login', credentials) == 200
+        return call
+
+    rng = random.Random(seed)
+    inputs = [{k: v if k in ('location', 'property_type') else float(v) for k, v in random_form(rng).items()}
+              for _ in range(1000)]
+
+    def call(i):
+        assert client.post_json('/api/predict', inputs[i % len(inputs)]) == 200
+    return call
+
+
+def measure_load(levels, predict_requests, login_requests):
+    """Latency and throughput of both servers at each number of concurrent clients."""
+    results = {}
+    for server in LOAD_SERVERS:
+        port = _free_port()
+        process = start_server(server, port)
+        try:
+            for endpoint, requests in (('predict', predict_requests), ('login', login_requests)):
+                for clients in levels:
+                    result = run_concurrent(lambda w: http_call(port, endpoint, seed=w), clients,
+                                            max(2, requests // clients))
+                    results[f'{server}_{endpoint}_c{clients}'] = result
+                    print(f"load {server} {endpoint} x{clients}: {result}", file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait()
+    return results
+
+
+def _peak_rss_kb(process, interval=0.05):
+    """Peak RSS of a running child, from VmHWM in /proc (Linux only).
+
+    ru_maxrss from wait4() can't be used: it includes the parent's peak at fork.
+    """
+    peak = 0
+    while process.poll() is None:
+        try:
+            with open(f'/proc/{process.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        peak = max(peak, int(line.split()[1]))
+        except OSError:
+            break
+        time.sleep(interval)
+    return peak
+
+
+def build_export_db(path, n_rows, chunk_size=100000, seed=0):
+    """A database at `path` with n_rows synthetic rows in both predictions and property_data.
+
+    created_at and added_at advance one minute per row from 2024-01-01.
+    """
+    import db
+    db.configure(path)
+    db.init_db()
+    # The market statistics triggers would dominate the insert time and aren't exported
+    with db.transaction() as conn:
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+            conn.execute(f'DROP TRIGGER {name}')
+    user_id = db.get_user_by_username('admin')['id']
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2024-01-01T00:00')
+    for offset in range(0, n_rows, chunk_size):
+        n = min(chunk_size, n_rows - offset)
+        times = np.datetime_as_string(start + np.arange(offset, offset + n).astype('timedelta64[m]'))
+        times = np.char.replace(times, 'T', ' ').astype(object) + ':00'
+        locations = rng.choice(KENYAN_COUNTIES, n).tolist()
+        types = rng.choice(PROPERTY_TYPES, n).tolist()
+        bedrooms = rng.integers(1, 7, n).tolist()
+        bathrooms = rng.integers(1, 5, n).tolist()
+        size = np.round(rng.uniform(300, 8000, n), 1).tolist()
+        price = np.round(rng.uniform(1e6, 8e7, n)).tolist()
+        with db.transaction() as conn:
+            conn.executemany('''INSERT INTO property_data
+                                (bedrooms, bathrooms, size_sqft, location, property_type, price, added_by, added_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                             zip(bedrooms, bathrooms, size, locations, types, price, [user_id] * n, times))
+            conn.executemany('''INSERT INTO predictions
+                                (user_id, location, property_type, bedrooms, bathrooms, size_sqft,
+                                 predicted_price, predicted_std, interval_low, interval_high, created_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                             zip([user_id] * n, locations, types, bedrooms, bathrooms, size, price,
+                                 [p * 0.1 for p in price], [p * 0.85 for p in price], [p * 1.15 for p in price],
+                                 times))
+    db.close_connections()
+
+
+def measure_export(n_rows, workdir):
+    """Throughput and peak memory of export.py on a synthetic database of n_rows per table.
+
+    Each export runs in its own process so its peak RSS can be read. The
+    `until` runs export the first tenth of the rows; a streaming export
+    should peak at the same memory for both.
+    """
+    path = os.path.join(workdir, 'export.db')
+    started = time.perf_counter()
+    build_export_db(path, n_rows)
+    results = {'rows': n_rows, 'build_seconds': round(time.perf_counter() - started, 2),
+               'db_mb': round(os.path.getsize(path) / 2**20, 1)}
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'export.py')
+    tenth = str(np.datetime64('2024-01-01T00:00') + np.timedelta64(n_rows // 10, 'm')).replace('T', ' ')
+    for table in ('predictions', 'property_data'):
+        for fmt in ('csv', 'ndjson', 'parquet'):
+            for scope, extra in (('all', []), ('tenth', ['--until', tenth])):
+                process = subprocess.Popen([sys.executable, script, table, '--format', fmt, '--db', path,
+                                            '--output', os.devnull, *extra],
+                                           stderr=subprocess.PIPE, text=True)
+                peak_kb = _peak_rss_kb(process)
+                output = process.stderr.read()
+                if process.wait():
+                    raise RuntimeError(f'export.py {table} --format {fmt} failed:\n{output}')
+                summary = json.loads(output.strip().splitlines()[-1])
+                results[f'{table}_{fmt}_{scope}'] = {
+                    'rows': summary['rows'],
+                    'seconds': summary['seconds'],
+                    'rows_per_s': round(summary['rows'] / summary['seconds']) if summary['seconds'] else None,
+                    'mb_per_s': round(summary['bytes'] / 2**20 / summary['seconds'], 1) if summary['seconds'] else None,
+                    'max_rss_mb': round(peak_kb / 1024, 1),
+                }
+                print(f"export {table} {fmt} {scope}: {results[f'{table}_{fmt}_{scope}']}", file=sys.stderr)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    """Percent change of p50 latency and throughput per scenario."""
+    lines = []
+    for name, result in current['results'].items():
+        before = previous.get('results', {}).get(name)
+        if not before:
+            continue
+        p50 = (result['p50_ms'] / before['p50_ms'] - 1) * 100 if before['p50_ms'] else 0.0
+        rps = (result['throughput_rps'] / before['throughput_rps'] - 1) * 100 if before['throughput_rps'] else 0.0
+        lines.append(f"{name:28s} p50 {before['p50_ms']:9.3f} -> {result['p50_ms']:9.3f} ms ({p50:+6.1f}%)  "
+                     f"rps {before['throughput_rps']:9.1f} -> {result['throughput_rps']:9.1f} ({rps:+6.1f}%)")
+    for name, result in current.get('pages', {}).items():
+        before = previous.get('pages', {}).get(name)
+        if before:
+            lines.append(f"page_{name:23s} first {before['first_visit_bytes']:7d} -> {result['first_visit_bytes']:7d} B  "
+                         f"repeat {before['repeat_visit_bytes']:7d} -> {result['repeat_visit_bytes']:7d} B")
+    for name, result in current.get('load', {}).items():
+        before = previous.get('load', {}).get(name)
+        if before:
+            lines.append(f"load_{name:23s} p99 {before['p99_ms']:9.3f} -> {result['p99_ms']:9.3f} ms  "
+                         f"rps {before['throughput_rps']:9.1f} -> {result['throughput_rps']:9.1f}")
+    for name, result in current.get('export', {}).items():
+        before = previous.get('export', {}).get(name)
+        if isinstance(result, dict) and isinstance(before, dict):
+            lines.append(f"export_{name:21s} rows/s {before['rows_per_s']:9} -> {result['rows_per_s']:9}  "
+                         f"rss {before['max_rss_mb']:7.1f} -> {result['max_rss_mb']:7.1f} MB")
+    for name, result in current.get('serving', {}).items():
+        before = previous.get('serving', {}).get(name)
+        if before:
+            lines.append(f"serving_{name:20s} ready {before['ready_seconds']:6.2f} -> {result['ready_seconds']:6.2f} s  "
+                         f"pss {before['pss_mb']:7.1f} -> {result['pss_mb']:7.1f} MB")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Smart Assets hot paths.')
+    parser.add_argument('--iterations', type=int, default=500, help='calls per sequential scenario')
+    parser.add_argument('--auth-iterations', type=int, default=50,
+                        help='calls per login scenario (password hashing is deliberately slow)')
+    parser.add_argument('--workers', type=int, default=8, help='threads for concurrent scenarios')
+    parser.add_argument('--trees', type=int, default=50, help='trees in the stand-in forest')
+    parser.add_argument('--depth', type=int, default=10, help='depth of the stand-in forest')
+    parser.add_argument('--artifact-format', default='mmap', choices=['mmap', 'pickle'],
+                        help='serve the stand-in model from the memory-mapped export or the pickle')
+    parser.add_argument('--only', help='comma-separated scenario names to run')
+    parser.add_argument('--serving-workers', type=int, default=4,
+                        help='workers for the serve.py startup and memory measurement (0 to skip)')
+    parser.add_argument('--load-clients', default='1,16,64',
+                        help='concurrent HTTP clients for the sync vs async server comparison (empty to skip)')
+    parser.add_argument('--load-requests', type=int, default=2000,
+                        help='predict requests per client count in the server comparison')
+    parser.add_argument('--export-rows', type=int, default=0,
+                        help='rows per table in the synthetic database for the export benchmark (0 to skip)')
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--compare', help='earlier JSON results to diff against')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='smart-assets-bench-') as workdir:
+        bench = Bench(workdir, args.trees, args.depth, mmap=args.artifact_format == 'mmap')
+        scenarios = bench.scenarios()
+        selected = args.only.split(',') if args.only else list(scenarios)
+
+        results = {}
+        for name in selected:
+            kind, factory = scenarios[name]
+            iterations = args.auth_iterations if 'login' in name else args.iterations
+            if kind == 'sequential':
+                results[name] = run_sequential(factory(), iterations)
+            else:
+                results[name] = run_concurrent(lambda w: factory(seed=w), args.workers,
+                                               max(1, iterations // args.workers))
+            print(f"{name}: {results[name]}", file=sys.stderr)
+        pages = bench.page_weight()
+        bench.db.stop_write_behind()
+
+        # Cold start and total memory of the prefork server, model shared vs loaded per worker
+        serving = {}
+        if args.serving_workers and sys.platform.startswith('linux'):
+            for name, preload in (('preload', True), ('no_preload', False)):
+                serving[name] = measure_serving(args.serving_workers, preload)
+                print(f"serving {name}: {serving[name]}", file=sys.stderr)
+
+        # serve.py and asgi.py over real HTTP, one process each
+        load = {}
+        levels = [int(n) for n in args.load_clients.split(',') if n.strip() and int(n)]
+        if levels:
+            load = measure_load(levels, args.load_requests, max(args.auth_iterations, 2 * max(levels)))
+
+        export = measure_export(args.export_rows, workdir) if args.export_rows else {}
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'config': vars(args),
+        },
+        'results': results,
+        'pages': pages,
+        'serving': serving,
+        'load': load,
+        'export': export,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(json.load(f), report), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import threading
+from typing import Any, NamedTuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import db
+from constants import KENYAN_COUNTIES, PROPERTY_TYPES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_K = 5
+MAX_K = 50
+
+# Listings are compared on (bedrooms, bathrooms, ln size_sqft) times these weights,
+# so a 25% difference in size counts as much as one bedroom or one bathroom
+WEIGHTS = np.array([1.0, 1.0, 1.0 / math.log(1.25)])
+
+# Rows added to a partition after its tree was built are searched by brute force;
+# past this many the tree is rebuilt
+MAX_PENDING = 256
+# Seconds between checks for rows added by other processes
+REFRESH_INTERVAL = 5.0
+CHUNK_SIZE = 50000
+
+_SELECT_ROWS = '''SELECT id, bedrooms, bathrooms, size_sqft, location, property_type, price
+                  FROM property_data
+                  WHERE id > ? AND price > 0 AND size_sqft > 0
+                  ORDER BY id'''
+
+
+class Partition(NamedTuple):
+    """The listings of one county and property type. Replaced, never modified."""
+    tree: Any           # cKDTree over points[:indexed]
+    indexed: int
+    points: np.ndarray  # (n, 3) weighted features
+    rows: np.ndarray    # (n, 4) bedrooms, bathrooms, size_sqft, price
+    ids: np.ndarray     # property_data ids, ascending
+
+
+def features(bedrooms, bathrooms, size_sqft):
+    """Weighted search coordinates; arguments may be scalars or arrays."""
+    return np.column_stack([np.asarray(bedrooms, dtype=np.float64),
+                            np.asarray(bathrooms, dtype=np.float64),
+                            np.log(np.asarray(size_sqft, dtype=np.float64))]) * WEIGHTS
+
+
+def _partition(points, rows, ids):
+    return Partition(cKDTree(points), len(ids), points, rows, ids)
+
+
+def _extend(partition, points, rows, ids):
+    points = np.concatenate([partition.points, points])
+    rows = np.concatenate([partition.rows, rows])
+    ids = np.concatenate([partition.ids, ids])
+    if len(ids) - partition.indexed > MAX_PENDING:
+        return _partition(points, rows, ids)
+    return partition._replace(points=points, rows=rows, ids=ids)
+
+
+def _read_rows(since_id=0, chunk_size=CHUNK_SIZE):
+    """Valid property_data rows with id > since_id, grouped by (location, property_type).
+
+    Returns {(location, property_type): (points, rows, ids)} and the largest id read.
+    """
+    ids, numeric, keys = [], [], []
+    with db.connection() as conn:
+        cursor = conn.execute(_SELECT_ROWS, (since_id,))
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            chunk_ids, bedrooms, bathrooms, size_sqft, location, property_type, price = zip(*chunk)
+            ids.append(np.asarray(chunk_ids, dtype=np.int64))
+            numeric.append(np.column_stack([bedrooms, bathrooms, size_sqft, price]).astype(np.float64))
+            keys.extend(zip(location, property_type))
+    if not ids:
+        return {}, since_id
+    ids = np.concatenate(ids)
+    numeric = np.concatenate(numeric)
+    # One stable sort by group keeps each group in id order
+    groups, inverse = np.unique(np.array([f'{loc}\x00{ptype}' for loc, ptype in keys]), return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.flatnonzero(np.diff(inverse[order])) + 1
+    grouped = {}
+    for group, members in zip(groups, np.split(order, bounds)):
+        rows = numeric[members]
+        grouped[tuple(group.split('\x00'))] = (features(rows[:, 0], rows[:, 1], rows[:, 2]), rows, ids[members])
+    return grouped, int(ids[-1])
+
+
+class ComparablesIndex:
+    """Nearest-neighbour search over property_data, one KD-tree per county and property type.
+
+    build() reads the table once. After that, rows with a higher id than
+    any seen are appended at most every `refresh_interval` seconds (or on
+    refresh()), by a background thread, so new listings from this or any
+    other process show up without a full rebuild. Queries never wait: they
+    read whichever set of partitions was swapped in last.
+    """
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._partitions = None
+        self._last_id = 0
+        self._lock = threading.Lock()          # held while reading property_data
+        self._state_lock = threading.Lock()    # guards the two flags below, never held for long
+        self._refreshing = False
+        self._refresh_again = False
+        self._last_check = 0.0
+        self.build_seconds = None
+
+    def build(self, if_missing=False):
+        """Index every row from scratch; also drops rows deleted since the last build."""
+        with self._lock:
+            if if_missing and self._partitions is not None:
+                return
+            started = time.perf_counter()
+            grouped, last_id = _read_rows()
+            self._partitions = {key: _partition(*group) for key, group in grouped.items()}
+            self._last_id = last_id
+            self._last_check = time.monotonic()
+            self.build_seconds = time.perf_counter() - started
+        logger.info("Comparables index built: %d rows in %d partitions, %.2fs",
+                    self.size(), len(self._partitions), self.build_seconds)
+
+    def _append_new_rows(self):
+        with self._lock:
+            grouped, last_id = _read_rows(self._last_id)
+            if grouped:
+                partitions = dict(self._partitions)
+                for key, (points, rows, ids) in grouped.items():
+                    current = partitions.get(key)
+                    partitions[key] = (_partition(points, rows, ids) if current is None
+                                       else _extend(current, points, rows, ids))
+                self._partitions = partitions
+                self._last_id = last_id
+            return sum(len(group[2]) for group in grouped.values())
+
+    def refresh(self, wait=True):
+        """Index rows added since the last build or refresh; returns how many (None if not waited on)."""
+        if self._partitions is None:
+            self.build(if_missing=True)
+            return self.size()
+        self._last_check = time.monotonic()
+        if wait:
+            return self._append_new_rows()
+        with self._state_lock:
+            if self._refreshing:
+                # Rows committed after the running refresh started its read get another pass
+                self._refresh_again = True
+                return None
+            self._refreshing = True
+
+        def run():
+            while True:
+                try:
+                    self._append_new_rows()
+                except Exception as e:
+                    logger.warning("Error refreshing comparables index: %s", e)
+                with self._state_lock:
+                    if not self._refresh_again:
+                        self._refreshing = False
+                        return
+                    self._refresh_again = False
+
+        threading.Thread(target=run, name='comparables-refresh', daemon=True).start()
+        return None
+
+    def query(self, location, property_type, bedrooms, bathrooms, size_sqft, k=DEFAULT_K):
+        """The k listings of this county and type closest to the given one, nearest first."""
+        if self._partitions is None:
+            self.build(if_missing=True)
+        elif time.monotonic() - self._last_check >= self.refresh_interval:
+            self.refresh(wait=False)
+        partition = self._partitions.get((location, property_type))
+        if partition is None or k < 1:
+            return []
+        distances, positions = _nearest(partition, features(bedrooms, bathrooms, size_sqft)[0], k)
+        rows = partition.rows[positions].tolist()
+        return [{'id': int(partition.ids[position]),
+                 'bedrooms': int(row[0]),
+                 'bathrooms': int(row[1]),
+                 'size_sqft': row[2],
+                 'price': row[3],
+                 'price_per_sqft': row[3] / row[2],
+                 'distance': round(float(distance), 4)}
+                for position, row, distance in zip(positions, rows, distances)]
+
+    def size(self):
+        return sum(len(p.ids) for p in (self._partitions or {}).values())
+
+    def stats(self):
+        partitions = self._partitions or {}
+        return {'rows': self.size(),
+                'partitions': len(partitions),
+                'pending': sum(len(p.ids) - p.indexed for p in partitions.values()),
+                'last_id': self._last_id,
+                'build_seconds': self.build_seconds}
+
+
+def _nearest(partition, point, k):
+    """(distances, positions) of the k nearest rows: tree hits plus the unindexed tail."""
+    k = min(k, len(partition.ids))
+    from_tree = min(k, partition.indexed)
+    # One extra neighbour shows whether others tie with the last one kept
+    distances, positions = partition.tree.query(point, k=min(from_tree + 1, partition.indexed))
+    distances, positions = np.atleast_1d(distances), np.atleast_1d(positions)
+    if len(positions) > from_tree and distances[from_tree] <= distances[from_tree - 1]:
+        # The tree picks arbitrarily among equally close rows; take them all so the newest wins below
+        positions = np.array(sorted(partition.tree.query_ball_point(point, distances[from_tree - 1])),
+                             dtype=np.int64)
+        distances = np.sqrt(((partition.points[positions] - point) ** 2).sum(axis=1))
+    else:
+        distances, positions = distances[:from_tree], positions[:from_tree]
+    tail = partition.points[partition.indexed:]
+    if len(tail):
+        distances = np.concatenate([distances, np.sqrt(((tail - point) ** 2).sum(axis=1))])
+        positions = np.concatenate([positions, np.arange(partition.indexed, len(partition.ids))])
+    # Nearest first; among equally close listings, the most recently added
+    order = np.lexsort((-partition.ids[positions], distances))[:k]
+    return distances[order], positions[order]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the comparables index and time queries against it.')
+    parser.add_argument('--db', default=db.DB_PATH, help='SQLite database with property_data')
+    parser.add_argument('--queries', type=int, default=10000, help='random queries to time')
+    parser.add_argument('-k', type=int, default=DEFAULT_K, help='comparables per query')
+    args = parser.parse_args()
+
+    db.configure(args.db)
+    index = ComparablesIndex()
+    index.build()
+    rng = random.Random(0)
+    queries = [(rng.choice(KENYAN_COUNTIES), rng.choice(PROPERTY_TYPES), rng.randint(1, 6),
+                rng.randint(1, 4), rng.uniform(400, 6000)) for _ in range(args.queries)]
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        index.query(*query, k=args.k)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    report = index.stats()
+    report.update({
+        'queries': len(latencies),
+        'p50_us': round(latencies[len(latencies) // 2] * 1e6, 1),
+        'p99_us': round(latencies[int(len(latencies) * 0.99)] * 1e6, 1),
+        'example': index.query(*queries[0], k=args.k),
+    })
+    json.dump(report, sys.stdout, indent=2)
+    print()
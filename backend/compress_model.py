@@ -1,47 +1,292 @@
+import os
+import sys
+import json
+import time
+import argparse
+import queue
+import tempfile
+import multiprocessing
+from typing import Any, NamedTuple
+
 import joblib
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.tree import DecisionTreeRegressor
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.model_selection import train_test_split
+
+import db
+from features import FeatureSchema
+from forest_eval import CompiledForest
+from model_registry import (DEFAULT_ENCODERS_DIR, MODEL_FILE, LOCATION_ENCODER_FILE,
+                            PROPERTY_ENCODER_FILE)
+from retrain import load_training_data, RetrainError
+
+# Settings of the forest that ships as rf_model_compressed_lvl2.pkl
+PRODUCTION_SETTINGS = {'n_estimators': 50, 'max_depth': 10, 'min_samples_leaf': 3}
+MIN_ROWS = 50
+# Seconds a measurement child may take before it is killed
+MEASURE_TIMEOUT = 300
+MEASURE_KEYS = ('load_ms', 'rss_mb', 'p50_us', 'p99_us')
+
+
+class Candidate(NamedTuple):
+    """One compressed variant of the original forest."""
+    name: str
+    strategy: str
+    n_trees: int
+    max_depth: Any
+    min_samples_leaf: Any
+    dtype: str
+    artifact: Any    # fitted RandomForestRegressor (pickled) or CompiledForest (.npz arrays)
+
+
+def distill(model, X_train, n_trees, max_depth, min_samples_leaf, random_state=42):
+    """Fit a smaller forest to reproduce the original model's predictions on real rows.
+
+    Larger min_samples_leaf merges leaves, which shrinks the trees.
+    """
+    student = RandomForestRegressor(n_estimators=n_trees, max_depth=max_depth,
+                                    min_samples_leaf=min_samples_leaf,
+                                    random_state=random_state, n_jobs=-1)
+    student.fit(X_train, model.predict(X_train))
+    student.set_params(n_jobs=None)
+    return student
+
+
+def build_candidates(model, X_train, trees, depths, leaves, strategies, float32):
+    forest = CompiledForest.from_sklearn(model)
+    candidates = [Candidate('original', 'original', forest.n_trees, forest.max_depth,
+                            model.min_samples_leaf, 'float64', model)]
+
+    for n_trees in trees:
+        for depth in depths:
+            label = depth if depth is not None else 'full'
+            if 'prune' in strategies:
+                # Keep the first n trees of the original and cut them at the depth cap
+                pruned = forest.truncated(n_trees=n_trees, max_depth=depth)
+                candidates.append(Candidate(f'prune-t{n_trees}-d{label}', 'prune', pruned.n_trees,
+                                            pruned.max_depth, None, 'float64', pruned))
+            if 'distill' in strategies:
+                for leaf in leaves:
+                    student = distill(model, X_train, n_trees, depth, leaf)
+                    candidates.append(Candidate(f'distill-t{n_trees}-d{label}-l{leaf}', 'distill',
+                                                n_trees, depth, leaf, 'float64', student))
+
+    if float32:
+        for c in list(candidates):
+            compiled = c.artifact if isinstance(c.artifact, CompiledForest) else CompiledForest.from_sklearn(c.artifact)
+            candidates.append(c._replace(name=c.name + '-f32', dtype='float32',
+                                         artifact=compiled.astype(np.float32)))
+    return candidates
+
+
+def save_candidate(candidate, out_dir, compress=3):
+    """Serialize a candidate the way it would be deployed; returns the file path."""
+    if isinstance(candidate.artifact, CompiledForest):
+        path = os.path.join(out_dir, candidate.name + '.npz')
+        candidate.artifact.save(path)
+    else:
+        path = os.path.join(out_dir, candidate.name + '.pkl')
+        joblib.dump(candidate.artifact, path, compress=compress)
+    return path
+
+
+def _rss_bytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _load_predictor(path, backend):
+    if path.endswith('.npz'):
+        return CompiledForest.load(path)
+    model = joblib.load(path)
+    return CompiledForest.from_sklearn(model) if backend == 'compiled' else model
+
+
+def _measure(path, backend, rows, results):
+    # Runs in a fresh process so load time and resident memory aren't skewed
+    # by artifacts the parent already holds. sklearn is imported up front so
+    # its module memory isn't counted against pickled candidates.
+    import gc
+    import sklearn.ensemble  # noqa: F401
+    gc.collect()
+    rss_before = _rss_bytes()
+    started = time.perf_counter()
+    predictor = _load_predictor(path, backend)
+    load_seconds = time.perf_counter() - started
+    gc.collect()
+    rss_after = _rss_bytes()
+
+    timings = []
+    for row in rows:
+        row = row.reshape(1, -1)
+        t0 = time.perf_counter()
+        predictor.predict(row)
+        timings.append(time.perf_counter() - t0)
+    timings = np.array(timings[min(10, len(timings) // 10):])  # drop warm-up calls
+    results.put({
+        'load_ms': load_seconds * 1000,
+        'rss_mb': (rss_after - rss_before) / 2**20 if rss_before is not None else None,
+        'p50_us': float(np.percentile(timings, 50) * 1e6),
+        'p99_us': float(np.percentile(timings, 99) * 1e6),
+    })
 
-def compress_model(input_path, output_path):
-    # Load the original model
-    print("Loading original model...")
+
+def measure(path, backend, rows, timeout=MEASURE_TIMEOUT):
+    """Load time, resident memory growth and single-row predict latency, measured in a child process.
+
+    Raises RuntimeError if the child dies before reporting or runs past `timeout` seconds.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(path, backend, rows, results))
+    process.start()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                return results.get(timeout=1.0)
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError(f"measuring {path} failed: child exited with code {process.exitcode}")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"measuring {path} took over {timeout}s")
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+def evaluate(candidate, X_test, y_test, reference):
+    predictions = candidate.artifact.predict(X_test)
+    return {
+        'r2': float(r2_score(y_test, predictions)),
+        'rmse': float(np.sqrt(mean_squared_error(y_test, predictions))),
+        'r2_vs_original': float(r2_score(reference, predictions)),
+        'rmse_vs_original': float(np.sqrt(mean_squared_error(reference, predictions))),
+    }
+
+
+def compare(model, X, y, trees=(20, 50), depths=(10, 16), leaves=(3,), strategies=('distill', 'prune'),
+            float32=False, backend='compiled', out_dir=None, compress=3, latency_rows=500, test_size=0.2):
+    """Build, save and measure compression candidates; returns one result dict per candidate."""
+    if len(y) < MIN_ROWS:
+        raise RetrainError(f"Need at least {MIN_ROWS} property rows to compress against, found {len(y)}")
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=42)
+    reference = model.predict(X_test)
+    out_dir = out_dir or tempfile.mkdtemp(prefix='smart-assets-compress-')
+    os.makedirs(out_dir, exist_ok=True)
+    rows = X_test[np.random.default_rng(0).integers(0, len(X_test), latency_rows)]
+
+    results = []
+    for candidate in build_candidates(model, X_train, trees, depths, leaves, strategies, float32):
+        path = save_candidate(candidate, out_dir, compress)
+        result = {
+            'name': candidate.name,
+            'strategy': candidate.strategy,
+            'trees': candidate.n_trees,
+            'max_depth': candidate.max_depth,
+            'min_samples_leaf': candidate.min_samples_leaf,
+            'dtype': candidate.dtype,
+            'path': path,
+            'disk_mb': os.path.getsize(path) / 2**20,
+        }
+        try:
+            result.update(measure(path, backend, rows))
+        except RuntimeError as e:
+            print(f"Could not measure {candidate.name}: {e}", file=sys.stderr)
+            result.update(dict.fromkeys(MEASURE_KEYS))
+        result.update(evaluate(candidate, X_test, y_test, reference))
+        results.append(result)
+        print(f"Measured {candidate.name}", file=sys.stderr)
+    return results
+
+
+def format_table(results):
+    columns = [('name', '{}'), ('disk_mb', '{:.2f}'), ('rss_mb', '{:.1f}'), ('load_ms', '{:.1f}'),
+               ('p50_us', '{:.0f}'), ('p99_us', '{:.0f}'), ('r2', '{:.4f}'), ('rmse', '{:,.0f}'),
+               ('r2_vs_original', '{:.4f}'), ('rmse_vs_original', '{:,.0f}')]
+    table = [[name for name, _ in columns]]
+    for result in results:
+        table.append([fmt.format(result[name]) if result[name] is not None else '-' for name, fmt in columns])
+    widths = [max(len(row[i]) for row in table) for i in range(len(columns))]
+    return '\n'.join('  '.join(cell.rjust(w) if i else cell.ljust(w) for i, (cell, w) in enumerate(zip(row, widths)))
+                     for row in table)
+
+
+def load_rows(encoders_dir):
+    location_encoder = joblib.load(os.path.join(encoders_dir, LOCATION_ENCODER_FILE))
+    property_encoder = joblib.load(os.path.join(encoders_dir, PROPERTY_ENCODER_FILE))
+    X, y, _ = load_training_data(FeatureSchema.from_encoders(location_encoder, property_encoder))
+    return X, y
+
+
+def compress_model(input_path, output_path, encoders_dir=DEFAULT_ENCODERS_DIR):
+    """Distill the model at input_path into the production-sized forest on real property rows."""
     model = joblib.load(input_path)
-    
     if not isinstance(model, RandomForestRegressor):
         raise ValueError("Model is not a RandomForestRegressor")
-    
-    # Create a new model with reduced parameters
-    print("Creating compressed model...")
-    compressed_model = RandomForestRegressor(
-        n_estimators=min(50, model.n_estimators),  # Reduce number of trees
-        max_depth=min(10, model.max_depth) if model.max_depth is not None else 10,  # Reduce tree depth
-        min_samples_split=5,  # Increase minimum samples to split
-        min_samples_leaf=3,   # Increase minimum samples in leaf
-        random_state=42
-    )
-    
-    # Get the training data from the original model
-    # Note: This assumes the model was trained with the same data structure
-    X = np.random.rand(100, 5)  # Placeholder data with same shape as training data
-    y = model.predict(X)
-    
-    # Train the compressed model
-    print("Training compressed model...")
-    compressed_model.fit(X, y)
-    
-    # Save the compressed model
-    print("Saving compressed model...")
-    joblib.dump(compressed_model, output_path, compress=3)  # Use maximum compression
-    
-    # Compare sizes
-    original_size = joblib.load(input_path).__sizeof__()
-    compressed_size = compressed_model.__sizeof__()
-    print(f"Original model size: {original_size / (1024*1024):.2f} MB")
-    print(f"Compressed model size: {compressed_size / (1024*1024):.2f} MB")
-    print(f"Compression ratio: {original_size/compressed_size:.2f}x")
+    X, y = load_rows(encoders_dir)
+    if len(y) < MIN_ROWS:
+        raise RetrainError(f"Need at least {MIN_ROWS} property rows to compress against, found {len(y)}")
+    student = distill(model, X, PRODUCTION_SETTINGS['n_estimators'], PRODUCTION_SETTINGS['max_depth'],
+                      PRODUCTION_SETTINGS['min_samples_leaf'])
+    joblib.dump(student, output_path, compress=3)
+    return student
+
+
+def _int_list(value, allow_none=False):
+    """Comma-separated positive integers; with allow_none, 'none' means no limit."""
+    values = []
+    for v in value.split(','):
+        v = v.strip()
+        if allow_none and v.lower() == 'none':
+            values.append(None)
+        elif v.isdigit() and int(v) > 0:
+            values.append(int(v))
+        else:
+            expected = "positive integers or 'none'" if allow_none else 'positive integers'
+            raise argparse.ArgumentTypeError(f"{v!r}: expected comma-separated {expected}")
+    return values
+
+
+def _limit_list(value):
+    return _int_list(value, allow_none=True)
+
 
 if __name__ == "__main__":
-    input_model = r"E:\Late-Night\Encoders\rf_model.pkl"
-    output_model = r"E:\Late-Night\Encoders\rf_model_compressed.pkl"
-    compress_model(input_model, output_model) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Compare compressed variants of the price model.')
+    parser.add_argument('--model', default=os.path.join(DEFAULT_ENCODERS_DIR, MODEL_FILE))
+    parser.add_argument('--encoders-dir', default=DEFAULT_ENCODERS_DIR)
+    parser.add_argument('--db', default=db.DB_PATH, help='SQLite database with property_data')
+    parser.add_argument('--trees', type=_int_list, default=[20, 50], help='comma-separated tree counts')
+    parser.add_argument('--max-depth', type=_limit_list, default=[10, 16],
+                        help="comma-separated depth caps ('none' for unlimited)")
+    parser.add_argument('--min-samples-leaf', type=_int_list, default=[3],
+                        help='comma-separated leaf sizes for distilled forests')
+    parser.add_argument('--strategies', default='distill,prune', help='distill, prune or both')
+    parser.add_argument('--float32', action='store_true', help='also try float32 thresholds and values')
+    parser.add_argument('--backend', default='compiled', choices=['compiled', 'sklearn'],
+                        help='predictor used for the latency measurement')
+    parser.add_argument('--compress', type=int, default=3, help='joblib compression level for pickles')
+    parser.add_argument('--out-dir', help='keep candidate artifacts here (default: a temp dir)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    db.configure(args.db)
+    model = joblib.load(args.model)
+    if not isinstance(model, RandomForestRegressor):
+        raise SystemExit("Model is not a RandomForestRegressor")
+    X, y = load_rows(args.encoders_dir)
+    results = compare(model, X, y, trees=args.trees, depths=args.max_depth, leaves=args.min_samples_leaf,
+                      strategies=args.strategies.split(','), float32=args.float32, backend=args.backend,
+                      out_dir=args.out_dir, compress=args.compress)
+    print(json.dumps(results, indent=2) if args.json else format_table(results))
@@ -0,0 +1,16 @@
+# List of all 47 Kenyan counties
+KENYAN_COUNTIES = [
+    'Baringo', 'Bomet', 'Bungoma', 'Busia', 'Elgeyo-Marakwet',
+    'Embu', 'Garissa', 'Homa Bay', 'Isiolo', 'Kajiado',
+    'Kakamega', 'Kericho', 'Kiambu', 'Kilifi', 'Kirinyaga',
+    'Kisii', 'Kisumu', 'Kitui', 'Kwale', 'Laikipia',
+    'Lamu', 'Machakos', 'Makueni', 'Mandera', 'Meru',
+    'Migori', 'Marsabit', 'Mombasa', 'Murang\'a', 'Nairobi',
+    'Nakuru', 'Nandi', 'Narok', 'Nyamira', 'Nyandarua',
+    'Nyeri', 'Samburu', 'Siaya', 'Taita-Taveta', 'Tana River',
+    'Tharaka-Nithi', 'Trans Nzoia', 'Turkana', 'Uasin Gishu',
+    'Vihiga', 'Wajir', 'West Pokot'
+]
+
+# Property types
+PROPERTY_TYPES = ['House', 'Apartment', 'Villa', 'Townhouse', 'Bungalow']
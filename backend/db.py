@@ -0,0 +1,526 @@
+import os
+import json
+import base64
+import logging
+import queue
+import time
+import sqlite3
+import atexit
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from contextlib import contextmanager
+
+from werkzeug.security import generate_password_hash
+
+from write_behind import WriteBehindQueue
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.environ.get('SMART_ASSETS_DB', os.path.join(BASE_DIR, 'users.db'))
+
+# Connections kept open per process; callers block briefly when all are busy
+POOL_SIZE = int(os.environ.get('SMART_ASSETS_DB_POOL_SIZE', 8))
+POOL_TIMEOUT = 10.0
+
+# Applied to every pooled connection. WAL lets readers run alongside a writer,
+# and synchronous=NORMAL is durable across application crashes in WAL mode.
+CONNECTION_PRAGMAS = (
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -16000',     # 16 MB page cache
+    'PRAGMA mmap_size = 134217728',   # 128 MB memory-mapped I/O
+    'PRAGMA temp_store = MEMORY',
+)
+
+# Size of sqlite3's per-connection prepared statement cache
+STATEMENT_CACHE_SIZE = 256
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by all threads in a process.
+
+    close() closes the idle connections. Ones borrowed at that moment still
+    count against `size`, and are closed instead of reused when they come
+    back, so the limit holds and nothing opened before close() is handed
+    out again (pre_fork relies on that).
+    """
+
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._generation = 0
+        self._opened_in = {}  # connection -> generation it was opened in
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                if self._created < self.size:
+                    conn = self._connect()
+                    self._created += 1
+                    self._opened_in[conn] = self._generation
+                    return conn
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise sqlite3.OperationalError('Timed out waiting for a database connection')
+            # Wake up now and then: a slot can also free up by a retired connection closing
+            try:
+                return self._idle.get(timeout=min(remaining, 0.1))
+            except queue.Empty:
+                pass
+
+    def release(self, conn):
+        # Never hand out a connection with a transaction left open
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if self._opened_in.get(conn) == self._generation:
+                self._idle.put(conn)
+                return
+            # Borrowed before close(): retire it
+            self._opened_in.pop(conn, None)
+            self._created -= 1
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            self._generation += 1
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                self._opened_in.pop(conn, None)
+                self._created -= 1
+                conn.close()
+
+
+_pool = ConnectionPool(DB_PATH)
+
+
+def configure(path, size=POOL_SIZE):
+    """Point the data-access layer at another database file."""
+    global _pool, DB_PATH
+    _pool.close()
+    DB_PATH = path
+    _pool = ConnectionPool(path, size)
+    clear_profile_cache()
+
+
+def close_connections():
+    """Close idle pooled connections; new ones are opened on demand.
+
+    Call this before fork() so no SQLite connection is shared with a child.
+    """
+    _pool.close()
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection for reads."""
+    pool = _pool  # return it to the same pool even if configure() swaps in another
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+@contextmanager
+def transaction():
+    """Borrow a pooled connection and commit on success, roll back on error."""
+    pool = _pool
+    conn = pool.acquire()
+    try:
+        with conn:
+            yield conn
+    finally:
+        pool.release(conn)
+
+
+# Audit rows (login history, single predictions) are written by a background
+# thread once start_write_behind() has been called; until then they are synchronous.
+_writer = None
+
+
+def start_write_behind(**options):
+    """Start the background writer for audit inserts; options go to WriteBehindQueue."""
+    global _writer
+    if _writer is None:
+        import market_stats
+        _writer = WriteBehindQueue(transaction, **options)
+        # Aggregate upkeep is a write too, so it runs on the writer thread rather than in a request
+        _writer.schedule(market_stats.compact_if_needed, market_stats.COMPACT_INTERVAL)
+        _writer.start()
+        atexit.register(stop_write_behind)
+    return _writer
+
+
+def stop_write_behind():
+    """Flush queued audit rows and stop the background writer."""
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+def write_behind_stats():
+    return _writer.stats() if _writer is not None else None
+
+
+def _execute_audit(sql, params):
+    if _writer is not None:
+        _writer.submit(sql, params)
+    else:
+        with transaction() as conn:
+            conn.execute(sql, params)
+
+
+# Schema
+HISTORY_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_predictions_user_created ON predictions (user_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_predictions_user_location ON predictions (user_id, location, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_predictions_user_type ON predictions (user_id, property_type, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_login_history_username_time ON login_history (username, login_time)',
+    'CREATE INDEX IF NOT EXISTS idx_login_history_time ON login_history (login_time)',
+)
+
+
+PREDICTION_ADDED_COLUMNS = (
+    ('predicted_std', 'REAL'),      # spread of the per-tree predictions
+    ('interval_low', 'REAL'),       # forest_eval.INTERVAL_QUANTILES of the per-tree predictions
+    ('interval_high', 'REAL'),
+)
+
+
+def init_db():
+    logger.info("Initializing database at: %s", DB_PATH)
+
+    with transaction() as c:
+        # Users table
+        c.execute('''CREATE TABLE IF NOT EXISTS users
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password TEXT NOT NULL,
+                    name TEXT,
+                    email TEXT,
+                    is_admin BOOLEAN DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_login TIMESTAMP)''')
+
+        # Login history table
+        c.execute('''CREATE TABLE IF NOT EXISTS login_history
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    username TEXT,
+                    login_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    ip_address TEXT,
+                    user_agent TEXT,
+                    success BOOLEAN,
+                    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE)''')
+
+        # Property data table
+        c.execute('''CREATE TABLE IF NOT EXISTS property_data
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    bedrooms INTEGER,
+                    bathrooms INTEGER,
+                    size_sqft REAL,
+                    location TEXT,
+                    property_type TEXT,
+                    price REAL,
+                    added_by INTEGER,
+                    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(added_by) REFERENCES users(id) ON DELETE CASCADE)''')
+
+        # Predictions table
+        c.execute('''CREATE TABLE IF NOT EXISTS predictions
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    location TEXT,
+                    property_type TEXT,
+                    bedrooms INTEGER,
+                    bathrooms INTEGER,
+                    size_sqft REAL,
+                    predicted_price REAL,
+                    predicted_std REAL,
+                    interval_low REAL,
+                    interval_high REAL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE)''')
+
+        # Columns added after the table was first created; older rows keep NULLs
+        columns = {row['name'] for row in c.execute('PRAGMA table_info(predictions)')}
+        for name, kind in PREDICTION_ADDED_COLUMNS:
+            if name not in columns:
+                c.execute(f'ALTER TABLE predictions ADD COLUMN {name} {kind}')
+
+        # History indexes. Every index ends in the rowid, so each one serves the keyset
+        # order (timestamp DESC, id DESC) directly; created once, on first start after upgrading
+        for statement in HISTORY_INDEXES:
+            c.execute(statement)
+
+        # Market statistics aggregates, kept current by triggers on the two tables above
+        from market_stats import create_schema
+        create_schema(c)
+
+        # Daily login counts that old login_history rows are rolled up into
+        import login_retention
+        login_retention.create_schema(c)
+
+        # Create admin user if not exists
+        admin_exists = c.execute("SELECT 1 FROM users WHERE username = 'admin'").fetchone()
+        if not admin_exists:
+            admin_password = generate_password_hash("admin123")
+            c.execute('INSERT INTO users (username, password, name, email, is_admin) VALUES (?, ?, ?, ?, ?)',
+                      ('admin', admin_password, 'Admin User', 'admin@example.com', 1))
+
+    logger.debug("Database initialization complete")
+
+
+# Users
+def get_user_by_username(username):
+    with connection() as conn:
+        user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+    return dict(user) if user else None
+
+
+def get_user_by_id(user_id):
+    with connection() as conn:
+        user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+    return dict(user) if user else None
+
+
+# Session users' profiles (no password hash), kept per process so page views
+# don't query users. This process updates its own copy on login; other workers
+# can show a last_login up to PROFILE_CACHE_TTL seconds old.
+PROFILE_CACHE_TTL = float(os.environ.get('SMART_ASSETS_PROFILE_CACHE_TTL', 300))
+PROFILE_CACHE_SIZE = 10000
+PROFILE_COLUMNS = ('id', 'username', 'name', 'email', 'is_admin', 'created_at', 'last_login')
+
+_profiles = OrderedDict()
+_profiles_lock = threading.Lock()
+
+
+def get_user_profile(user_id):
+    """Profile dict for user_id, or None, from the cache when it's fresh enough."""
+    now = time.monotonic()
+    with _profiles_lock:
+        cached = _profiles.get(user_id)
+        if cached is not None and now - cached[0] < PROFILE_CACHE_TTL:
+            _profiles.move_to_end(user_id)
+            return dict(cached[1])
+    with connection() as conn:
+        row = conn.execute(f"SELECT {', '.join(PROFILE_COLUMNS)} FROM users WHERE id = ?",
+                           (user_id,)).fetchone()
+    if row is None:
+        forget_user_profile(user_id)
+        return None
+    return cache_user_profile(row)
+
+
+def cache_user_profile(user):
+    """Store the profile columns of a users row (e.g. the one just checked at login)."""
+    profile = {column: user[column] for column in PROFILE_COLUMNS}
+    with _profiles_lock:
+        _profiles[profile['id']] = (time.monotonic(), profile)
+        _profiles.move_to_end(profile['id'])
+        while len(_profiles) > PROFILE_CACHE_SIZE:
+            _profiles.popitem(last=False)
+    return dict(profile)
+
+
+def _update_profile(user_id, **changes):
+    with _profiles_lock:
+        cached = _profiles.get(user_id)
+        if cached is not None:
+            cached[1].update(changes)
+
+
+def forget_user_profile(user_id):
+    with _profiles_lock:
+        _profiles.pop(user_id, None)
+
+
+def clear_profile_cache():
+    with _profiles_lock:
+        _profiles.clear()
+
+
+def create_user(name, email, username, password):
+    try:
+        with transaction() as conn:
+            # Check if username already exists
+            existing_user = conn.execute('SELECT 1 FROM users WHERE username = ?', (username,)).fetchone()
+            if existing_user:
+                logger.debug("Username %s already exists", username)
+                return False
+
+            # Insert new user
+            conn.execute('INSERT INTO users (name, email, username, password) VALUES (?, ?, ?, ?)',
+                         (name, email, username, generate_password_hash(password)))
+        return True
+    except sqlite3.Error as e:
+        logger.error("Database error in create_user: %s", e)
+        return False
+
+
+# Login history
+INSERT_LOGIN = '''INSERT INTO login_history
+                (user_id, username, login_time, ip_address, user_agent, success)
+                VALUES (?, ?, ?, ?, ?, ?)'''
+UPDATE_LAST_LOGIN = 'UPDATE users SET last_login = ? WHERE id = ?'
+
+
+def _timestamp():
+    # Same format as SQLite's CURRENT_TIMESTAMP, taken when the event happens
+    # rather than when a queued row is finally written
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def record_login(user_id, username, ip_address, user_agent, success=True):
+    now = _timestamp()
+    try:
+        _execute_audit(INSERT_LOGIN, (user_id, username, now, ip_address, user_agent, success))
+        if success and user_id:
+            _execute_audit(UPDATE_LAST_LOGIN, (now, user_id))
+            # Queued writes may land later; the cached profile shows the login now
+            _update_profile(user_id, last_login=now)
+    except sqlite3.Error as e:
+        logger.error("Error recording login: %s", e)
+
+
+# Predictions
+INSERT_PREDICTION = '''INSERT INTO predictions
+                     (user_id, location, property_type, bedrooms, bathrooms, size_sqft, predicted_price,
+                      predicted_std, interval_low, interval_high)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+INSERT_PREDICTION_AT = '''INSERT INTO predictions
+                        (user_id, location, property_type, bedrooms, bathrooms, size_sqft, predicted_price,
+                         predicted_std, interval_low, interval_high, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+
+
+def _optional_float(value):
+    return None if value is None else float(value)
+
+
+def insert_prediction(user_id, location, property_type, bedrooms, bathrooms, size_sqft, predicted_price,
+                      predicted_std=None, interval_low=None, interval_high=None):
+    _execute_audit(INSERT_PREDICTION_AT,
+                   (user_id, location, property_type, bedrooms, bathrooms, size_sqft, float(predicted_price),
+                    _optional_float(predicted_std), _optional_float(interval_low),
+                    _optional_float(interval_high), _timestamp()))
+
+
+def insert_predictions(rows):
+    """Insert many (user_id, location, property_type, bedrooms, bathrooms, size_sqft,
+    predicted_price, predicted_std, interval_low, interval_high) rows."""
+    with transaction() as conn:
+        conn.executemany(INSERT_PREDICTION, rows)
+
+
+# Property data
+INSERT_PROPERTY = '''INSERT INTO property_data
+                   (bedrooms, bathrooms, size_sqft, location, property_type, price, added_by)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)'''
+
+
+def insert_property(bedrooms, bathrooms, size_sqft, location, property_type, price, added_by):
+    with transaction() as conn:
+        conn.execute(INSERT_PROPERTY,
+                     (bedrooms, bathrooms, size_sqft, location, property_type, price, added_by))
+
+
+def insert_properties(rows):
+    """Insert many (bedrooms, bathrooms, size_sqft, location, property_type, price, added_by) rows in one transaction."""
+    with transaction() as conn:
+        conn.executemany(INSERT_PROPERTY, rows)
+
+
+# History pages, newest first, with keyset pagination: a page continues strictly
+# after the (timestamp, id) of the last row of the previous one, so the cost of a
+# page doesn't depend on how far into the history it is.
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    """Raised for a pagination cursor that wasn't produced by this module."""
+
+
+def encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(json.dumps([timestamp, row_id]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(timestamp, str) or not isinstance(row_id, int):
+        raise InvalidCursor('Invalid cursor')
+    return timestamp, row_id
+
+
+def _history_page(sql, where, params, time_column, limit, cursor):
+    limit = max(1, min(int(limit), MAX_HISTORY_PAGE_SIZE))
+    if cursor:
+        where.append(f'({time_column}, id) < (?, ?)')
+        params.extend(decode_cursor(cursor))
+    if where:
+        sql += f" WHERE {' AND '.join(where)}"
+    sql += f' ORDER BY {time_column} DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
+    with connection() as conn:
+        rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+    # The extra row only tells whether there is a next page
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][time_column], rows[-1]['id'])
+    return rows, next_cursor
+
+
+def get_prediction_history(user_id, limit=HISTORY_PAGE_SIZE, cursor=None, location=None, property_type=None):
+    """One page of a user's predictions; returns (rows, next_cursor or None)."""
+    where, params = ['user_id = ?'], [user_id]
+    if location is not None:
+        where.append('location = ?')
+        params.append(location)
+    if property_type is not None:
+        where.append('property_type = ?')
+        params.append(property_type)
+    sql = '''SELECT id, location, property_type, bedrooms, bathrooms, size_sqft, predicted_price,
+                    predicted_std, interval_low, interval_high, created_at
+             FROM predictions'''
+    return _history_page(sql, where, params, 'created_at', limit, cursor)
+
+
+def get_login_history(limit=HISTORY_PAGE_SIZE, cursor=None, username=None):
+    """One page of login attempts, optionally for one username; returns (rows, next_cursor or None)."""
+    where, params = [], []
+    if username is not None:
+        where.append('username = ?')
+        params.append(username)
+    sql = 'SELECT id, user_id, username, login_time, ip_address, user_agent, success FROM login_history'
+    return _history_page(sql, where, params, 'login_time', limit, cursor)
@@ -0,0 +1,230 @@
+import io
+import sys
+import csv
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+
+import db
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'ndjson', 'parquet')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Rows read per query, and per Parquet row group. Memory use depends on this, not on the table size.
+CHUNK_SIZE = 20000
+
+
+class ExportTable:
+    """Exported columns of a table and the columns its filters apply to."""
+
+    def __init__(self, name, columns, time_column, user_column):
+        self.name = name
+        self.columns = columns  # (name, parquet type), 'id' first
+        self.time_column = time_column
+        self.user_column = user_column
+
+    @property
+    def column_names(self):
+        return [name for name, _ in self.columns]
+
+
+TABLES = {
+    'predictions': ExportTable('predictions', [
+        ('id', 'int64'), ('user_id', 'int64'), ('location', 'string'), ('property_type', 'string'),
+        ('bedrooms', 'int64'), ('bathrooms', 'int64'), ('size_sqft', 'float64'),
+        ('predicted_price', 'float64'), ('predicted_std', 'float64'),
+        ('interval_low', 'float64'), ('interval_high', 'float64'), ('created_at', 'string'),
+    ], time_column='created_at', user_column='user_id'),
+    'property_data': ExportTable('property_data', [
+        ('id', 'int64'), ('bedrooms', 'int64'), ('bathrooms', 'int64'), ('size_sqft', 'float64'),
+        ('location', 'string'), ('property_type', 'string'), ('price', 'float64'),
+        ('added_by', 'int64'), ('added_at', 'string'),
+    ], time_column='added_at', user_column='added_by'),
+}
+
+
+class ExportError(ValueError):
+    """Raised for an unknown table or format, or an invalid filter."""
+
+
+def _timestamp(value, name):
+    try:
+        return datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        raise ExportError(f'{name} must be a date or timestamp (YYYY-MM-DD[ HH:MM:SS])')
+
+
+def build_query(table, since=None, until=None, user=None, location=None, property_type=None):
+    """SQL selecting one chunk of `table` after a given id, and its filter parameters.
+
+    `since` is inclusive and `until` exclusive; `user` is a username. The
+    statement takes (last_id, *params, chunk_size).
+    """
+    if table not in TABLES:
+        raise ExportError(f"Unknown table {table!r}; expected one of: {', '.join(TABLES)}")
+    spec = TABLES[table]
+    where, params = ['id > ?'], []
+    if since:
+        where.append(f'{spec.time_column} >= ?')
+        params.append(_timestamp(since, 'since'))
+    if until:
+        where.append(f'{spec.time_column} < ?')
+        params.append(_timestamp(until, 'until'))
+    if user:
+        found = db.get_user_by_username(user)
+        if found is None:
+            raise ExportError(f'Unknown user: {user}')
+        where.append(f'{spec.user_column} = ?')
+        params.append(found['id'])
+    if location:
+        where.append('location = ?')
+        params.append(location)
+    if property_type:
+        where.append('property_type = ?')
+        params.append(property_type)
+    sql = (f"SELECT {', '.join(spec.column_names)} FROM {table} "
+           f"WHERE {' AND '.join(where)} ORDER BY id LIMIT ?")
+    return sql, params
+
+
+def iter_chunks(query, chunk_size=CHUNK_SIZE, summary=None):
+    """Yield lists of row tuples in id order, at most chunk_size at a time; query is from build_query().
+
+    Each chunk is its own short query continuing after the last id seen, so
+    a slow client never holds a pooled connection or an open read
+    transaction (which would stop WAL checkpoints) for the whole export.
+    """
+    sql, params = query
+    last_id = 0
+    while True:
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None  # plain tuples
+            rows = cursor.execute(sql, (last_id, *params, chunk_size)).fetchall()
+        if not rows:
+            return
+        if summary is not None:
+            summary['rows'] = summary.get('rows', 0) + len(rows)
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
+def stream_csv(table, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TABLES[table].column_names)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def stream_ndjson(table, chunks):
+    names = TABLES[table].column_names
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    for rows in chunks:
+        yield ''.join(encode(dict(zip(names, row))) + '\n' for row in rows).encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last take()."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def stream_parquet(table, chunks):
+    """One Parquet row group per chunk, sent as soon as it's written."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    spec = TABLES[table]
+    schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in spec.columns])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression='snappy') as writer:
+        for rows in chunks:
+            columns = zip(*rows)
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema))
+            yield sink.take()
+    yield sink.take()
+
+
+def export(table, fmt='csv', chunk_size=CHUNK_SIZE, summary=None, **filters):
+    """Generator of encoded output chunks; `summary['rows']` counts rows as they're read.
+
+    The table, format and filters are checked before anything is produced,
+    so errors can still become an HTTP 400.
+    """
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format {fmt!r}; expected one of: {', '.join(FORMATS)}")
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ExportError('Parquet export needs the pyarrow package')
+    query = build_query(table, **filters)
+    writer = {'csv': stream_csv, 'ndjson': stream_ndjson, 'parquet': stream_parquet}[fmt]
+    return writer(table, iter_chunks(query, chunk_size, summary))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream predictions or property_data as CSV, NDJSON or Parquet.')
+    parser.add_argument('table', choices=sorted(TABLES))
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--output', '-o', help='file to write (default: stdout)')
+    parser.add_argument('--since', help='rows created at or after this date/timestamp')
+    parser.add_argument('--until', help='rows created before this date/timestamp')
+    parser.add_argument('--user', help='username that made the prediction or added the listing')
+    parser.add_argument('--location', help='county')
+    parser.add_argument('--property-type')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows per query')
+    parser.add_argument('--db', default=db.DB_PATH, help='SQLite database path')
+    args = parser.parse_args()
+
+    db.configure(args.db)
+    started = time.perf_counter()
+    written = 0
+    summary = {'table': args.table, 'format': args.format, 'rows': 0}
+    try:
+        chunks = export(args.table, args.format, args.chunk_size, summary, since=args.since, until=args.until,
+                        user=args.user, location=args.location, property_type=args.property_type)
+        out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+        with out:
+            for chunk in chunks:
+                out.write(chunk)
+                written += len(chunk)
+    except ExportError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    summary['bytes'] = written
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    print(json.dumps(summary), file=sys.stderr)
@@ -0,0 +1,110 @@
+import numpy as np
+
+from constants import KENYAN_COUNTIES, PROPERTY_TYPES
+
+# Model input columns, in the order the forest was trained on
+FEATURE_COLUMNS = ('bedrooms', 'bathrooms', 'size_sqft', 'location', 'property_type')
+LOCATION, PROPERTY_TYPE = 3, 4
+
+CATEGORY_LABELS = {'location': 'county', 'property_type': 'property type'}
+
+
+class UnknownCategoryError(ValueError):
+    """Raised when a county or property type isn't in the model's vocabulary."""
+
+    def __init__(self, column, value):
+        self.column = column
+        self.value = value
+        super().__init__(f"Unknown {CATEGORY_LABELS[column]}: {value!r}")
+
+
+class _Vocabulary:
+    """Category -> code lookups for one column.
+
+    `codes` serves single values from a dict; `sorted_classes` and
+    `sorted_codes` map whole arrays with one np.searchsorted. Categories
+    outside `allowed` are treated as unknown even if the encoder knows them.
+    """
+
+    def __init__(self, classes, allowed):
+        classes = np.asarray([str(c) for c in classes], dtype=str)
+        allowed = set(allowed)
+        self.codes = {c: i for i, c in enumerate(classes.tolist()) if c in allowed}
+        order = np.argsort(classes, kind='stable')
+        self.sorted_classes = classes[order]
+        self.sorted_codes = np.where(np.isin(self.sorted_classes, list(allowed)), order, np.nan)
+
+    def encode(self, values):
+        """Codes for an array of categories; NaN where a value is unknown."""
+        values = np.asarray(values, dtype=str)
+        if not len(self.sorted_classes) or not values.size:
+            return np.full(values.shape, np.nan)
+        positions = np.searchsorted(self.sorted_classes, values).clip(0, len(self.sorted_classes) - 1)
+        return np.where(self.sorted_classes[positions] == values, self.sorted_codes[positions], np.nan)
+
+
+class FeatureSchema:
+    """Column order and category encoding shared by training, the routes and batches.
+
+    Built from the fitted encoders of a model version, so every path turns
+    the same inputs into exactly the same feature rows. encode_row() handles
+    one listing; encode() handles columns of any length without a DataFrame.
+    """
+
+    columns = FEATURE_COLUMNS
+
+    def __init__(self, location_classes, property_classes,
+                 counties=KENYAN_COUNTIES, property_types=PROPERTY_TYPES):
+        self.location = _Vocabulary(location_classes, counties)
+        self.property_type = _Vocabulary(property_classes, property_types)
+
+    @classmethod
+    def from_encoders(cls, location_encoder, property_encoder, **vocabularies):
+        return cls(location_encoder.classes_, property_encoder.classes_, **vocabularies)
+
+    def encode_row(self, bedrooms, bathrooms, size_sqft, location, property_type):
+        """One listing as a (1, 5) feature matrix; raises UnknownCategoryError."""
+        location_code = self.location.codes.get(location)
+        if location_code is None:
+            raise UnknownCategoryError('location', location)
+        property_code = self.property_type.codes.get(property_type)
+        if property_code is None:
+            raise UnknownCategoryError('property_type', property_type)
+        return np.array([[bedrooms, bathrooms, size_sqft, location_code, property_code]], dtype=np.float64)
+
+    def encode(self, bedrooms, bathrooms, size_sqft, locations, property_types):
+        """Columns as an (n, 5) float matrix.
+
+        Numeric columns are taken as given (NaN for missing values) and
+        unknown categories are encoded as NaN; use validate() or known() to
+        find those rows.
+        """
+        X = np.empty((len(locations), len(FEATURE_COLUMNS)), dtype=np.float64)
+        X[:, 0] = bedrooms
+        X[:, 1] = bathrooms
+        X[:, 2] = size_sqft
+        X[:, LOCATION] = self.location.encode(locations)
+        X[:, PROPERTY_TYPE] = self.property_type.encode(property_types)
+        return X
+
+    @staticmethod
+    def known(X):
+        """Rows whose county and property type were both recognised."""
+        return ~np.isnan(X[:, LOCATION]) & ~np.isnan(X[:, PROPERTY_TYPE])
+
+    @staticmethod
+    def validate(X):
+        """Error message per row of an encoded matrix, None for rows that can be scored."""
+        errors = np.full(len(X), None, dtype=object)
+        bedrooms, bathrooms, size_sqft = X[:, 0], X[:, 1], X[:, 2]
+        # Later checks overwrite earlier ones, so list them from least to most specific
+        checks = [
+            (np.isnan(X[:, PROPERTY_TYPE]), 'Invalid property type'),
+            (np.isnan(X[:, LOCATION]), 'Invalid county'),
+            (~(size_sqft >= 1), 'size_sqft must be a number >= 1'),
+            (~(bathrooms >= 1) | (bathrooms % 1 != 0), 'bathrooms must be a whole number >= 1'),
+            (~(bedrooms >= 1) | (bedrooms % 1 != 0), 'bedrooms must be a whole number >= 1'),
+        ]
+        for mask, message in checks:
+            errors[mask] = message
+        return errors
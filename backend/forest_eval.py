@@ -0,0 +1,283 @@
+import os
+import sys
+import time
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+# Node marker sklearn uses for leaves in tree_.children_left / children_right
+TREE_LEAF = -1
+
+# Quantiles of the per-tree predictions reported as the prediction interval
+INTERVAL_QUANTILES = (0.1, 0.9)
+
+
+class TreeDistribution(NamedTuple):
+    """Spread of the individual tree predictions for each row.
+
+    `mean` is exactly the forest's point prediction; `quantiles` has one
+    column per entry of `levels`.
+    """
+    mean: np.ndarray
+    std: np.ndarray
+    quantiles: np.ndarray
+    levels: tuple
+
+
+@lru_cache(maxsize=32)
+def _quantile_positions(n, levels):
+    position = np.asarray(levels, dtype=np.float64) * (n - 1)
+    below = np.floor(position).astype(np.intp)
+    return below, np.minimum(below + 1, n - 1), position - below
+
+
+def tree_quantiles(tree_values, levels):
+    """Quantiles along axis 1 with linear interpolation (np.quantile's default), shape (n_rows, len(levels)).
+
+    One sort with cached interpolation indices; np.quantile's own overhead
+    is several times the cost of the sort for a single row.
+    """
+    values = np.sort(tree_values, axis=1)
+    below, above, fraction = _quantile_positions(values.shape[1], tuple(levels))
+    low = values[:, below]
+    return low + (values[:, above] - low) * fraction
+
+
+def tree_distribution(tree_values, levels=INTERVAL_QUANTILES):
+    """Mean, standard deviation and quantiles of an (n_rows, n_trees) matrix of tree predictions."""
+    mean = tree_values.mean(axis=1)
+    deviation = tree_values - mean[:, None]
+    # Population std, as np.std computes it, without its per-call overhead
+    std = np.sqrt(np.einsum('ij,ij->i', deviation, deviation) / tree_values.shape[1])
+    return TreeDistribution(mean, std, tree_quantiles(tree_values, levels), tuple(levels))
+
+
+def tree_values(predictor, X):
+    """Per-tree predictions, shape (n_rows, n_trees), from a CompiledForest or a fitted sklearn forest."""
+    if isinstance(predictor, CompiledForest):
+        return predictor.leaf_values(X)
+    # sklearn backend: one predict() per tree, so much slower than leaf_values()
+    X = np.asarray(X, dtype=np.float32)
+    return np.column_stack([estimator.predict(X) for estimator in predictor.estimators_])
+
+
+class CompiledForest:
+    """Array-backed evaluator for a fitted RandomForestRegressor.
+
+    All trees are flattened into one set of contiguous node arrays
+    (feature, threshold, left, right, value) with child indices made global,
+    so every tree can be walked at once with NumPy fancy indexing. Leaves
+    point to themselves, which lets a fixed number of steps (the deepest tree)
+    bring every row to its leaf without per-tree branching in Python.
+
+    predict() matches sklearn's RandomForestRegressor.predict: inputs are
+    cast to float32 before comparing against thresholds, exactly as the
+    sklearn tree code does.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.n_features = int(n_features)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Flatten the estimators of a fitted sklearn forest."""
+        features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            n = tree.node_count
+            node_ids = np.arange(offset, offset + n, dtype=np.int32)
+            is_leaf = tree.children_left == TREE_LEAF
+
+            # Leaves loop back to themselves; internal nodes get global child ids
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left + offset).astype(np.int32))
+            rights.append(np.where(is_leaf, node_ids, tree.children_right + offset).astype(np.int32))
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            values.append(tree.value[:, 0, 0].astype(np.float64))
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n
+
+        return cls(np.concatenate(features), np.concatenate(thresholds),
+                   np.concatenate(lefts), np.concatenate(rights),
+                   np.concatenate(values), np.asarray(roots, dtype=np.int32),
+                   max_depth, model.n_features_in_)
+
+    def _as_matrix(self, X):
+        # sklearn trees compare float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[1]} features, but the forest expects {self.n_features}")
+        return X.astype(np.float64)
+
+    def leaf_values(self, X):
+        """Leaf value reached in every tree, shape (n_rows, n_trees)."""
+        X = self._as_matrix(X)
+        if len(X) == 1:
+            return self._leaf_values_row(X[0])[None, :]
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), self.n_trees)).copy()
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.value[nodes]
+
+    def _leaf_values_row(self, x):
+        # Single-row fast path: 1-D take() avoids 2-D fancy indexing overhead
+        feature, threshold, left, right = self.feature, self.threshold, self.left, self.right
+        nodes = self.roots
+        for _ in range(self.max_depth):
+            go_left = x.take(feature.take(nodes)) <= threshold.take(nodes)
+            nodes = np.where(go_left, left.take(nodes), right.take(nodes))
+        return self.value.take(nodes)
+
+    def predict(self, X):
+        """Mean of the tree predictions, like RandomForestRegressor.predict."""
+        return self.leaf_values(X).mean(axis=1)
+
+    def predict_distribution(self, X, levels=INTERVAL_QUANTILES):
+        """Point prediction plus the spread of the tree predictions, from the same single pass."""
+        return tree_distribution(self.leaf_values(X), levels)
+
+    def node_depths(self):
+        """Depth of every node reachable from the roots; -1 for unreachable nodes."""
+        depth = np.full(self.n_nodes, -1, dtype=np.int32)
+        current = self.roots
+        for d in range(self.max_depth + 1):
+            depth[current] = d
+            internal = current[self.left[current] != current]
+            current = np.concatenate([self.left[internal], self.right[internal]])
+        return depth
+
+    def truncated(self, n_trees=None, max_depth=None):
+        """Copy keeping the first `n_trees` trees, each cut off at `max_depth`.
+
+        Internal nodes at the depth cap become leaves predicting their node
+        mean (sklearn stores a value for every node), and nodes that are no
+        longer reachable are dropped from the arrays.
+        """
+        roots = self.roots[:n_trees] if n_trees else self.roots
+        cap = self.max_depth if max_depth is None else min(max_depth, self.max_depth)
+        forest = CompiledForest(self.feature, self.threshold, self.left, self.right,
+                                self.value, roots, self.max_depth, self.n_features)
+        depth = forest.node_depths()
+        keep = (depth >= 0) & (depth <= cap)
+        new_id = np.cumsum(keep, dtype=np.int64) - 1
+        kept = np.flatnonzero(keep)
+        is_leaf = (self.left[kept] == kept) | (depth[kept] == cap)
+        self_ids = new_id[kept].astype(np.int32)
+        return CompiledForest(
+            np.where(is_leaf, 0, self.feature[kept]).astype(np.int32),
+            np.where(is_leaf, np.inf, self.threshold[kept]).astype(self.threshold.dtype),
+            np.where(is_leaf, self_ids, new_id[self.left[kept]]).astype(np.int32),
+            np.where(is_leaf, self_ids, new_id[self.right[kept]]).astype(np.int32),
+            self.value[kept],
+            new_id[roots].astype(np.int32),
+            cap, self.n_features)
+
+    def astype(self, dtype):
+        """Copy with thresholds and leaf values stored as `dtype` (e.g. float32)."""
+        return CompiledForest(self.feature, self.threshold.astype(dtype), self.left, self.right,
+                              self.value.astype(dtype), self.roots, self.max_depth, self.n_features)
+
+    def arrays(self):
+        """The node arrays and shape metadata, keyed by name."""
+        return {
+            'feature': self.feature, 'threshold': self.threshold,
+            'left': self.left, 'right': self.right, 'value': self.value, 'roots': self.roots,
+            'max_depth': np.asarray(self.max_depth), 'n_features': np.asarray(self.n_features),
+        }
+
+    def save(self, path):
+        """Write the node arrays to an uncompressed .npz file."""
+        np.savez(path, **self.arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['feature'], data['threshold'], data['left'], data['right'],
+                       data['value'], data['roots'], data['max_depth'], data['n_features'])
+
+
+def compile_forest(model):
+    """Build a CompiledForest, or return None for models it can't represent."""
+    if not hasattr(model, 'estimators_') or getattr(model, 'n_outputs_', 1) != 1:
+        return None
+    return CompiledForest.from_sklearn(model)
+
+
+def random_inputs(forest, n_samples=1000, seed=0):
+    """Random rows spanning the split thresholds of each feature."""
+    rng = np.random.default_rng(seed)
+    columns = []
+    for f in range(forest.n_features):
+        splits = forest.threshold[(forest.feature == f) & np.isfinite(forest.threshold)]
+        low, high = (splits.min(), splits.max()) if len(splits) else (0.0, 1.0)
+        margin = (high - low) * 0.1 + 1.0
+        columns.append(rng.uniform(low - margin, high + margin, n_samples))
+    return np.column_stack(columns)
+
+
+def check_parity(forest, model, n_samples=1000, seed=0, rtol=1e-9):
+    """Compare CompiledForest.predict with model.predict on random inputs.
+
+    Both the batch path and the single-row path are checked. Returns the
+    largest absolute difference; raises AssertionError when the two disagree
+    beyond rtol.
+    """
+    X = random_inputs(forest, n_samples, seed)
+    expected = model.predict(X)
+    actual = forest.predict(X)
+    # Replace the first rows with single-row results so that path is compared too
+    for i in range(min(16, len(X))):
+        actual[i] = forest.predict(X[i])[0]
+    max_diff = float(np.max(np.abs(expected - actual)))
+    if not np.allclose(expected, actual, rtol=rtol, atol=0):
+        raise AssertionError(f"Compiled forest differs from sklearn (max abs diff {max_diff})")
+    return max_diff
+
+
+def _time_per_call(fn, X, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(X)
+    return (time.perf_counter() - started) / repeat
+
+
+if __name__ == '__main__':
+    # Check parity and single-row latency against the model in Encoders/
+    import joblib
+    from model_registry import MODEL_FILE, DEFAULT_ENCODERS_DIR
+
+    encoders_dir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_ENCODERS_DIR
+    model = joblib.load(os.path.join(encoders_dir, MODEL_FILE))
+    forest = CompiledForest.from_sklearn(model)
+    print(f"Trees: {forest.n_trees}, nodes: {forest.n_nodes}, max depth: {forest.max_depth}")
+    print(f"Parity OK, max abs diff: {check_parity(forest, model, n_samples=5000)}")
+
+    row = random_inputs(forest, 1)
+    sklearn_s = _time_per_call(model.predict, row, 50)
+    compiled_s = _time_per_call(forest.predict, row, 500)
+    interval_s = _time_per_call(forest.predict_distribution, row, 500)
+    print(f"Single row: sklearn {sklearn_s * 1e6:.0f} us, compiled {compiled_s * 1e6:.0f} us, "
+          f"compiled with interval {interval_s * 1e6:.0f} us")
@@ -0,0 +1,252 @@
+import sys
+import json
+import time
+import logging
+import sqlite3
+import argparse
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+import db
+import market_stats
+from constants import KENYAN_COUNTIES, PROPERTY_TYPES
+from features import FeatureSchema
+
+logger = logging.getLogger(__name__)
+
+# Columns of property_data a file must provide, in insert order
+INGEST_COLUMNS = ['bedrooms', 'bathrooms', 'size_sqft', 'location', 'property_type', 'price']
+FORMATS = ('csv', 'parquet')
+
+# Rows validated and inserted per transaction
+CHUNK_SIZE = 10000
+# Rejected rows listed individually in the summary; the rest are only counted
+MAX_REPORTED_REJECTIONS = 100
+# Upper bounds for a plausible listing; also keep the integer casts in range
+MAX_ROOMS = 1000
+MAX_SIZE_SQFT = 1e7
+MAX_PRICE = 1e13
+
+# Validates against the full vocabularies, not a model version's encoders
+_schema = FeatureSchema(KENYAN_COUNTIES, PROPERTY_TYPES)
+# Case-insensitive spellings -> canonical category names
+_COUNTY_NAMES = {c.lower(): c for c in KENYAN_COUNTIES}
+_PROPERTY_TYPE_NAMES = {t.lower(): t for t in PROPERTY_TYPES}
+
+
+class IngestError(ValueError):
+    """Raised when a file can't be read at all (bad format, missing columns)."""
+
+
+def detect_format(filename=None, content_type=None):
+    name = (filename or '').lower()
+    if name.endswith(('.parquet', '.pq')) or 'parquet' in (content_type or '').lower():
+        return 'parquet'
+    return 'csv'
+
+
+def _normalize_header(columns):
+    return [str(c).strip().lower().replace(' ', '_') for c in columns]
+
+
+def _check_columns(columns):
+    missing = [c for c in INGEST_COLUMNS if c not in columns]
+    if missing:
+        raise IngestError(f'Missing columns: {", ".join(missing)}')
+
+
+def _csv_chunks(source, chunk_size):
+    try:
+        reader = pd.read_csv(source, chunksize=chunk_size, dtype=str, keep_default_na=False,
+                             skipinitialspace=True)
+        first = True
+        for chunk in reader:
+            chunk.columns = _normalize_header(chunk.columns)
+            if first:
+                _check_columns(chunk.columns)
+                first = False
+            yield chunk[INGEST_COLUMNS]
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise IngestError(f'Could not parse CSV: {e}')
+    except pd.errors.EmptyDataError:
+        raise IngestError('The file is empty')
+
+
+def _parquet_chunks(source, chunk_size):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise IngestError('Parquet files need the pyarrow package')
+    try:
+        parquet = pq.ParquetFile(source)
+    except Exception as e:
+        raise IngestError(f'Could not read Parquet file: {e}')
+    names = dict(zip(_normalize_header(parquet.schema_arrow.names), parquet.schema_arrow.names))
+    _check_columns(names)
+    batches = parquet.iter_batches(batch_size=chunk_size, columns=[names[c] for c in INGEST_COLUMNS])
+    while True:
+        try:
+            batch = next(batches, None)
+            if batch is None:
+                return
+            chunk = batch.to_pandas()
+        except Exception as e:
+            raise IngestError(f'Could not read Parquet file: {e}')
+        chunk.columns = INGEST_COLUMNS
+        yield chunk
+
+
+def iter_chunks(source, fmt='csv', chunk_size=CHUNK_SIZE):
+    """Read a path or binary file object in DataFrames of at most chunk_size rows.
+
+    Only the current chunk is held in memory. Parquet needs a seekable source.
+    """
+    if fmt not in FORMATS:
+        raise IngestError(f'Unsupported format: {fmt}')
+    if fmt == 'parquet':
+        return _parquet_chunks(source, chunk_size)
+    return _csv_chunks(source, chunk_size)
+
+
+def _categories(column, names):
+    # Strip and fix the case of known names; unknown values pass through and are rejected
+    values = column.astype(str).str.strip()
+    return values.str.lower().map(names).fillna(values)
+
+
+def normalize_chunk(chunk):
+    """Validate a raw chunk column-wise.
+
+    Returns (rows, errors): rows is a DataFrame of INGEST_COLUMNS with
+    numbers parsed and categories in canonical spelling, errors an object
+    array with a message for every rejected row and None for accepted ones.
+    """
+    rows = pd.DataFrame({
+        'bedrooms': pd.to_numeric(chunk['bedrooms'], errors='coerce'),
+        'bathrooms': pd.to_numeric(chunk['bathrooms'], errors='coerce'),
+        'size_sqft': pd.to_numeric(chunk['size_sqft'], errors='coerce'),
+        'location': _categories(chunk['location'], _COUNTY_NAMES),
+        'property_type': _categories(chunk['property_type'], _PROPERTY_TYPE_NAMES),
+        'price': pd.to_numeric(chunk['price'], errors='coerce'),
+    })
+    X = _schema.encode(rows['bedrooms'].to_numpy(dtype=float), rows['bathrooms'].to_numpy(dtype=float),
+                       rows['size_sqft'].to_numpy(dtype=float), rows['location'].to_numpy(dtype=str),
+                       rows['property_type'].to_numpy(dtype=str))
+    errors = _schema.validate(X)
+    unset = errors == None  # noqa: E711
+    limits = [('bedrooms', MAX_ROOMS), ('bathrooms', MAX_ROOMS), ('size_sqft', MAX_SIZE_SQFT)]
+    for column, limit in limits:
+        # NaN and inf fail the comparison too
+        too_big = ~(rows[column].to_numpy(dtype=float) <= limit) & unset
+        errors[too_big] = f'{column} must be at most {limit:g}'
+    price = rows['price'].to_numpy(dtype=float)
+    unset = errors == None  # noqa: E711
+    errors[~(price >= 1) & unset] = 'price must be a number >= 1'
+    errors[(price >= 1) & ~(price <= MAX_PRICE) & unset] = f'price must be at most {MAX_PRICE:g}'
+    return rows, errors
+
+
+def ingest(source, fmt='csv', added_by=None, chunk_size=CHUNK_SIZE, dry_run=False):
+    """Stream a CSV or Parquet file into property_data.
+
+    Every chunk is validated, then its accepted rows are inserted with one
+    executemany in one transaction; rejected rows are skipped. Returns a
+    summary with counts, rejections grouped by reason and the first
+    MAX_REPORTED_REJECTIONS rejected rows (0-based data row numbers).
+
+    A file that can't be read at all raises IngestError. If reading fails
+    after some chunks were inserted, or inserting a chunk fails, the chunks
+    before it stay inserted and the summary gets an 'error' with the reason
+    and an 'error_source' ('file' or 'database'), so the caller knows how
+    far it got.
+    """
+    started = time.perf_counter()
+    summary = {'rows': 0, 'accepted': 0, 'rejected': 0, 'chunks': 0}
+    reasons = Counter()
+    rejections = []
+
+    chunks = iter_chunks(source, fmt, chunk_size)
+    while True:
+        try:
+            chunk = next(chunks, None)
+        except IngestError as e:
+            if not summary['chunks']:
+                raise
+            summary['error'] = f'{e} (after row {summary["rows"]}; rows before it were imported)'
+            summary['error_source'] = 'file'
+            break
+        if chunk is None:
+            break
+        rows, errors = normalize_chunk(chunk)
+        accepted = errors == None  # noqa: E711 - elementwise comparison on an object array
+        if accepted.any():
+            valid = rows[accepted]
+            records = list(zip(valid['bedrooms'].astype(int).tolist(),
+                               valid['bathrooms'].astype(int).tolist(),
+                               valid['size_sqft'].astype(float).tolist(),
+                               valid['location'].tolist(),
+                               valid['property_type'].tolist(),
+                               valid['price'].astype(float).tolist(),
+                               [added_by] * len(valid)))
+            if not dry_run:
+                try:
+                    db.insert_properties(records)
+                except sqlite3.Error as e:
+                    # This chunk's transaction was rolled back; earlier ones are committed
+                    logger.error("Database error inserting rows %d-%d: %s",
+                                 summary['rows'], summary['rows'] + len(chunk) - 1, e)
+                    summary['error'] = (f'Database error at row {summary["rows"]}: {e} '
+                                        f'(rows before it were imported)')
+                    summary['error_source'] = 'database'
+                    break
+
+        rejected = np.flatnonzero(~accepted)
+        reasons.update(errors[rejected].tolist())
+        for offset in rejected[:max(0, MAX_REPORTED_REJECTIONS - len(rejections))]:
+            rejections.append({'row': summary['rows'] + int(offset), 'error': errors[offset]})
+
+        summary['rows'] += len(chunk)
+        summary['accepted'] += int(accepted.sum())
+        summary['rejected'] += len(rejected)
+        summary['chunks'] += 1
+
+    if summary['accepted'] and not dry_run:
+        # The triggers queued histogram deltas for every row; fold them in here, not on a read
+        try:
+            market_stats.compact_if_needed()
+        except sqlite3.Error as e:
+            # The rows are in; the deltas stay pending until the next compaction
+            logger.warning("Error compacting market stats after import: %s", e)
+    summary['reasons'] = dict(reasons)
+    summary['rejections'] = rejections
+    summary['dry_run'] = dry_run
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk-load listings into property_data.')
+    parser.add_argument('path', help='CSV or Parquet file')
+    parser.add_argument('--format', choices=FORMATS, help='default: from the file extension')
+    parser.add_argument('--added-by', default='admin', help='username recorded as the submitter')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows per transaction')
+    parser.add_argument('--db', default=db.DB_PATH, help='SQLite database path')
+    parser.add_argument('--dry-run', action='store_true', help='validate only, insert nothing')
+    args = parser.parse_args()
+
+    db.configure(args.db)
+    user = db.get_user_by_username(args.added_by)
+    if user is None:
+        raise SystemExit(f"Unknown user: {args.added_by}")
+    try:
+        result = ingest(args.path, args.format or detect_format(args.path), user['id'],
+                        args.chunk_size, args.dry_run)
+    except (IngestError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(result, indent=2))
+    if 'error' in result:
+        print(f"Error: {result['error']}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,109 @@
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import db
+
+# Raw login_history rows older than this are rolled up into login_history_daily
+RETENTION_DAYS = 90
+# Rows summarised and deleted per transaction, so writers are never blocked for long
+BATCH_SIZE = 5000
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS login_history_daily
+       (day TEXT NOT NULL,
+        username TEXT NOT NULL,
+        success BOOLEAN NOT NULL,
+        attempts INTEGER NOT NULL,
+        first_time TIMESTAMP NOT NULL,
+        last_time TIMESTAMP NOT NULL,
+        PRIMARY KEY (day, username, success)) WITHOUT ROWID''',
+]
+
+# The oldest rows before the cutoff, in login_time order (idx_login_history_time)
+_BATCH = '''SELECT id FROM login_history WHERE login_time < ? ORDER BY login_time, id LIMIT ?'''
+
+_SUMMARIZE = f'''
+    INSERT INTO login_history_daily (day, username, success, attempts, first_time, last_time)
+    SELECT date(login_time), COALESCE(username, ''), COALESCE(success, 0), COUNT(*),
+           MIN(login_time), MAX(login_time)
+    FROM login_history WHERE id IN ({_BATCH})
+    GROUP BY 1, 2, 3
+    ON CONFLICT (day, username, success) DO UPDATE SET
+        attempts = attempts + excluded.attempts,
+        first_time = MIN(first_time, excluded.first_time),
+        last_time = MAX(last_time, excluded.last_time)'''
+
+_DELETE = f'DELETE FROM login_history WHERE id IN ({_BATCH})'
+
+
+def create_schema(conn):
+    """Create the daily summary table; called from db.init_db()."""
+    for statement in SCHEMA:
+        conn.execute(statement)
+
+
+def cutoff_for(days, now=None):
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(days=days)).strftime('%Y-%m-%d 00:00:00')
+
+
+def compact(days=RETENTION_DAYS, batch_size=BATCH_SIZE, max_batches=None):
+    """Roll login_history rows older than `days` into daily per-username counts.
+
+    The cutoff is the start of a UTC day, so every summarised day is
+    complete. Each batch is summarised and deleted in its own transaction;
+    a run that stops midway leaves no row counted twice or lost. Returns
+    the number of rows removed and batches run.
+    """
+    cutoff = cutoff_for(days)
+    removed = batches = 0
+    while max_batches is None or batches < max_batches:
+        with db.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(_SUMMARIZE, (cutoff, batch_size))
+                deleted = conn.execute(_DELETE, (cutoff, batch_size)).rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        if not deleted:
+            break
+        removed += deleted
+        batches += 1
+    return {'cutoff': cutoff, 'removed': removed, 'batches': batches}
+
+
+def daily_summary(since=None, username=None):
+    """Summarised days, newest first, as dicts."""
+    where, params = [], []
+    if since is not None:
+        where.append('day >= ?')
+        params.append(since)
+    if username is not None:
+        where.append('username = ?')
+        params.append(username)
+    sql = 'SELECT day, username, success, attempts, first_time, last_time FROM login_history_daily'
+    if where:
+        sql += f" WHERE {' AND '.join(where)}"
+    with db.connection() as conn:
+        return [dict(row) for row in conn.execute(sql + ' ORDER BY day DESC, username', params)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarise and delete old login_history rows.')
+    parser.add_argument('--days', type=int, default=RETENTION_DAYS, help='keep raw rows this many days')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='rows per transaction')
+    parser.add_argument('--max-batches', type=int, help='stop after this many batches')
+    parser.add_argument('--db', default=db.DB_PATH, help='SQLite database path')
+    args = parser.parse_args()
+
+    db.configure(args.db)
+    started = time.perf_counter()
+    result = compact(args.days, args.batch_size, args.max_batches)
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    json.dump(result, sys.stdout, indent=2)
+    print()
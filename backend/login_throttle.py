@@ -0,0 +1,183 @@
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# (burst, refill seconds per attempt). An IP may try 20 times at once, then once
+# every 3 s. A username may fail 5 times from one IP, then once every 12 s; only
+# failures count, and only from that IP, so nobody else can lock a user out.
+IP_LIMIT = (20, 3.0)
+USERNAME_LIMIT = (5, 12.0)
+
+# Buckets kept by the in-memory store; least recently used ones are dropped first.
+# A dropped bucket comes back full, which only ever lets an attempt through early.
+MAX_MEMORY_KEYS = 100000
+
+
+def _refill(tokens, updated, now, burst, interval):
+    return min(burst, tokens + (now - updated) / interval)
+
+
+def _retry_after(tokens, interval):
+    return (1 - tokens) * interval
+
+
+def _limit(limit):
+    # (key, burst, interval[, cost]); a cost of 0 only checks that a token is there
+    key, burst, interval, *cost = limit
+    return key, burst, interval, cost[0] if cost else 1
+
+
+class MemoryBucketStore:
+    """Token buckets in a dict, for one process."""
+
+    path = None
+
+    def __init__(self, max_keys=MAX_MEMORY_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, limits, now):
+        """Take `cost` tokens from each (key, burst, interval[, cost]) bucket, or from none.
+
+        Every bucket must hold at least one token. Returns 0 when the
+        attempt is allowed, otherwise the seconds until every bucket has a
+        token again.
+        """
+        limits = [_limit(limit) for limit in limits]
+        with self._lock:
+            levels = []
+            for key, burst, interval, _ in limits:
+                tokens, updated = self._buckets.get(key, (burst, now))
+                levels.append(_refill(tokens, updated, now, burst, interval))
+            wait = max(_retry_after(tokens, interval)
+                       for tokens, (_, _, interval, _) in zip(levels, limits))
+            if wait > 0:
+                return wait
+            for tokens, (key, _, _, cost) in zip(levels, limits):
+                if cost:
+                    self._buckets[key] = (tokens - cost, now)
+                    self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteBucketStore:
+    """Token buckets in a SQLite file shared by all worker processes.
+
+    Each attempt reads and updates its buckets in one IMMEDIATE transaction,
+    so concurrent workers can't both spend the last token.
+    """
+
+    # Take calls between deletions of buckets that have refilled completely
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        conn = self._connection()
+        conn.execute('''CREATE TABLE IF NOT EXISTS login_throttle
+                        (key TEXT PRIMARY KEY,
+                        tokens REAL NOT NULL,
+                        updated REAL NOT NULL,
+                        full_at REAL NOT NULL) WITHOUT ROWID''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_login_throttle_full_at ON login_throttle (full_at)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def take(self, limits, now):
+        limits = [_limit(limit) for limit in limits]
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            levels = []
+            for key, burst, interval, _ in limits:
+                row = conn.execute('SELECT tokens, updated FROM login_throttle WHERE key = ?', (key,)).fetchone()
+                tokens, updated = row if row else (burst, now)
+                levels.append(_refill(tokens, updated, now, burst, interval))
+            wait = max(_retry_after(tokens, interval)
+                       for tokens, (_, _, interval, _) in zip(levels, limits))
+            if wait <= 0:
+                conn.executemany('INSERT OR REPLACE INTO login_throttle (key, tokens, updated, full_at) '
+                                 'VALUES (?, ?, ?, ?)',
+                                 [(key, tokens - cost, now, now + (burst - tokens + cost) * interval)
+                                  for tokens, (key, burst, interval, cost) in zip(levels, limits) if cost])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._takes += 1
+        if self._takes % self.PRUNE_EVERY == 0:
+            self.prune(now)
+        return max(wait, 0)
+
+    def prune(self, now=None):
+        """Delete buckets that are full again; they behave exactly like missing ones."""
+        conn = self._connection()
+        conn.execute('DELETE FROM login_throttle WHERE full_at <= ?', (now or time.time(),))
+
+
+class LoginThrottle:
+    """Token-bucket limiter for login attempts, keyed by client IP and by username.
+
+    Every attempt takes a token from its IP's bucket before the password is
+    checked, and also needs a token in the bucket of the username at that
+    IP; when either is empty the attempt is rejected without hashing or
+    writing login_history. The username bucket is only charged by failed()
+    after a wrong password, so a user who logs in correctly never uses it
+    up and guesses from one address can't lock out the user at another.
+    Pass a SQLiteBucketStore to share the buckets between worker processes.
+    """
+
+    def __init__(self, store=None, ip_limit=IP_LIMIT, username_limit=USERNAME_LIMIT):
+        self.store = store if store is not None else MemoryBucketStore()
+        self.ip_limit = ip_limit
+        self.username_limit = username_limit
+        self.allowed = 0
+        self.rejected = 0
+
+    @staticmethod
+    def _user_key(ip_address, username):
+        return f'user:{username.lower()}@{ip_address}'
+
+    def _take(self, limits):
+        try:
+            return self.store.take(limits, time.time())
+        except sqlite3.Error as e:
+            # Don't lock everyone out because the shared state is unavailable
+            logger.warning("Login throttle unavailable, allowing attempt: %s", e)
+            return 0
+
+    def attempt(self, ip_address, username):
+        """Seconds the caller must wait, or 0 if this attempt may go ahead."""
+        wait = self._take([('ip:' + str(ip_address), *self.ip_limit),
+                           (self._user_key(ip_address, username), *self.username_limit, 0)])
+        if wait > 0:
+            self.rejected += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def failed(self, ip_address, username):
+        """Charge a wrong password to the username's bucket for this IP."""
+        self._take([(self._user_key(ip_address, username), *self.username_limit)])
+
+    def stats(self):
+        return {'allowed': self.allowed, 'rejected': self.rejected, 'shared': self.store.path}
@@ -0,0 +1,347 @@
+import sys
+import json
+import time
+import argparse
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+# Aggregates per (source, location, property_type) for property_data listings
+# ('property') and model output ('prediction'). Counts and sums are exact;
+# medians come from log-scale histograms whose buckets are 2% wide, so any
+# quantile is within about 1% of the true value.
+SOURCES = {
+    'property': ('property_data', 'price'),
+    'prediction': ('predictions', 'predicted_price'),
+}
+METRICS = ('price', 'ppsf')    # price and price per square foot
+GROUP_COLUMNS = ('location', 'property_type')
+
+BUCKET_GAMMA = 1.02
+BUCKET_COUNT = 1400            # lower bounds 1 .. ~1e12
+BUCKET_LOWER = BUCKET_GAMMA ** np.arange(BUCKET_COUNT)
+
+REBUILD_CHUNK_SIZE = 100000
+# Pending histogram updates are folded into the packed sketches once there are this many,
+# checked every COMPACT_INTERVAL seconds by the write-behind thread and after each import
+COMPACT_THRESHOLD = 5000
+COMPACT_INTERVAL = 30.0
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS market_stats
+       (source TEXT NOT NULL,
+        location TEXT NOT NULL,
+        property_type TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        price_sum REAL NOT NULL DEFAULT 0,
+        ppsf_count INTEGER NOT NULL DEFAULT 0,
+        ppsf_sum REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (source, location, property_type)) WITHOUT ROWID''',
+    # One packed histogram per group and metric: int64 counts for buckets first_bucket, first_bucket + 1, ...
+    '''CREATE TABLE IF NOT EXISTS market_sketch
+       (source TEXT NOT NULL,
+        location TEXT NOT NULL,
+        property_type TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        first_bucket INTEGER NOT NULL,
+        counts BLOB NOT NULL,
+        PRIMARY KEY (source, location, property_type, metric)) WITHOUT ROWID''',
+    # Per-bucket changes written by the triggers since the last compaction
+    '''CREATE TABLE IF NOT EXISTS market_sketch_delta
+       (source TEXT NOT NULL,
+        location TEXT NOT NULL,
+        property_type TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (source, location, property_type, metric, bucket)) WITHOUT ROWID''',
+    # Bucket lower bounds, so triggers can find a value's bucket with one index seek
+    '''CREATE TABLE IF NOT EXISTS market_buckets
+       (bucket INTEGER PRIMARY KEY,
+        lower REAL NOT NULL)''',
+    'CREATE INDEX IF NOT EXISTS idx_market_buckets_lower ON market_buckets (lower)',
+]
+
+# Trigger bodies; {sign} is +1 for the NEW row and -1 for the OLD one
+_STATS_UPSERT = '''
+    INSERT INTO market_stats (source, location, property_type, count, price_sum, ppsf_count, ppsf_sum)
+    VALUES ('{source}', COALESCE({row}.location, ''), COALESCE({row}.property_type, ''), {sign},
+            {sign} * {row}.{price},
+            CASE WHEN {row}.size_sqft > 0 THEN {sign} ELSE 0 END,
+            CASE WHEN {row}.size_sqft > 0 THEN {sign} * {row}.{price} / {row}.size_sqft ELSE 0 END)
+    ON CONFLICT (source, location, property_type) DO UPDATE SET
+        count = count + excluded.count,
+        price_sum = price_sum + excluded.price_sum,
+        ppsf_count = ppsf_count + excluded.ppsf_count,
+        ppsf_sum = ppsf_sum + excluded.ppsf_sum;'''
+_DELTA_UPSERT = '''
+    INSERT INTO market_sketch_delta (source, location, property_type, metric, bucket, count)
+    SELECT '{source}', COALESCE({row}.location, ''), COALESCE({row}.property_type, ''), '{metric}', bucket, {sign}
+    FROM market_buckets WHERE lower <= {value} AND {value} > 0 ORDER BY lower DESC LIMIT 1
+    ON CONFLICT (source, location, property_type, metric, bucket) DO UPDATE SET count = count + excluded.count;'''
+
+
+# An update moves the row out of its old group and into its new one: two triggers,
+# each guarded by its own row's price
+_EVENTS = (
+    ('insert', 'INSERT', 'NEW', 1),
+    ('delete', 'DELETE', 'OLD', -1),
+    ('update_old', 'UPDATE OF {columns}', 'OLD', -1),
+    ('update_new', 'UPDATE OF {columns}', 'NEW', 1),
+)
+
+
+def _triggers():
+    for source, (table, price) in SOURCES.items():
+        columns = ', '.join((price, 'size_sqft') + GROUP_COLUMNS)
+        for name, event, row, sign in _EVENTS:
+            values = {'price': f'{row}.{price}',
+                      'ppsf': f'({row}.{price} / NULLIF({row}.size_sqft, 0))'}
+            body = _STATS_UPSERT.format(source=source, row=row, sign=sign, price=price)
+            body += ''.join(_DELTA_UPSERT.format(source=source, row=row, sign=sign, metric=metric,
+                                                 value=values[metric])
+                            for metric in METRICS)
+            yield (f'market_stats_{source}_{name}',
+                   f'CREATE TRIGGER IF NOT EXISTS market_stats_{source}_{name} '
+                   f'AFTER {event.format(columns=columns)} ON {table} WHEN {row}.{price} > 0 BEGIN{body}\nEND')
+
+
+def create_schema(conn):
+    """Create the aggregate tables and the triggers that keep them current.
+
+    Called from db.init_db(). A database that already has listings or
+    predictions when the tables or any of the triggers are first created
+    is backfilled, since rows changed before then were never counted.
+    """
+    existing = {name for name, in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND name LIKE 'market_stats%'")}
+    for statement in SCHEMA:
+        conn.execute(statement)
+    if conn.execute('SELECT COUNT(*) FROM market_buckets').fetchone()[0] != BUCKET_COUNT:
+        conn.execute('DELETE FROM market_buckets')
+        conn.executemany('INSERT INTO market_buckets (bucket, lower) VALUES (?, ?)',
+                         enumerate(BUCKET_LOWER.tolist()))
+    triggers = list(_triggers())
+    for _, trigger in triggers:
+        conn.execute(trigger)
+    if not {'market_stats'}.union(name for name, _ in triggers) <= existing:
+        _rebuild(conn)
+
+
+def bucket_of(values):
+    """Histogram bucket of each positive value (same rule as the triggers)."""
+    return np.searchsorted(BUCKET_LOWER, values, side='right') - 1
+
+
+def bucket_value(bucket):
+    """Value reported for a bucket: the geometric midpoint of its bounds."""
+    return BUCKET_GAMMA ** (bucket + 0.5)
+
+
+def _pack(histogram):
+    # Trim a dense histogram to its non-zero span
+    nonzero = np.flatnonzero(histogram)
+    if not len(nonzero):
+        return None
+    first = int(nonzero[0])
+    return first, histogram[first:nonzero[-1] + 1].astype(np.int64).tobytes()
+
+
+def _unpack_into(histogram, first, blob):
+    counts = np.frombuffer(blob, dtype=np.int64)
+    histogram[first:first + len(counts)] += counts
+
+
+def _write_sketches(conn, histograms):
+    for key, histogram in histograms.items():
+        packed = _pack(histogram)
+        if packed is None:
+            conn.execute('''DELETE FROM market_sketch
+                            WHERE source = ? AND location = ? AND property_type = ? AND metric = ?''', key)
+        else:
+            conn.execute('''INSERT OR REPLACE INTO market_sketch
+                            (source, location, property_type, metric, first_bucket, counts)
+                            VALUES (?, ?, ?, ?, ?, ?)''', key + packed)
+
+
+def _rebuild(conn, chunk_size=REBUILD_CHUNK_SIZE):
+    stats = defaultdict(lambda: np.zeros(4))
+    histograms = defaultdict(lambda: np.zeros(BUCKET_COUNT, dtype=np.int64))
+    for source, (table, price) in SOURCES.items():
+        sql = f'''SELECT COALESCE(location, '') AS location, COALESCE(property_type, '') AS property_type,
+                          {price} AS price, size_sqft
+                   FROM {table} WHERE {price} > 0'''
+        for chunk in pd.read_sql_query(sql, conn, chunksize=chunk_size):
+            sized = chunk['size_sqft'].fillna(0).to_numpy(dtype=float) > 0
+            chunk['ppsf_count'] = sized.astype(int)
+            chunk['ppsf'] = np.where(sized, chunk['price'] / chunk['size_sqft'].where(sized, 1), 0.0)
+            chunk['price_bucket'] = bucket_of(chunk['price'].to_numpy(dtype=float))
+            chunk['ppsf_bucket'] = bucket_of(chunk['ppsf'].to_numpy())
+
+            sums = chunk.groupby(list(GROUP_COLUMNS)).agg(
+                count=('price', 'size'), price_sum=('price', 'sum'),
+                ppsf_count=('ppsf_count', 'sum'), ppsf_sum=('ppsf', 'sum'))
+            for key, values in zip(sums.index, sums.to_numpy(dtype=float)):
+                stats[(source,) + key] += values
+            for metric, rows in (('price', chunk), ('ppsf', chunk[sized])):
+                # Values below the first bucket have no bucket (the triggers skip them too)
+                rows = rows[rows[f'{metric}_bucket'] >= 0]
+                for key, buckets in rows.groupby(list(GROUP_COLUMNS))[f'{metric}_bucket']:
+                    histograms[(source,) + key + (metric,)] += np.bincount(buckets, minlength=BUCKET_COUNT)
+
+    conn.execute('DELETE FROM market_stats')
+    conn.execute('DELETE FROM market_sketch')
+    conn.execute('DELETE FROM market_sketch_delta')
+    conn.executemany('''INSERT INTO market_stats
+                        (source, location, property_type, count, price_sum, ppsf_count, ppsf_sum)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     [key + (int(v[0]), float(v[1]), int(v[2]), float(v[3])) for key, v in stats.items()])
+    _write_sketches(conn, histograms)
+    return {'groups': len(stats), 'rows': int(sum(v[0] for v in stats.values()))}
+
+
+def _compact(conn):
+    deltas = conn.execute('''SELECT source, location, property_type, metric, bucket, count
+                             FROM market_sketch_delta''').fetchall()
+    histograms = {}
+    for source, location, property_type, metric, bucket, count in deltas:
+        key = (source, location, property_type, metric)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = np.zeros(BUCKET_COUNT, dtype=np.int64)
+            row = conn.execute('''SELECT first_bucket, counts FROM market_sketch
+                                  WHERE source = ? AND location = ? AND property_type = ? AND metric = ?''',
+                               key).fetchone()
+            if row is not None:
+                _unpack_into(histogram, *row)
+        histogram[bucket] += count
+    _write_sketches(conn, histograms)
+    conn.execute('DELETE FROM market_sketch_delta')
+    return {'deltas': len(deltas), 'sketches': len(histograms)}
+
+
+def _write_transaction(work):
+    import db
+    with db.connection() as conn:
+        # Take the write lock first so no insert lands between reading and replacing
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = work(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return result
+
+
+def rebuild(chunk_size=REBUILD_CHUNK_SIZE):
+    """Recompute every aggregate from the base tables in one write transaction."""
+    return _write_transaction(lambda conn: _rebuild(conn, chunk_size))
+
+
+def compact():
+    """Fold the per-bucket deltas written by the triggers into the packed sketches."""
+    return _write_transaction(_compact)
+
+
+def compact_if_needed(threshold=COMPACT_THRESHOLD):
+    """compact() once at least `threshold` deltas are pending; returns its result or None.
+
+    Called from write paths only (the write-behind thread, imports), never
+    from query(), so reads don't take the write lock.
+    """
+    import db
+    with db.connection() as conn:
+        pending = conn.execute('SELECT COUNT(*) FROM market_sketch_delta').fetchone()[0]
+    if pending < threshold:
+        return None
+    return compact()
+
+
+def _median(histogram):
+    if histogram is None:
+        return None
+    cumulative = np.cumsum(histogram)
+    if cumulative[-1] <= 0:
+        return None
+    return bucket_value(int(np.searchsorted(cumulative, cumulative[-1] * 0.5)))
+
+
+def query(source='property', group_by=GROUP_COLUMNS, location=None, property_type=None):
+    """Statistics per group, read from the aggregate tables only.
+
+    group_by is any subset of ('location', 'property_type'); groups are
+    merged by adding their counts, sums and histograms. Pending deltas are
+    added in as well, so the result is current without compacting; this
+    only reads. Returns a list of dicts sorted by count, largest first.
+    """
+    import db
+    if source not in SOURCES:
+        raise ValueError(f"Unknown source: {source}")
+    group_by = tuple(c for c in GROUP_COLUMNS if c in group_by)
+    where, params = ['source = ?'], [source]
+    for column, value in (('location', location), ('property_type', property_type)):
+        if value is not None:
+            where.append(f'{column} = ?')
+            params.append(value)
+    where = ' AND '.join(where)
+    positions = [GROUP_COLUMNS.index(c) for c in group_by]
+
+    with db.connection() as conn:
+        stats = conn.execute(f'''SELECT location, property_type, count, price_sum, ppsf_count, ppsf_sum
+                                 FROM market_stats WHERE {where}''', params).fetchall()
+        sketches = conn.execute(f'''SELECT location, property_type, metric, first_bucket, counts
+                                    FROM market_sketch WHERE {where}''', params).fetchall()
+        deltas = conn.execute(f'''SELECT location, property_type, metric, bucket, count
+                                  FROM market_sketch_delta WHERE {where}''', params).fetchall()
+
+    # Merge into one dense histogram per result group; a packed sketch is a slice-add
+    totals = defaultdict(lambda: np.zeros(4))
+    for row in stats:
+        totals[tuple(row[i] for i in positions)] += row[2:]
+    histograms = defaultdict(lambda: np.zeros(BUCKET_COUNT, dtype=np.int64))
+    for row in sketches:
+        _unpack_into(histograms[tuple(row[i] for i in positions) + (row[2],)], row[3], row[4])
+    for row in deltas:
+        histograms[tuple(row[i] for i in positions) + (row[2],)][row[3]] += row[4]
+
+    results = []
+    for key, (count, price_sum, ppsf_count, ppsf_sum) in totals.items():
+        if count <= 0:
+            continue
+        result = dict(zip(group_by, key))
+        result.update({
+            'count': int(count),
+            'mean_price': price_sum / count,
+            'median_price': _median(histograms.get(key + ('price',))),
+            'mean_price_per_sqft': ppsf_sum / ppsf_count if ppsf_count else None,
+            'median_price_per_sqft': _median(histograms.get(key + ('ppsf',))),
+        })
+        results.append(result)
+    results.sort(key=lambda r: r['count'], reverse=True)
+    return results
+
+
+if __name__ == '__main__':
+    import db
+
+    parser = argparse.ArgumentParser(description='Market statistics aggregates.')
+    parser.add_argument('--db', default=db.DB_PATH, help='SQLite database path')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('rebuild', help='recompute the aggregates from property_data and predictions')
+    subparsers.add_parser('compact', help='fold pending histogram updates into the sketches')
+    show = subparsers.add_parser('show', help='print statistics')
+    show.add_argument('--source', default='property', choices=list(SOURCES))
+    show.add_argument('--group-by', default='location,property_type')
+    args = parser.parse_args()
+
+    db.configure(args.db)
+    started = time.perf_counter()
+    if args.command in ('rebuild', 'compact'):
+        result = rebuild() if args.command == 'rebuild' else compact()
+        result['seconds'] = round(time.perf_counter() - started, 3)
+    else:
+        result = query(args.source, [c for c in args.group_by.split(',') if c])
+    json.dump(result, sys.stdout, indent=2)
+    print()
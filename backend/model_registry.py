@@ -0,0 +1,239 @@
+import os
+import logging
+import time
+import hashlib
+import threading
+from datetime import datetime
+from typing import Any, NamedTuple
+
+import joblib
+import numpy as np
+
+from forest_eval import compile_forest, random_inputs
+import model_store
+from features import FeatureSchema
+
+logger = logging.getLogger(__name__)
+
+# Directory holding the active artifacts (the repo's Encoders/ by default)
+DEFAULT_ENCODERS_DIR = os.environ.get(
+    'SMART_ASSETS_ENCODERS_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Encoders'))
+
+# Artifact file names inside the Encoders directory
+MODEL_FILE = 'rf_model_compressed_lvl2.pkl'
+LOCATION_ENCODER_FILE = 'location_encoder.joblib'
+PROPERTY_ENCODER_FILE = 'property_encoder.joblib'
+ARTIFACT_FILES = (MODEL_FILE, LOCATION_ENCODER_FILE, PROPERTY_ENCODER_FILE)
+
+# Prediction backends: 'compiled' walks flattened tree arrays, 'sklearn' calls model.predict
+BACKENDS = ('compiled', 'sklearn')
+
+
+class ModelBundle(NamedTuple):
+    """Immutable snapshot of everything a request needs to make a prediction.
+
+    Handlers should fetch a bundle once per request and use only that bundle,
+    so a reload that happens mid-request can never mix artifacts from two
+    different versions. `predictor` is what handlers should call predict() on;
+    it is either the compiled forest or the sklearn model itself. `model` is
+    None when the bundle was mapped from the memory-mapped export.
+    """
+    model: Any
+    location_encoder: Any
+    property_encoder: Any
+    schema: FeatureSchema   # feature order and category codes of this version
+    predictor: Any
+    backend: str
+    artifact_format: str    # 'mmap' or 'pickle'
+    version: str
+    loaded_at: datetime
+    load_seconds: float
+
+
+class ModelRegistry:
+    """Loads the forest and encoders once per process and hot-swaps them.
+
+    With the compiled backend the memory-mapped export in Encoders/forest_mmap/
+    is preferred when it exists and isn't older than the pickled model; it
+    loads without unpickling and its pages are shared by every process.
+
+    The first call to get() loads the artifacts synchronously. After that the
+    files are re-checked at most every `check_interval` seconds; when they
+    change, a background thread loads the new set and swaps the bundle
+    reference in one assignment. Requests keep using the old bundle until the
+    new one is ready, so in-flight predictions are never blocked by a reload.
+    """
+
+    def __init__(self, encoders_dir, check_interval=5.0, backend='compiled'):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown prediction backend: {backend}")
+        self.encoders_dir = encoders_dir
+        self.backend = backend
+        self.check_interval = check_interval
+        self._bundle = None
+        self._lock = threading.Lock()
+        self._reloading = False
+        self._last_check = 0.0
+        self._last_error = None
+        self.load_count = 0
+
+    def _path(self, name):
+        return os.path.join(self.encoders_dir, name)
+
+    def _use_mmap(self):
+        if self.backend != 'compiled':
+            return False
+        try:
+            manifest = os.stat(self._path(os.path.join(model_store.MMAP_DIR, model_store.MANIFEST_FILE)))
+        except OSError:
+            return False
+        try:
+            model = os.stat(self._path(MODEL_FILE))
+        except OSError:
+            return True
+        # A pickle written after the export (e.g. copied in by hand) wins
+        return manifest.st_mtime_ns >= model.st_mtime_ns
+
+    def _artifact_files(self, use_mmap):
+        if use_mmap:
+            # Array files are content-addressed, so the manifest alone identifies the set
+            return (os.path.join(model_store.MMAP_DIR, model_store.MANIFEST_FILE),)
+        return ARTIFACT_FILES
+
+    def fingerprint(self):
+        """Short hash of the artifact sizes and modification times."""
+        digest = hashlib.sha1()
+        for name in self._artifact_files(self._use_mmap()):
+            st = os.stat(self._path(name))
+            digest.update(f'{name}:{st.st_size}:{st.st_mtime_ns};'.encode())
+        return digest.hexdigest()[:12]
+
+    def _load(self):
+        version = self.fingerprint()
+        started = time.perf_counter()
+        if self._use_mmap():
+            predictor, location_encoder, property_encoder, _ = model_store.load(
+                self._path(model_store.MMAP_DIR))
+            model, backend, artifact_format = None, 'compiled', 'mmap'
+        else:
+            model = joblib.load(self._path(MODEL_FILE))
+            location_encoder = joblib.load(self._path(LOCATION_ENCODER_FILE))
+            property_encoder = joblib.load(self._path(PROPERTY_ENCODER_FILE))
+            predictor, backend = self._build_predictor(model)
+            artifact_format = 'pickle'
+        load_seconds = time.perf_counter() - started
+
+        # A writer may have replaced a file while we were reading; in that case
+        # the set we loaded is inconsistent, so refuse it and retry later.
+        if self.fingerprint() != version:
+            raise RuntimeError('Model artifacts changed while loading')
+
+        self.load_count += 1
+        schema = FeatureSchema.from_encoders(location_encoder, property_encoder)
+        return ModelBundle(model, location_encoder, property_encoder, schema, predictor, backend,
+                           artifact_format, version, datetime.now(), load_seconds)
+
+    def _build_predictor(self, model):
+        if self.backend == 'sklearn':
+            return model, 'sklearn'
+        try:
+            forest = compile_forest(model)
+            if forest is None:
+                raise ValueError(f"{type(model).__name__} can't be compiled")
+            # Parity with sklearn is covered by tests/test_forest_eval.py, not re-checked per load
+            return forest, 'compiled'
+        except Exception as e:
+            logger.warning("Falling back to sklearn prediction backend: %s", e)
+            return model, 'sklearn'
+
+    def get(self):
+        """Return the current bundle, loading it on first use."""
+        bundle = self._bundle
+        if bundle is None:
+            with self._lock:
+                if self._bundle is None:
+                    try:
+                        self._bundle = self._load()
+                        self._last_error = None
+                    except Exception as e:
+                        self._last_error = str(e)
+                        raise
+                    self._last_check = time.monotonic()
+                return self._bundle
+
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            self._maybe_reload(bundle)
+        return bundle
+
+    def warm_up(self, n_rows=256):
+        """Load the bundle and run it once on synthetic rows.
+
+        Touches every array the predictor reads, so in a prefork server the
+        pages are resident in the master before workers share them.
+        """
+        bundle = self.get()
+        if bundle.backend == 'compiled':
+            rows = random_inputs(bundle.predictor, n_rows)
+        else:
+            rows = np.zeros((n_rows, bundle.model.n_features_in_))
+        bundle.predictor.predict(rows)
+        bundle.predictor.predict(rows[:1])
+        bundle.schema.encode(rows[:1, 0], rows[:1, 1], rows[:1, 2],
+                             bundle.location_encoder.classes_[:1], bundle.property_encoder.classes_[:1])
+        return bundle
+
+    def _maybe_reload(self, bundle):
+        try:
+            changed = self.fingerprint() != bundle.version
+        except OSError:
+            # Files are being replaced right now; keep serving the old bundle
+            return
+        if changed:
+            self.reload(wait=False)
+
+    def reload(self, wait=True):
+        """Load the artifacts again and swap them in.
+
+        With wait=False the load runs on a background thread and this call
+        returns immediately; concurrent reload requests are collapsed into one.
+        """
+        with self._lock:
+            if self._reloading:
+                return False
+            self._reloading = True
+
+        def run():
+            try:
+                bundle = self._load()
+                self._bundle = bundle
+                self._last_error = None
+                logger.info("Model artifacts reloaded (version %s)", bundle.version)
+            except Exception as e:
+                self._last_error = str(e)
+                logger.error("Error reloading model artifacts: %s", e)
+            finally:
+                self._reloading = False
+
+        if wait:
+            run()
+        else:
+            threading.Thread(target=run, name='model-reload', daemon=True).start()
+        return True
+
+    def status(self):
+        """Version and load information for status pages."""
+        bundle = self._bundle
+        return {
+            'loaded': bundle is not None,
+            'version': bundle.version if bundle else None,
+            'backend': bundle.backend if bundle else None,
+            'artifact_format': bundle.artifact_format if bundle else None,
+            'loaded_at': bundle.loaded_at.isoformat() if bundle else None,
+            'load_seconds': round(bundle.load_seconds, 4) if bundle else None,
+            'load_count': self.load_count,
+            'reloading': self._reloading,
+            'last_error': self._last_error,
+        }
@@ -0,0 +1,199 @@
+import os
+import json
+import hashlib
+import argparse
+from datetime import datetime, timezone
+
+import numpy as np
+
+from forest_eval import CompiledForest
+
+# Memory-mapped export of the active model, kept next to the pickles in Encoders/
+MMAP_DIR = 'forest_mmap'
+MANIFEST_FILE = 'manifest.json'
+FORMAT_NAME = 'smart-assets-forest'
+FORMAT_VERSION = 1
+
+FOREST_ARRAYS = ('feature', 'threshold', 'left', 'right', 'value', 'roots')
+VOCABULARY_ARRAYS = ('location_classes', 'property_classes')
+
+
+class ArtifactError(ValueError):
+    """Raised when a memory-mapped export is missing, incompatible or corrupt."""
+
+
+class VocabularyEncoder:
+    """Drop-in for a fitted LabelEncoder's transform(), backed by its classes_ array.
+
+    Lets the serving path use the exported vocabularies without unpickling
+    (or importing) sklearn.
+    """
+
+    def __init__(self, classes):
+        self.classes_ = classes
+        self._codes = {c: i for i, c in enumerate(classes.tolist())}
+
+    def transform(self, values):
+        try:
+            return np.array([self._codes[v] for v in values], dtype=np.int64)
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"y contains previously unseen labels: {e}")
+
+
+def _sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _vocabulary(encoder):
+    # Fixed-width unicode so the array can be memory-mapped (object arrays can't)
+    return np.asarray([str(c) for c in encoder.classes_], dtype=str)
+
+
+def export(model, location_encoder, property_encoder, out_dir, source=None):
+    """Write the model and encoder vocabularies as uncompressed .npy files plus a manifest.
+
+    Array files are named by content hash and never overwritten, and the
+    manifest is replaced last with os.replace, so a process loading the
+    directory sees either the old set or the new one. Files the new manifest
+    no longer references are removed afterwards. Returns the manifest.
+    """
+    forest = model if isinstance(model, CompiledForest) else CompiledForest.from_sklearn(model)
+    arrays = {name: getattr(forest, name) for name in FOREST_ARRAYS}
+    arrays['location_classes'] = _vocabulary(location_encoder)
+    arrays['property_classes'] = _vocabulary(property_encoder)
+
+    os.makedirs(out_dir, exist_ok=True)
+    entries = {}
+    for name, array in arrays.items():
+        tmp = os.path.join(out_dir, f'.{name}.npy.tmp')
+        with open(tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array), allow_pickle=False)
+        checksum = _sha256(tmp)
+        filename = f'{name}-{checksum[:16]}.npy'
+        os.replace(tmp, os.path.join(out_dir, filename))
+        entries[name] = {'file': filename, 'dtype': array.dtype.str, 'shape': list(array.shape),
+                         'sha256': checksum}
+
+    manifest = {
+        'format': FORMAT_NAME,
+        'format_version': FORMAT_VERSION,
+        # Content version: changes exactly when any array changes
+        'version': hashlib.sha256(''.join(entries[n]['sha256'] for n in sorted(entries)).encode()).hexdigest()[:12],
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'source': source,
+        'n_trees': forest.n_trees,
+        'n_nodes': forest.n_nodes,
+        'max_depth': forest.max_depth,
+        'n_features': forest.n_features,
+        'arrays': entries,
+    }
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    referenced = {entry['file'] for entry in entries.values()}
+    for filename in os.listdir(out_dir):
+        if filename.endswith('.npy') and filename not in referenced:
+            os.remove(os.path.join(out_dir, filename))
+    return manifest
+
+
+def read_manifest(path):
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise ArtifactError(f"No {MANIFEST_FILE} in {path}")
+    except ValueError as e:
+        raise ArtifactError(f"Unreadable {manifest_path}: {e}")
+    if manifest.get('format') != FORMAT_NAME or manifest.get('format_version') != FORMAT_VERSION:
+        raise ArtifactError(f"{manifest_path} is {manifest.get('format')} v{manifest.get('format_version')}, "
+                            f"expected {FORMAT_NAME} v{FORMAT_VERSION}")
+    return manifest
+
+
+def verify(path, manifest=None):
+    """Recompute every array checksum; raises ArtifactError on the first mismatch."""
+    manifest = manifest or read_manifest(path)
+    for name, entry in manifest['arrays'].items():
+        if _sha256(os.path.join(path, entry['file'])) != entry['sha256']:
+            raise ArtifactError(f"Checksum mismatch for {name} ({entry['file']})")
+    return manifest
+
+
+def load(path, check_checksums=False):
+    """Map an export into memory; returns (forest, location_encoder, property_encoder, manifest).
+
+    Arrays are opened read-only with mmap, so loading costs a few page faults
+    and every process mapping the same files shares one copy in the OS page
+    cache. Shapes and dtypes are always checked against the manifest; the
+    full checksums (which read every byte) only when check_checksums is set.
+    """
+    manifest = read_manifest(path)
+    if check_checksums:
+        verify(path, manifest)
+    arrays = {}
+    for name in FOREST_ARRAYS + VOCABULARY_ARRAYS:
+        entry = manifest['arrays'].get(name)
+        if entry is None:
+            raise ArtifactError(f"Manifest in {path} has no {name} array")
+        try:
+            array = np.load(os.path.join(path, entry['file']), mmap_mode='r', allow_pickle=False)
+        except (OSError, ValueError) as e:
+            raise ArtifactError(f"Can't map {entry['file']}: {e}")
+        if array.dtype.str != entry['dtype'] or list(array.shape) != entry['shape']:
+            raise ArtifactError(f"{entry['file']} is {array.dtype.str}{list(array.shape)}, "
+                                f"manifest says {entry['dtype']}{entry['shape']}")
+        # Plain ndarray view of the mapping; skips np.memmap's per-operation overhead
+        arrays[name] = array.view(np.ndarray)
+
+    forest = CompiledForest(*(arrays[name] for name in FOREST_ARRAYS),
+                            manifest['max_depth'], manifest['n_features'])
+    return (forest, VocabularyEncoder(arrays['location_classes']),
+            VocabularyEncoder(arrays['property_classes']), manifest)
+
+
+def convert(encoders_dir, out_dir=None):
+    """Export the pickled model and encoders in encoders_dir to the memory-mapped format.
+
+    The export is checked against the pickled model's own predictions
+    before it is written.
+    """
+    import joblib
+    from forest_eval import check_parity
+    from model_registry import MODEL_FILE, LOCATION_ENCODER_FILE, PROPERTY_ENCODER_FILE
+
+    model_path = os.path.join(encoders_dir, MODEL_FILE)
+    model = joblib.load(model_path)
+    location_encoder = joblib.load(os.path.join(encoders_dir, LOCATION_ENCODER_FILE))
+    property_encoder = joblib.load(os.path.join(encoders_dir, PROPERTY_ENCODER_FILE))
+    forest = CompiledForest.from_sklearn(model)
+    check_parity(forest, model)
+    source = {'model': MODEL_FILE, 'sha256': _sha256(model_path)}
+    return export(forest, location_encoder, property_encoder,
+                  out_dir or os.path.join(encoders_dir, MMAP_DIR), source=source)
+
+
+if __name__ == '__main__':
+    from model_registry import DEFAULT_ENCODERS_DIR
+
+    parser = argparse.ArgumentParser(description='Convert and check the memory-mapped model export.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help='export the pickled model and encoders')
+    convert_parser.add_argument('--encoders-dir', default=DEFAULT_ENCODERS_DIR)
+    convert_parser.add_argument('--out-dir', help=f'default: <encoders-dir>/{MMAP_DIR}')
+    verify_parser = subparsers.add_parser('verify', help='check the manifest and array checksums')
+    verify_parser.add_argument('path', nargs='?', default=os.path.join(DEFAULT_ENCODERS_DIR, MMAP_DIR))
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        manifest = convert(args.encoders_dir, args.out_dir)
+    else:
+        manifest = verify(args.path)
+    print(json.dumps({k: v for k, v in manifest.items() if k != 'arrays'}, indent=2))
@@ -0,0 +1,200 @@
+import logging
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Shared entries older than this (or than the TTL, when one is set) are deleted
+# whenever a process sees a new model version
+SHARED_MAX_AGE = 24 * 3600
+
+
+def normalize_key(bedrooms, bathrooms, size_sqft, location, property_type):
+    """Canonical form of a prediction input, so equivalent queries share an entry.
+
+    Callers predict on the returned values, not the raw input, so every
+    request that maps to an entry gets exactly the price stored in it.
+    """
+    return (int(bedrooms), int(bathrooms), round(float(size_sqft), 2),
+            str(location).strip(), str(property_type).strip())
+
+
+class SQLiteCacheBackend:
+    """Prediction cache table in a SQLite file shared by all worker processes.
+
+    Each thread keeps its own connection in WAL mode, so
+    readers in one process never wait on a writer in another.
+    Values are stored as JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        columns = {row[1]: row for row in conn.execute('PRAGMA table_info(prediction_cache)')}
+        if columns and (columns['value'][2] != 'TEXT' or not columns['version'][5]):
+            # Older files held bare prices, or one row per input whatever the version;
+            # it's only a cache, so start over
+            conn.execute('DROP TABLE prediction_cache')
+        conn.execute('''CREATE TABLE IF NOT EXISTS prediction_cache
+                        (key TEXT NOT NULL,
+                        version TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        created REAL NOT NULL,
+                        PRIMARY KEY (key, version))''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_prediction_cache_created ON prediction_cache (created)')
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, version, min_created):
+        row = self._connection().execute(
+            'SELECT value FROM prediction_cache WHERE key = ? AND version = ? AND created >= ?',
+            (key, version, min_created)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, version, value):
+        conn = self._connection()
+        conn.execute('INSERT OR REPLACE INTO prediction_cache (key, version, value, created) VALUES (?, ?, ?, ?)',
+                     (key, version, json.dumps(value), time.time()))
+        conn.commit()
+
+    def prune(self, max_age):
+        """Drop entries older than max_age seconds, whatever their version.
+
+        Deleting by version instead would let workers part-way through a
+        rolling reload wipe each other's entries; keys include the version,
+        so old ones are never served, only left to age out.
+        """
+        conn = self._connection()
+        conn.execute('DELETE FROM prediction_cache WHERE created < ?', (time.time() - max_age,))
+        conn.commit()
+
+
+class PredictionCache:
+    """Bounded in-process LRU cache of predictions with optional TTL.
+
+    Entries are keyed by the normalized input tuple and the model version,
+    so a new model never serves an old price. The first lookup with a new
+    version also clears the local entries so they don't occupy space until
+    they age out, and prunes shared entries older than SHARED_MAX_AGE.
+    """
+
+    def __init__(self, max_entries=10000, ttl=None, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            if self._version is not None:
+                self._entries.clear()
+                self.invalidations += 1
+            self._version = version
+        if self.shared is not None:
+            try:
+                self.shared.prune(self.ttl or SHARED_MAX_AGE)
+            except sqlite3.Error as e:
+                logger.warning("Error pruning shared prediction cache: %s", e)
+
+    def get(self, version, key):
+        """Return the cached prediction for `key` under `version`, or None."""
+        self._check_version(version)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if self.ttl is None or now - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+
+        if self.shared is not None:
+            min_created = time.time() - self.ttl if self.ttl else 0
+            try:
+                value = self.shared.get(json.dumps(key), version, min_created)
+            except sqlite3.Error as e:
+                logger.warning("Error reading shared prediction cache: %s", e)
+                value = None
+            if value is not None:
+                value = tuple(value) if isinstance(value, list) else value
+                self.shared_hits += 1
+                self._store(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, version, key, value):
+        self._check_version(version)
+        self._store(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.put(json.dumps(key), version, value)
+            except sqlite3.Error as e:
+                logger.warning("Error writing shared prediction cache: %s", e)
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, version, key, compute):
+        """Cached value for `key`, calling compute() and storing the result on a miss.
+
+        Values must be JSON-serializable when a shared backend is configured
+        (a float, or a tuple of floats).
+        """
+        value = self.get(version, key)
+        if value is None:
+            value = compute()
+            self.put(version, key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'version': self._version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'shared_hits': self.shared_hits,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'shared': self.shared.path if self.shared is not None else None,
+        }
@@ -0,0 +1,253 @@
+import os
+import logging
+import json
+import shutil
+import argparse
+import threading
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+from joblib import parallel_config
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import LabelEncoder
+
+import db
+from constants import KENYAN_COUNTIES, PROPERTY_TYPES
+import model_store
+from features import FeatureSchema
+from model_registry import (DEFAULT_ENCODERS_DIR, MODEL_FILE, LOCATION_ENCODER_FILE,
+                            PROPERTY_ENCODER_FILE)
+
+logger = logging.getLogger(__name__)
+
+# Written next to the active artifacts and read by /ml/status
+METRICS_FILE = 'model_metrics.json'
+# Every trained artifact set is also kept under Encoders/versions/<version>/
+VERSIONS_DIR = 'versions'
+
+CHUNK_SIZE = 50000
+MIN_ROWS_FULL = 50
+MIN_ROWS_INCREMENTAL = 10
+
+FOREST_PARAMS = {'n_estimators': 100, 'min_samples_leaf': 2, 'random_state': 42}
+
+
+class RetrainError(ValueError):
+    """Raised when there isn't enough data to train."""
+
+
+def iter_property_rows(since_id=0, chunk_size=CHUNK_SIZE):
+    """Stream valid property_data rows with id > since_id in chunks.
+
+    Yields (ids, numeric, locations, property_types, prices) tuples of
+    NumPy arrays, one per chunk, so the table is never fetched in one go.
+    """
+    with db.connection() as conn:
+        cursor = conn.execute('''SELECT id, bedrooms, bathrooms, size_sqft, location, property_type, price
+                                 FROM property_data
+                                 WHERE id > ? AND price > 0 AND size_sqft > 0
+                                 ORDER BY id''', (since_id,))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            ids, bedrooms, bathrooms, size_sqft, location, property_type, price = zip(*rows)
+            yield (np.asarray(ids, dtype=np.int64),
+                   np.column_stack([bedrooms, bathrooms, size_sqft]).astype(np.float64),
+                   np.asarray(location, dtype=str),
+                   np.asarray(property_type, dtype=str),
+                   np.asarray(price, dtype=np.float64))
+
+
+def fit_encoders():
+    """Encoders over the full vocabularies, so codes stay stable between versions."""
+    return LabelEncoder().fit(KENYAN_COUNTIES), LabelEncoder().fit(PROPERTY_TYPES)
+
+
+def load_training_data(schema, since_id=0, chunk_size=CHUNK_SIZE):
+    """Build the (X, y) feature matrix from property_data, chunk by chunk.
+
+    Encoding goes through the same FeatureSchema the app predicts with. Rows
+    with a county or property type outside the vocabularies are skipped.
+    Returns (X, y, last_id).
+    """
+    X_parts, y_parts = [], []
+    last_id = since_id
+    for ids, numeric, locations, property_types, prices in iter_property_rows(since_id, chunk_size):
+        X = schema.encode(numeric[:, 0], numeric[:, 1], numeric[:, 2], locations, property_types)
+        valid = schema.known(X)
+        X_parts.append(X[valid])
+        y_parts.append(prices[valid])
+        last_id = int(ids[-1])
+    if not X_parts:
+        return np.empty((0, 5)), np.empty(0), last_id
+    return np.concatenate(X_parts), np.concatenate(y_parts), last_id
+
+
+def evaluate(model, X, y):
+    predictions = model.predict(X)
+    return {
+        'r2': float(r2_score(y, predictions)) if len(y) > 1 else None,
+        'rmse': float(np.sqrt(mean_squared_error(y, predictions))),
+        'mae': float(mean_absolute_error(y, predictions)),
+    }
+
+
+def read_metrics(encoders_dir=DEFAULT_ENCODERS_DIR):
+    path = os.path.join(encoders_dir, METRICS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _atomic_copy(src, dst):
+    tmp = dst + '.tmp'
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def publish(model, location_encoder, property_encoder, metrics, encoders_dir=DEFAULT_ENCODERS_DIR):
+    """Write a versioned artifact set and make it the active one.
+
+    The set is written to Encoders/versions/<version>/ first and then copied
+    over the active files one at a time with os.replace, encoders before the
+    model, so the model registry picks it up on its next check. The
+    memory-mapped export in Encoders/forest_mmap/ is refreshed last.
+    """
+    version_dir = os.path.join(encoders_dir, VERSIONS_DIR, metrics['version'])
+    os.makedirs(version_dir, exist_ok=True)
+    joblib.dump(location_encoder, os.path.join(version_dir, LOCATION_ENCODER_FILE))
+    joblib.dump(property_encoder, os.path.join(version_dir, PROPERTY_ENCODER_FILE))
+    joblib.dump(model, os.path.join(version_dir, MODEL_FILE), compress=3)
+    with open(os.path.join(version_dir, METRICS_FILE), 'w') as f:
+        json.dump(metrics, f, indent=2)
+
+    for name in (LOCATION_ENCODER_FILE, PROPERTY_ENCODER_FILE, MODEL_FILE, METRICS_FILE):
+        _atomic_copy(os.path.join(version_dir, name), os.path.join(encoders_dir, name))
+    model_store.export(model, location_encoder, property_encoder,
+                       os.path.join(encoders_dir, model_store.MMAP_DIR),
+                       source={'model': MODEL_FILE, 'version': metrics['version']})
+    return version_dir
+
+
+def retrain(incremental=False, add_trees=20, n_jobs=-1, backend='loky', test_size=0.2,
+            chunk_size=CHUNK_SIZE, encoders_dir=DEFAULT_ENCODERS_DIR, dry_run=False):
+    """Train a new model version from property_data and publish it.
+
+    A full run fits fresh encoders and a RandomForestRegressor on every row.
+    An incremental run loads the active model and adds `add_trees` trees
+    fitted only on rows added since the last version (warm_start), leaving
+    the existing trees untouched. Trees are fitted on a joblib process pool
+    (`backend='loky'`) with `n_jobs` workers. Returns the metrics dict.
+    """
+    previous = read_metrics(encoders_dir)
+    started = datetime.now(timezone.utc)
+
+    if incremental:
+        since_id = int(previous.get('last_property_id', 0))
+        model = joblib.load(os.path.join(encoders_dir, MODEL_FILE))
+        location_encoder = joblib.load(os.path.join(encoders_dir, LOCATION_ENCODER_FILE))
+        property_encoder = joblib.load(os.path.join(encoders_dir, PROPERTY_ENCODER_FILE))
+        min_rows = MIN_ROWS_INCREMENTAL
+    else:
+        since_id = 0
+        location_encoder, property_encoder = fit_encoders()
+        model = RandomForestRegressor(**FOREST_PARAMS)
+        min_rows = MIN_ROWS_FULL
+
+    schema = FeatureSchema.from_encoders(location_encoder, property_encoder)
+    X, y, last_id = load_training_data(schema, since_id, chunk_size)
+    if len(y) < min_rows:
+        raise RetrainError(f"Need at least {min_rows} new property rows to train, found {len(y)}")
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=42)
+
+    if incremental:
+        model.set_params(warm_start=True, n_estimators=len(model.estimators_) + add_trees, n_jobs=n_jobs)
+    else:
+        model.set_params(n_jobs=n_jobs)
+    with parallel_config(backend=backend, n_jobs=n_jobs):
+        model.fit(X_train, y_train)
+    # Don't carry training-time settings into serving
+    model.set_params(warm_start=False, n_jobs=None)
+
+    metrics = {
+        'version': started.strftime('v%Y%m%d%H%M%S') + f'{started.microsecond // 1000:03d}',
+        'parent_version': previous.get('version') if incremental else None,
+        'mode': 'incremental' if incremental else 'full',
+        'created_at': started.isoformat(),
+        'train_seconds': round((datetime.now(timezone.utc) - started).total_seconds(), 3),
+        'last_property_id': last_id,
+        'train_rows': int(len(y_train)),
+        'holdout_rows': int(len(y_test)),
+        'total_rows': int(previous.get('total_rows', 0)) + int(len(y)) if incremental else int(len(y)),
+        'n_estimators': len(model.estimators_),
+        'holdout': evaluate(model, X_test, y_test),
+    }
+    if not dry_run:
+        metrics['path'] = publish(model, location_encoder, property_encoder, metrics, encoders_dir)
+    return metrics
+
+
+class RetrainJob:
+    """Runs retrain() on a background thread, one run at a time."""
+
+    def __init__(self, encoders_dir=DEFAULT_ENCODERS_DIR):
+        self.encoders_dir = encoders_dir
+        self._lock = threading.Lock()
+        self._thread = None
+        self.state = 'idle'
+        self.last_result = None
+        self.last_error = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, **options):
+        with self._lock:
+            if self.running:
+                return False
+            self.state = 'running'
+            self._thread = threading.Thread(target=self._run, kwargs=options,
+                                            name='retrain', daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self, **options):
+        try:
+            self.last_result = retrain(encoders_dir=self.encoders_dir, **options)
+            self.last_error = None
+            self.state = 'succeeded'
+        except Exception as e:
+            logger.error("Retraining failed: %s", e)
+            self.last_error = str(e)
+            self.state = 'failed'
+
+    def status(self):
+        return {'state': self.state, 'last_result': self.last_result, 'last_error': self.last_error}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Retrain the price model from property_data.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='add trees fitted on rows added since the last version')
+    parser.add_argument('--add-trees', type=int, default=20, help='trees to add in an incremental run')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='worker processes for fitting trees')
+    parser.add_argument('--backend', default='loky', choices=['loky', 'threading'],
+                        help='joblib backend used to fit trees')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows fetched per query')
+    parser.add_argument('--encoders-dir', default=DEFAULT_ENCODERS_DIR)
+    parser.add_argument('--db', default=db.DB_PATH, help='SQLite database path')
+    parser.add_argument('--dry-run', action='store_true', help='train and score but do not publish')
+    args = parser.parse_args()
+
+    db.configure(args.db)
+    result = retrain(incremental=args.incremental, add_trees=args.add_trees, n_jobs=args.n_jobs,
+                     backend=args.backend, chunk_size=args.chunk_size,
+                     encoders_dir=args.encoders_dir, dry_run=args.dry_run)
+    print(json.dumps(result, indent=2))
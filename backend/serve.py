@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+
+from werkzeug.serving import make_server
+
+import wsgi
+
+logger = logging.getLogger('serve')
+
+
+def _raise_exit(signum, frame):
+    raise SystemExit(0)
+
+
+def run_worker(server, load_model):
+    """Body of a forked worker: serve from the shared socket until signalled."""
+    import db
+    # Workers forked after startup inherit the master's handlers; undo that
+    signal.signal(signal.SIGTERM, _raise_exit)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    status = 0
+    try:
+        wsgi.post_fork(load_model=load_model)
+        logger.info("Worker %d ready", os.getpid())
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    except Exception:
+        logger.exception("Worker %d failed", os.getpid())
+        status = 1
+    finally:
+        db.stop_write_behind()
+        logging.shutdown()
+    # Skip the master's atexit handlers and buffered state
+    os._exit(status)
+
+
+def serve(host='127.0.0.1', port=8000, workers=4, preload_model=True, threaded=True):
+    """Prefork server: initialize once in the master, then fork `workers` processes.
+
+    With preload_model the forest, encoders and compiled templates are loaded
+    and warmed in the master before forking, so every worker shares the same
+    physical pages instead of loading its own copy. Workers that exit
+    unexpectedly are replaced.
+    """
+    started = time.perf_counter()
+    # Workers are forked from here, so they share even a generated secret key
+    app = wsgi.create_app(preload_model=preload_model, write_behind=False, secret_key_shared=True)
+    server = make_server(host, port, app, threaded=threaded)
+
+    if workers <= 1 or not hasattr(os, 'fork'):
+        wsgi.post_fork()
+        logger.info("Serving on http://%s:%d in one process (ready in %.2fs)",
+                    host, server.port, time.perf_counter() - started)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    wsgi.pre_fork()
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            run_worker(server, load_model=not preload_model)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for _ in range(workers):
+        spawn()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info("Master %d serving on http://%s:%d with %d workers (ready in %.2fs)",
+                os.getpid(), host, server.port, workers, time.perf_counter() - started)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            logger.warning("Worker %d exited with status %d; starting a new one", pid, status)
+            spawn()
+    server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run Smart Assets with preforked worker processes.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--no-preload', action='store_true',
+                        help='load the model in every worker instead of once in the master')
+    parser.add_argument('--no-threads', action='store_true', help='handle one request at a time per worker')
+    parser.add_argument('--access-log', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    if not args.access_log:
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    serve(args.host, args.port, args.workers, preload_model=not args.no_preload,
+          threaded=not args.no_threads)
@@ -0,0 +1,58 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The backend modules import each other as top-level modules (import db, ...)
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# The app modules read these at import time, so set them before any test imports one.
+# Everything goes to a scratch directory; the checked-in users.db and Encoders/ are never touched.
+WORKDIR = tempfile.mkdtemp(prefix='smart-assets-tests-')
+os.environ['SMART_ASSETS_DB'] = os.path.join(WORKDIR, 'test.db')
+os.environ['SMART_ASSETS_ENCODERS_DIR'] = os.path.join(WORKDIR, 'Encoders')
+os.environ['SMART_ASSETS_WRITE_BEHIND'] = '0'      # audit rows are written before the response
+os.environ['SMART_ASSETS_LOGIN_THROTTLE'] = '0'    # tests that need it install their own
+os.environ['SMART_ASSETS_SECRET_KEY'] = 'test-secret-key'
+os.environ.pop('SMART_ASSETS_SHARED_CACHE', None)
+
+TEST_USER = ('tester', 'tester-password')
+ADMIN_USER = ('admin', 'admin123')  # created by init_db()
+
+
+@pytest.fixture(scope='session')
+def app():
+    """The Flask app over a small stand-in forest and a fresh database."""
+    from benchmark import build_stand_in
+    build_stand_in(os.environ['SMART_ASSETS_ENCODERS_DIR'], n_estimators=10, max_depth=6, n_rows=2000)
+    import wsgi
+    import db
+    app = wsgi.create_app(write_behind=False, secret_key_shared=True)
+    app.config['TESTING'] = True
+    db.create_user('Test User', 'tester@example.com', *TEST_USER)
+    return app
+
+
+def login(app, username, password):
+    client = app.test_client()
+    response = client.post('/login', data={'username': username, 'password': password})
+    assert response.status_code == 302, f'login as {username} failed'
+    return client
+
+
+@pytest.fixture
+def client(app):
+    """Logged in as an ordinary user."""
+    return login(app, *TEST_USER)
+
+
+@pytest.fixture
+def admin_client(app):
+    return login(app, *ADMIN_USER)
+
+
+@pytest.fixture
+def anonymous_client(app):
+    return app.test_client()
@@ -0,0 +1,181 @@
+import asyncio
+import json
+
+import pytest
+
+import asgi
+from conftest import TEST_USER
+
+ROW = {'bedrooms': 3, 'bathrooms': 2, 'size_sqft': 1500, 'location': 'Nairobi', 'property_type': 'House'}
+
+
+class Response:
+    def __init__(self, messages):
+        start = messages[0]
+        self.status = start['status']
+        self.headers = {key.decode(): value.decode() for key, value in start['headers']}
+        self.body = b''.join(message.get('body', b'') for message in messages[1:])
+
+    def json(self):
+        return json.loads(self.body)
+
+
+async def request(app, method, path, body=b'', headers=(), client=('127.0.0.1', 40000)):
+    """Drive one HTTP request through the ASGI app and collect the response."""
+    if isinstance(body, dict):
+        body = json.dumps(body).encode()
+        headers = [('content-type', 'application/json'), *headers]
+    scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path,
+             'root_path': '', 'query_string': b'', 'server': ('testserver', 80), 'client': client,
+             'headers': [(key.encode(), value.encode()) for key, value in headers]}
+    incoming = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        return incoming.pop(0) if incoming else {'type': 'http.disconnect'}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return Response(sent)
+
+
+@pytest.fixture
+def asgi_app(app):
+    async_app = asgi.AsyncApp(app, max_concurrency=4, hash_threads=2, inference_threads=2, wsgi_threads=2)
+    yield async_app
+    for pool in (async_app.hash_pool, async_app.inference_pool, async_app.fallback.pool):
+        pool.shutdown(wait=True)
+
+
+def login_cookie(asgi_app):
+    response = asyncio.run(request(asgi_app, 'POST', '/api/login',
+                                   {'username': TEST_USER[0], 'password': TEST_USER[1]}))
+    assert response.status == 200
+    return response.headers['set-cookie'].split(';')[0]
+
+
+def test_lifespan(app, monkeypatch):
+    import db
+    stopped = []
+    monkeypatch.setattr(db, 'stop_write_behind', lambda: stopped.append(True))
+    async_app = asgi.AsyncApp(app)
+    incoming = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    sent = []
+
+    async def receive():
+        return incoming.pop(0)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(async_app({'type': 'lifespan'}, receive, send))
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    assert stopped == [True]
+
+
+def test_login(asgi_app):
+    response = asyncio.run(request(asgi_app, 'POST', '/api/login',
+                                   {'username': TEST_USER[0], 'password': TEST_USER[1]}))
+    assert response.status == 200
+    assert response.json() == {'username': TEST_USER[0], 'is_admin': False}
+    assert 'HttpOnly' in response.headers['set-cookie']
+
+
+@pytest.mark.parametrize('body, status', [
+    ({'username': TEST_USER[0], 'password': 'wrong'}, 401),
+    ({'username': TEST_USER[0]}, 400),
+    (b'[1]', 400),
+    (b'not json', 400),
+])
+def test_login_rejected(asgi_app, body, status):
+    response = asyncio.run(request(asgi_app, 'POST', '/api/login', body))
+    assert response.status == status
+    assert 'set-cookie' not in response.headers
+
+
+def test_login_throttled(asgi_app, monkeypatch):
+    import vinnie
+    from login_throttle import LoginThrottle
+    monkeypatch.setattr(vinnie, 'login_throttle', LoginThrottle(ip_limit=(1, 30.0)))
+    body = {'username': TEST_USER[0], 'password': TEST_USER[1]}
+    assert asyncio.run(request(asgi_app, 'POST', '/api/login', body)).status == 200
+    response = asyncio.run(request(asgi_app, 'POST', '/api/login', body))
+    assert response.status == 429
+    assert int(response.headers['retry-after']) > 0
+
+
+def test_predict(asgi_app):
+    cookie = login_cookie(asgi_app)
+    response = asyncio.run(request(asgi_app, 'POST', '/api/predict', ROW, [('cookie', cookie)]))
+    assert response.status == 200
+    body = response.json()
+    assert body['interval_low'] <= body['predicted_price'] <= body['interval_high']
+    assert body['model_version']
+
+
+def test_predict_matches_flask(app, asgi_app, client):
+    cookie = login_cookie(asgi_app)
+    native = asyncio.run(request(asgi_app, 'POST', '/api/predict', ROW, [('cookie', cookie)])).json()
+    assert native == client.post('/api/predict', json=ROW).get_json()
+
+
+def test_predict_errors(asgi_app):
+    assert asyncio.run(request(asgi_app, 'POST', '/api/predict', ROW)).status == 401
+    cookie = login_cookie(asgi_app)
+    response = asyncio.run(request(asgi_app, 'POST', '/api/predict', dict(ROW, location='Atlantis'),
+                                   [('cookie', cookie)]))
+    assert response.status == 400
+    response = asyncio.run(request(asgi_app, 'POST', '/api/predict', dict(ROW, bedrooms=0),
+                                   [('cookie', cookie)]))
+    assert response.status == 400
+
+
+def test_flask_session_works_on_native_routes(app, asgi_app):
+    client = app.test_client()
+    client.post('/login', data={'username': TEST_USER[0], 'password': TEST_USER[1]})
+    cookie = client.get_cookie(app.config.get('SESSION_COOKIE_NAME', 'session'))
+    response = asyncio.run(request(asgi_app, 'POST', '/api/predict', ROW,
+                                   [('cookie', f'{cookie.key}={cookie.value}')]))
+    assert response.status == 200
+
+
+def test_other_routes_go_to_flask(asgi_app):
+    response = asyncio.run(request(asgi_app, 'GET', '/login'))
+    assert response.status == 200
+    assert response.headers['content-type'].startswith('text/html')
+    cookie = login_cookie(asgi_app)
+    response = asyncio.run(request(asgi_app, 'GET', '/api/predictions/history', headers=[('cookie', cookie)]))
+    assert response.status == 200
+
+
+def test_busy_server_returns_503_and_keeps_its_slots(app, monkeypatch):
+    monkeypatch.setattr(asgi, 'QUEUE_TIMEOUT', 0.05)
+    async_app = asgi.AsyncApp(app, max_concurrency=1)
+
+    async def scenario():
+        release = asyncio.Event()
+        original = async_app.routes[('POST', '/api/login')]
+
+        async def slow(scope, receive, send):
+            await release.wait()
+            return await original(scope, receive, send)
+
+        async_app.routes[('POST', '/api/login')] = slow
+        body = {'username': TEST_USER[0], 'password': TEST_USER[1]}
+        held = asyncio.create_task(request(async_app, 'POST', '/api/login', body))
+        await asyncio.sleep(0)
+        busy = await request(async_app, 'POST', '/api/login', body)
+        release.set()
+        return busy, await held
+
+    try:
+        busy, held = asyncio.run(scenario())
+        assert busy.status == 503 and busy.headers['retry-after'] == '1'
+        assert held.status == 200
+        assert async_app.rejected == 1 and async_app.in_flight == 0
+        assert async_app._slots._value == 1
+    finally:
+        async_app.close()
@@ -0,0 +1,108 @@
+import csv
+import io
+import json
+
+import pytest
+
+import batch_predict
+
+ROW = {'bedrooms': 3, 'bathrooms': 2, 'size_sqft': 1500, 'location': 'Nairobi', 'property_type': 'House'}
+
+
+def predictions_count():
+    import db
+    with db.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+
+
+def test_json_batch(client):
+    rows = [ROW, dict(ROW, bedrooms=5, location='Mombasa')]
+    response = client.post('/api/predict/batch', json=rows)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['summary']['rows'] == 2 and body['summary']['predicted'] == 2
+    for i, prediction in enumerate(body['predictions']):
+        assert prediction['row'] == i and prediction['error'] is None
+        assert prediction['interval_low'] <= prediction['predicted_price'] <= prediction['interval_high']
+
+
+def test_json_rows_object(client):
+    response = client.post('/api/predict/batch', json={'rows': [ROW]})
+    assert response.status_code == 200
+    assert response.get_json()['summary']['predicted'] == 1
+
+
+def test_csv_batch(client):
+    body = 'bedrooms,bathrooms,size_sqft,location,property_type\n3,2,1500,Nairobi,House\n2,1,800,Kisumu,Apartment\n'
+    response = client.post('/api/predict/batch', data=body, content_type='text/csv')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [row['row'] for row in rows] == ['0', '1']
+    assert all(float(row['predicted_price']) > 0 and not row['error'] for row in rows)
+
+
+def test_mixed_valid_and_invalid_rows(client):
+    rows = [ROW, dict(ROW, location='Atlantis'), dict(ROW, bedrooms=0), dict(ROW, size_sqft='big'), ROW]
+    before = predictions_count()
+    response = client.post('/api/predict/batch', json=rows)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['summary'] == dict(body['summary'], rows=5, predicted=2, errors=3)
+    errors = [p['error'] for p in body['predictions']]
+    assert errors[0] is None and errors[4] is None
+    assert 'county' in errors[1] and 'bedrooms' in errors[2] and 'size_sqft' in errors[3]
+    assert body['predictions'][1]['predicted_price'] is None
+    # Only the valid rows are recorded
+    assert predictions_count() - before == 2
+
+
+@pytest.mark.parametrize('data, content_type', [
+    (b'[1, 2, 3]', 'application/json'),
+    (b'["a"]', 'application/json'),
+    (b'{"rows": [null]}', 'application/json'),
+    (b'{"rows": 5}', 'application/json'),
+    (b'not json', 'application/json'),
+    (b'', 'application/json'),
+    (b'[{"bedrooms": 3}]', 'application/json'),
+    (b'bedrooms,bathrooms\n1,2\n', 'text/csv'),
+])
+def test_malformed_bodies(client, data, content_type):
+    response = client.post('/api/predict/batch', data=data, content_type=content_type)
+    assert response.status_code == 400
+    assert response.get_json()['error']
+
+
+def test_requires_login(anonymous_client):
+    assert anonymous_client.post('/api/predict/batch', json=[ROW]).status_code == 401
+
+
+def test_records_each_chunk_before_sending_it(client, monkeypatch):
+    monkeypatch.setattr(batch_predict, 'CHUNK_SIZE', 4)
+    monkeypatch.setattr(batch_predict.predict_batch, '__defaults__', (4,))
+    before = predictions_count()
+    response = client.post('/api/predict/batch', json=[ROW] * 10, buffered=False)
+    chunks = iter(response.response)
+    next(chunks)  # the opening bracket
+    next(chunks)  # first chunk of results
+    # A client that goes away now still leaves an audit row for what it was sent
+    assert predictions_count() - before == 4
+    response.close()
+    assert predictions_count() - before == 4
+
+
+def test_record_predictions_skips_invalid_rows():
+    import numpy as np
+    import pandas as pd
+    chunk = pd.DataFrame([ROW, ROW])
+    estimates = np.array([[1.0, 0.1, 0.5, 1.5], [np.nan] * 4])
+    errors = np.array([None, 'Invalid county'], dtype=object)
+    written = []
+    passed = list(batch_predict.record_predictions(7, [(0, chunk, estimates, errors)], written.append))
+    assert len(passed) == 1
+    assert written == [[(7, 'Nairobi', 'House', 3, 2, 1500.0, 1.0, 0.1, 0.5, 1.5)]]
+
+
+def test_read_batch_rejects_non_objects():
+    with pytest.raises(batch_predict.BatchInputError, match='row 1'):
+        batch_predict.read_batch(json.dumps([ROW, 2]).encode(), 'application/json')
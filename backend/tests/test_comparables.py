@@ -0,0 +1,177 @@
+import numpy as np
+import pytest
+
+import comparables
+import db
+from comparables import ComparablesIndex
+
+GROUPS = [('Nairobi', 'House'), ('Nairobi', 'Apartment'), ('Mombasa', 'House')]
+INSERT_NAIROBI_HOUSE = '''INSERT INTO property_data (bedrooms, bathrooms, size_sqft, location, property_type, price)
+                          VALUES (?, ?, ?, 'Nairobi', 'House', ?)'''
+
+
+@pytest.fixture
+def listings_db(app, tmp_path):
+    """A fresh database whose property_data only holds what the test adds."""
+    path = db.DB_PATH
+    db.configure(str(tmp_path / 'comparables.db'))
+    db.init_db()
+    yield
+    db.configure(path)
+
+
+def add_listings(n, seed, groups=GROUPS):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n):
+        location, property_type = groups[i % len(groups)]
+        rows.append((int(rng.integers(1, 6)), int(rng.integers(1, 4)), float(rng.uniform(400, 6000)),
+                     location, property_type, float(rng.uniform(2e6, 5e7))))
+    # Rows the index must skip
+    rows += [(3, 2, 0.0, 'Nairobi', 'House', 5e6), (3, 2, 1500.0, 'Nairobi', 'House', None)]
+    with db.transaction() as conn:
+        conn.executemany('INSERT INTO property_data (bedrooms, bathrooms, size_sqft, location, property_type, price) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+
+def brute_force(location, property_type, bedrooms, bathrooms, size_sqft, k):
+    """ids of the k nearest valid listings, ties broken by the newest id."""
+    with db.connection() as conn:
+        rows = conn.execute('''SELECT id, bedrooms, bathrooms, size_sqft FROM property_data
+                               WHERE location = ? AND property_type = ? AND price > 0 AND size_sqft > 0''',
+                            (location, property_type)).fetchall()
+    if not rows:
+        return []
+    ids, beds, baths, sizes = map(np.array, zip(*rows))
+    distances = np.sqrt(((comparables.features(beds, baths, sizes)
+                          - comparables.features(bedrooms, bathrooms, size_sqft)) ** 2).sum(axis=1))
+    order = np.lexsort((-ids, distances))[:k]
+    return ids[order].tolist()
+
+
+def queries(seed, n=40):
+    rng = np.random.default_rng(seed)
+    return [(*GROUPS[i % len(GROUPS)], int(rng.integers(1, 6)), int(rng.integers(1, 4)),
+             float(rng.uniform(400, 6000))) for i in range(n)]
+
+
+def assert_matches_brute_force(index, k=5):
+    for query in queries(seed=k):
+        found = index.query(*query, k=k)
+        assert [row['id'] for row in found] == brute_force(*query, k)
+        distances = [row['distance'] for row in found]
+        assert distances == sorted(distances)
+
+
+def test_one_tree_per_partition(listings_db):
+    add_listings(300, seed=0)
+    index = ComparablesIndex()
+    index.build()
+    assert set(index._partitions) == set(GROUPS)
+    for key, partition in index._partitions.items():
+        assert partition.indexed == len(partition.ids) == partition.tree.n == 100
+        assert list(partition.ids) == sorted(partition.ids)
+    assert index.stats() == dict(index.stats(), rows=300, partitions=3, pending=0)
+    assert_matches_brute_force(index)
+
+
+def test_results_stay_in_their_partition(listings_db):
+    add_listings(90, seed=1)
+    index = ComparablesIndex()
+    with db.connection() as conn:
+        groups = dict(((row[0]), (row[1], row[2])) for row in
+                      conn.execute('SELECT id, location, property_type FROM property_data'))
+    for location, property_type in GROUPS:
+        found = index.query(location, property_type, 3, 2, 1500, k=comparables.MAX_K)
+        assert len(found) == 30
+        assert {groups[row['id']] for row in found} == {(location, property_type)}
+    assert index.query('Kisumu', 'Villa', 3, 2, 1500) == []
+
+
+def test_pending_tail_is_merged_before_a_rebuild(listings_db, monkeypatch):
+    monkeypatch.setattr(comparables, 'MAX_PENDING', 40)
+    add_listings(60, seed=2)
+    index = ComparablesIndex(refresh_interval=3600)
+    index.build()
+    # New rows land in the brute-force tail, not in the tree
+    add_listings(60, seed=3)
+    assert index.refresh() == 60
+    for partition in index._partitions.values():
+        assert partition.indexed == 20 and len(partition.ids) == 40
+    assert index.stats()['pending'] == 60
+    for k in (1, 5, 25, 40, 50):
+        assert_matches_brute_force(index, k)
+
+    # An exact duplicate of an indexed listing: the newer one (in the tail) comes first
+    with db.connection() as conn:
+        old = conn.execute("SELECT bedrooms, bathrooms, size_sqft, price FROM property_data "
+                           "WHERE location = 'Nairobi' AND property_type = 'House' ORDER BY id LIMIT 1").fetchone()
+    with db.transaction() as conn:
+        new_id = conn.execute(INSERT_NAIROBI_HOUSE, tuple(old)).lastrowid
+    index.refresh()
+    found = index.query('Nairobi', 'House', *tuple(old)[:3], k=2)
+    assert found[0]['id'] == new_id and found[0]['distance'] == found[1]['distance'] == 0
+
+    # Past MAX_PENDING the partition's tree is rebuilt over every row
+    add_listings(90, seed=4)
+    index.refresh()
+    for partition in index._partitions.values():
+        assert partition.indexed == len(partition.ids) == partition.tree.n
+    assert index.stats()['pending'] == 0
+    assert_matches_brute_force(index)
+
+
+def test_ties_inside_the_tree_prefer_the_newest(listings_db):
+    with db.transaction() as conn:
+        conn.executemany(INSERT_NAIROBI_HOUSE, [(3, 2, 1500.0, 1e6 * i) for i in range(1, 9)] + [(5, 3, 4000.0, 9e6)])
+    index = ComparablesIndex()
+    index.build()
+    for k in (1, 3, 8, 9):
+        found = index.query('Nairobi', 'House', 3, 2, 1500, k=k)
+        assert [row['id'] for row in found] == [8, 7, 6, 5, 4, 3, 2, 1, 9][:k]
+
+
+def test_new_partition_from_a_refresh(listings_db):
+    add_listings(30, seed=5)
+    index = ComparablesIndex()
+    index.build()
+    add_listings(4, seed=6, groups=[('Kisumu', 'Villa')])
+    assert index.query('Kisumu', 'Villa', 3, 2, 1500) == []
+    index.refresh()
+    assert len(index.query('Kisumu', 'Villa', 3, 2, 1500, k=10)) == 4
+
+
+def test_build_drops_deleted_rows(listings_db):
+    add_listings(30, seed=7)
+    index = ComparablesIndex()
+    index.build()
+    with db.transaction() as conn:
+        conn.execute("DELETE FROM property_data WHERE location = 'Mombasa'")
+    index.build()
+    assert index.query('Mombasa', 'House', 3, 2, 1500) == []
+    assert index.size() == 20
+
+
+@pytest.mark.parametrize('k, expected', [(0, 0), (-3, 0), (1, 1), (10, 10), (15, 10), (comparables.MAX_K, 10)])
+def test_k_limits_on_the_index(listings_db, k, expected):
+    add_listings(30, seed=8)
+    index = ComparablesIndex()
+    assert len(index.query('Nairobi', 'House', 3, 2, 1500, k=k)) == expected
+
+
+LISTING = {'bedrooms': 3, 'bathrooms': 2, 'size_sqft': 1500, 'location': 'Nairobi', 'property_type': 'House'}
+
+
+@pytest.mark.parametrize('k', ['0', '-1', str(comparables.MAX_K + 1), 'five', '2.5', ''])
+def test_endpoint_rejects_bad_k(client, k):
+    response = client.get('/api/comparables', query_string=dict(LISTING, k=k))
+    assert response.status_code == 400
+    assert 'k must be' in response.get_json()['error']
+
+
+def test_endpoint(client, anonymous_client):
+    response = client.get('/api/comparables', query_string=dict(LISTING, k=3))
+    assert response.status_code == 200
+    assert len(response.get_json()['comparables']) <= 3
+    assert client.get('/api/comparables', query_string=dict(LISTING, location='Atlantis')).status_code == 400
+    assert anonymous_client.get('/api/comparables', query_string=LISTING).status_code == 401
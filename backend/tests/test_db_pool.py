@@ -0,0 +1,112 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import db
+from db import ConnectionPool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'pool.db'), size=2, timeout=0.3)
+    yield pool
+    pool.close()
+
+
+def test_pragmas_are_applied(pool):
+    conn = pool.acquire()
+    pragma = lambda name: conn.execute(f'PRAGMA {name}').fetchone()[0]
+    assert pragma('foreign_keys') == 1
+    assert pragma('journal_mode') == 'wal'
+    assert pragma('synchronous') == 1          # NORMAL
+    assert pragma('busy_timeout') == 5000
+    assert pragma('cache_size') == -16000
+    assert pragma('temp_store') == 2           # MEMORY
+    assert conn.row_factory is sqlite3.Row
+    pool.release(conn)
+
+
+def test_connections_are_reused(pool):
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+
+
+def test_borrowing_past_the_limit_times_out(pool):
+    held = [pool.acquire(), pool.acquire()]
+    started = time.monotonic()
+    with pytest.raises(sqlite3.OperationalError, match='Timed out'):
+        pool.acquire()
+    assert time.monotonic() - started >= 0.3
+    assert pool._created == 2
+    for conn in held:
+        pool.release(conn)
+
+
+def test_borrowing_past_the_limit_waits_for_a_release(pool):
+    held = [pool.acquire(), pool.acquire()]
+    threading.Timer(0.05, pool.release, [held[0]]).start()
+    assert pool.acquire() is held[0]
+    assert pool._created == 2
+    pool.release(held[0])
+    pool.release(held[1])
+
+
+def test_release_rolls_back_an_open_transaction(pool):
+    conn = pool.acquire()
+    conn.execute('CREATE TABLE t (x)')
+    conn.commit()
+    conn.execute('INSERT INTO t VALUES (1)')
+    pool.release(conn)
+    conn = pool.acquire()
+    assert not conn.in_transaction
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    pool.release(conn)
+
+
+def test_close_retires_borrowed_connections(pool):
+    idle, borrowed = pool.acquire(), pool.acquire()
+    pool.release(idle)
+    pool.close()
+    # The idle one is closed at once; the borrowed one still counts against the limit
+    with pytest.raises(sqlite3.ProgrammingError):
+        idle.execute('SELECT 1')
+    fresh = pool.acquire()
+    assert fresh is not idle
+    with pytest.raises(sqlite3.OperationalError):
+        pool.acquire()
+    # Returned after close(): closed, not reused, and its slot freed
+    pool.release(borrowed)
+    with pytest.raises(sqlite3.ProgrammingError):
+        borrowed.execute('SELECT 1')
+    another = pool.acquire()
+    assert another is not borrowed
+    assert pool._created == 2
+    pool.release(fresh)
+    pool.release(another)
+
+
+def test_waiter_gets_the_slot_of_a_retired_connection(pool):
+    held = [pool.acquire(), pool.acquire()]
+    pool.close()
+    threading.Timer(0.05, pool.release, [held[0]]).start()
+    conn = pool.acquire()
+    assert conn is not held[0]
+    pool.release(conn)
+    pool.release(held[1])
+
+
+def test_configure_switches_database(app, tmp_path):
+    path = db.DB_PATH
+    try:
+        db.configure(str(tmp_path / 'other.db'), size=1)
+        with db.transaction() as conn:
+            conn.execute('CREATE TABLE marker (x)')
+        with db.connection() as conn:
+            assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'marker'").fetchone()
+    finally:
+        db.configure(path)
+    with db.connection() as conn:
+        assert not conn.execute("SELECT name FROM sqlite_master WHERE name = 'marker'").fetchone()
@@ -0,0 +1,171 @@
+import csv
+import io
+import json
+
+import pytest
+
+import db
+import export
+
+LOCATION = 'Exportshire'
+ROWS = 23
+
+
+@pytest.fixture(scope='module')
+def listings(app):
+    """ROWS listings in their own county, one added_at per day from 2026-03-01."""
+    admin_id = db.get_user_by_username('admin')['id']
+    with db.transaction() as conn:
+        conn.executemany('''INSERT INTO property_data (bedrooms, bathrooms, size_sqft, location, property_type,
+                                                       price, added_by, added_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                         [(1 + i % 5, 1 + i % 3, 500.5 + i, LOCATION, 'Apartment' if i % 2 else 'House',
+                           1e6 * (i + 1), admin_id, f'2026-03-{i + 1:02d} 12:00:00') for i in range(ROWS)])
+    with db.connection() as conn:
+        return [tuple(row) for row in conn.execute(
+            f"SELECT {', '.join(export.TABLES['property_data'].column_names)} FROM property_data "
+            'WHERE location = ? ORDER BY id', (LOCATION,))]
+
+
+def run(fmt, chunk_size=export.CHUNK_SIZE, summary=None, **filters):
+    filters.setdefault('location', LOCATION)
+    return b''.join(export.export('property_data', fmt, chunk_size, summary, **filters))
+
+
+def read_csv(data):
+    reader = csv.reader(io.StringIO(data.decode()))
+    assert next(reader) == export.TABLES['property_data'].column_names
+    return [tuple(row) for row in reader]
+
+
+def as_text(rows):
+    # What csv.writer makes of each value
+    return [tuple('' if value is None else str(value) for value in row) for row in rows]
+
+
+def read_ndjson(data):
+    names = export.TABLES['property_data'].column_names
+    rows = [json.loads(line) for line in data.decode().splitlines()]
+    assert all(list(row) == names for row in rows)
+    return [tuple(row.values()) for row in rows]
+
+
+def read_parquet(data):
+    pq = pytest.importorskip('pyarrow.parquet')
+    table = pq.read_table(io.BytesIO(data))
+    assert table.schema.names == export.TABLES['property_data'].column_names
+    return [tuple(row.values()) for row in table.to_pylist()], pq.ParquetFile(io.BytesIO(data))
+
+
+def test_csv_round_trip(listings):
+    assert read_csv(run('csv')) == as_text(listings)
+
+
+def test_ndjson_round_trip(listings):
+    assert read_ndjson(run('ndjson')) == listings
+
+
+def test_parquet_round_trip(listings):
+    rows, parquet = read_parquet(run('parquet', chunk_size=10))
+    assert rows == listings
+    # One row group per chunk
+    assert [parquet.metadata.row_group(i).num_rows for i in range(parquet.num_row_groups)] == [10, 10, 3]
+    types = {field.name: str(field.type) for field in parquet.schema_arrow}
+    assert types['id'] == 'int64' and types['price'] == 'double' and types['added_at'] == 'string'
+
+
+@pytest.mark.parametrize('since, until, days', [
+    ('2026-03-05', None, range(5, ROWS + 1)),
+    (None, '2026-03-05', range(1, 5)),
+    ('2026-03-05', '2026-03-10', range(5, 10)),
+    ('2026-03-05 12:00:00', '2026-03-05 12:00:01', [5]),   # since is inclusive, until exclusive
+    ('2026-03-05T12:00:01', None, range(6, ROWS + 1)),
+    ('2026-04-01', None, []),
+])
+def test_since_until(listings, since, until, days):
+    rows = read_ndjson(run('ndjson', since=since, until=until))
+    assert rows == [row for row in listings if int(row[-1][8:10]) in days]
+
+
+def test_other_filters(listings):
+    rows = read_ndjson(run('ndjson', user='admin', property_type='House'))
+    assert rows == [row for row in listings if row[5] == 'House']
+    assert run('ndjson', user='tester') == b''
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 10, ROWS, ROWS + 1, 1000])
+@pytest.mark.parametrize('fmt, read', [('csv', read_csv), ('ndjson', read_ndjson),
+                                       ('parquet', lambda data: read_parquet(data)[0])])
+def test_chunk_boundaries(listings, chunk_size, fmt, read):
+    summary = {}
+    rows = read(run(fmt, chunk_size, summary))
+    assert rows == (as_text(listings) if fmt == 'csv' else listings)
+    assert summary['rows'] == ROWS
+
+
+@pytest.mark.parametrize('chunk_size', [1, 23])
+def test_exact_multiple_of_the_chunk_size(listings, chunk_size, monkeypatch):
+    queries = []
+    connection = db.connection
+
+    def counting_connection():
+        queries.append(1)
+        return connection()
+
+    monkeypatch.setattr(db, 'connection', counting_connection)
+    chunks = list(export.iter_chunks(export.build_query('property_data', location=LOCATION), chunk_size))
+    assert [len(chunk) for chunk in chunks] == [chunk_size] * (ROWS // chunk_size)
+    # A full last chunk needs one more (empty) query to know it was the last
+    assert len(queries) == len(chunks) + 1
+
+
+@pytest.fixture
+def empty_database(app, tmp_path):
+    path = db.DB_PATH
+    db.configure(str(tmp_path / 'empty.db'))
+    db.init_db()
+    yield
+    db.configure(path)
+
+
+@pytest.mark.parametrize('table', sorted(export.TABLES))
+def test_empty_table(empty_database, table):
+    names = export.TABLES[table].column_names
+    summary = {}
+    assert b''.join(export.export(table, 'csv', summary=summary)).decode().splitlines() == [','.join(names)]
+    assert b''.join(export.export(table, 'ndjson')) == b''
+    pq = pytest.importorskip('pyarrow.parquet')
+    parquet = pq.read_table(io.BytesIO(b''.join(export.export(table, 'parquet'))))
+    assert parquet.num_rows == 0 and parquet.schema.names == names
+    assert summary.get('rows', 0) == 0
+
+
+@pytest.mark.parametrize('table, fmt, filters, message', [
+    ('users', 'csv', {}, 'Unknown table'),
+    ('property_data', 'xlsx', {}, 'Unknown format'),
+    ('property_data', 'csv', {'since': 'yesterday'}, 'since must be'),
+    ('property_data', 'csv', {'until': '2026-13-01'}, 'until must be'),
+    ('predictions', 'csv', {'user': 'nobody-by-this-name'}, 'Unknown user'),
+])
+def test_invalid_requests(app, table, fmt, filters, message):
+    # Raised by export() itself, before the response starts
+    with pytest.raises(export.ExportError, match=message):
+        export.export(table, fmt, **filters)
+
+
+def test_export_endpoint(admin_client, listings):
+    response = admin_client.get('/api/admin/export/property_data',
+                                query_string={'format': 'ndjson', 'location': LOCATION, 'since': '2026-03-20'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert 'property_data.ndjson' in response.headers['Content-Disposition']
+    assert read_ndjson(response.data) == listings[19:]
+    response = admin_client.get('/api/admin/export/property_data', query_string={'location': LOCATION})
+    assert read_csv(response.data) == as_text(listings)
+
+
+def test_export_endpoint_errors(admin_client, client):
+    assert admin_client.get('/api/admin/export/users').status_code == 400
+    assert admin_client.get('/api/admin/export/predictions?format=xml').status_code == 400
+    assert admin_client.get('/api/admin/export/predictions?until=soon').status_code == 400
+    assert client.get('/api/admin/export/predictions').status_code == 403
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.tree._tree import TREE_LEAF
+
+from forest_eval import CompiledForest, random_inputs
+
+
+@pytest.fixture(scope='module')
+def model():
+    rng = np.random.default_rng(0)
+    X = np.column_stack([rng.integers(1, 7, 400), rng.integers(1, 5, 400), rng.uniform(300, 6000, 400),
+                         rng.integers(0, 47, 400), rng.integers(0, 5, 400)]).astype(float)
+    y = X[:, 2] * 1000 + X[:, 0] * 50000 + X[:, 3] * 20000 + rng.normal(0, 1e5, 400)
+    return RandomForestRegressor(n_estimators=12, max_depth=8, random_state=0).fit(X, y)
+
+
+@pytest.fixture(scope='module')
+def forest(model):
+    return CompiledForest.from_sklearn(model)
+
+
+@pytest.fixture(scope='module')
+def X(forest):
+    return random_inputs(forest, 500, seed=1)
+
+
+def reference_predict(model, X, n_trees=None, max_depth=None):
+    """Walk the sklearn trees directly, stopping at max_depth, and average the first n_trees."""
+    X = np.asarray(X, dtype=np.float32)
+    predictions = []
+    for estimator in model.estimators_[:n_trees]:
+        tree = estimator.tree_
+        values = []
+        for x in X:
+            node, depth = 0, 0
+            while tree.children_left[node] != TREE_LEAF and (max_depth is None or depth < max_depth):
+                go_left = x[tree.feature[node]] <= tree.threshold[node]
+                node = tree.children_left[node] if go_left else tree.children_right[node]
+                depth += 1
+            values.append(tree.value[node, 0, 0])
+        predictions.append(values)
+    return np.mean(predictions, axis=0)
+
+
+def test_batch_matches_sklearn(model, forest, X):
+    np.testing.assert_allclose(forest.predict(X), model.predict(X), rtol=1e-12)
+
+
+def test_single_row_matches_sklearn(model, forest, X):
+    # One row at a time goes through the take() fast path
+    actual = np.array([forest.predict(row)[0] for row in X[:100]])
+    np.testing.assert_allclose(actual, model.predict(X[:100]), rtol=1e-12)
+    np.testing.assert_allclose(forest.leaf_values(X[0]), forest.leaf_values(X[:2])[:1], rtol=0)
+
+
+def test_reference_walk_matches_sklearn(model, X):
+    # Guards the oracle used for truncated() below
+    np.testing.assert_allclose(reference_predict(model, X[:50]), model.predict(X[:50]), rtol=1e-12)
+
+
+@pytest.mark.parametrize('n_trees, max_depth', [(None, None), (5, None), (None, 3), (5, 3), (12, 1)])
+def test_truncated(model, forest, X, n_trees, max_depth):
+    small = forest.truncated(n_trees=n_trees, max_depth=max_depth)
+    expected = reference_predict(model, X[:100], n_trees, max_depth)
+    np.testing.assert_allclose(small.predict(X[:100]), expected, rtol=1e-12)
+    np.testing.assert_allclose([small.predict(row)[0] for row in X[:20]], expected[:20], rtol=1e-12)
+    assert small.n_trees == (n_trees or forest.n_trees)
+    assert small.max_depth <= (max_depth or forest.max_depth)
+    if n_trees or max_depth:
+        assert small.n_nodes < forest.n_nodes
+
+
+def test_astype_float32(forest, X):
+    small = forest.astype(np.float32)
+    assert small.threshold.dtype == np.float32 and small.value.dtype == np.float32
+    np.testing.assert_allclose(small.predict(X), forest.predict(X), rtol=1e-5)
+    np.testing.assert_allclose([small.predict(row)[0] for row in X[:20]], forest.predict(X[:20]), rtol=1e-5)
+
+
+def test_save_and_load(forest, X, tmp_path):
+    path = str(tmp_path / 'forest.npz')
+    forest.save(path)
+    np.testing.assert_array_equal(CompiledForest.load(path).predict(X), forest.predict(X))
+
+
+def test_wrong_feature_count(forest):
+    with pytest.raises(ValueError):
+        forest.predict(np.zeros((2, forest.n_features + 1)))
@@ -0,0 +1,128 @@
+import base64
+import json
+
+import pytest
+
+import db
+from conftest import login
+
+HISTORY_USER = ('history-user', 'history-password')
+LOGIN_USER = 'cursor-probe'
+# Many rows share each timestamp, so only the id keeps the order total
+TIMESTAMPS = ['2026-01-01 10:00:00'] * 12 + ['2026-01-01 09:00:00'] * 9 + ['2026-01-01 11:00:00'] * 6
+
+
+@pytest.fixture(scope='module')
+def history(app):
+    db.create_user('History User', 'history@example.com', *HISTORY_USER)
+    user_id = db.get_user_by_username(HISTORY_USER[0])['id']
+    with db.transaction() as conn:
+        conn.executemany('''INSERT INTO predictions (user_id, location, property_type, bedrooms, bathrooms,
+                                                     size_sqft, predicted_price, created_at)
+                            VALUES (?, 'Nairobi', 'House', 3, 2, 1500, ?, ?)''',
+                         [(user_id, 1e6 + i, ts) for i, ts in enumerate(TIMESTAMPS)])
+        conn.executemany('''INSERT INTO login_history (username, login_time, ip_address, user_agent, success)
+                            VALUES (?, ?, '10.0.0.1', 'pytest', 1)''',
+                         [(LOGIN_USER, ts) for ts in TIMESTAMPS])
+    return user_id
+
+
+@pytest.fixture
+def history_client(app, history):
+    return login(app, *HISTORY_USER)
+
+
+def expected_ids(table, time_column, where, params):
+    with db.connection() as conn:
+        return [row[0] for row in conn.execute(
+            f'SELECT id FROM {table} WHERE {where} ORDER BY {time_column} DESC, id DESC', params)]
+
+
+def walk(client, url, limit, **filters):
+    """Every page of a history endpoint; returns the ids in order and the number of pages."""
+    ids, pages, cursor = [], 0, None
+    while True:
+        query = dict(filters, limit=limit, **({'cursor': cursor} if cursor else {}))
+        response = client.get(url, query_string=query)
+        assert response.status_code == 200
+        body = response.get_json()
+        assert len(body['items']) <= limit
+        ids.extend(item['id'] for item in body['items'])
+        pages += 1
+        cursor = body['next_cursor']
+        if cursor is None:
+            return ids, pages
+
+
+@pytest.mark.parametrize('limit', [1, 4, 5, 9, 27, 100])
+def test_prediction_pages_with_shared_timestamps(history_client, history, limit):
+    ids, pages = walk(history_client, '/api/predictions/history', limit)
+    assert ids == expected_ids('predictions', 'created_at', 'user_id = ?', (history,))
+    assert len(ids) == len(set(ids)) == len(TIMESTAMPS)
+    assert pages == max(1, -(-len(TIMESTAMPS) // limit))
+
+
+@pytest.mark.parametrize('limit', [1, 5, 12, 26])
+def test_login_pages_with_shared_timestamps(admin_client, history, limit):
+    ids, _ = walk(admin_client, '/api/admin/login-history', limit, username=LOGIN_USER)
+    assert ids == expected_ids('login_history', 'login_time', 'username = ?', (LOGIN_USER,))
+    assert len(ids) == len(set(ids)) == len(TIMESTAMPS)
+
+
+def test_rows_added_mid_walk_are_not_repeated(history_client, history):
+    first = history_client.get('/api/predictions/history', query_string={'limit': 5}).get_json()
+    with db.transaction() as conn:
+        conn.execute('''INSERT INTO predictions (user_id, location, property_type, bedrooms, bathrooms,
+                                                 size_sqft, predicted_price, created_at)
+                        VALUES (?, 'Nairobi', 'House', 3, 2, 1500, 1, '2026-01-01 11:00:00')''', (history,))
+        new_id = conn.execute('SELECT MAX(id) FROM predictions').fetchone()[0]
+    try:
+        rest = history_client.get('/api/predictions/history',
+                                  query_string={'limit': 100, 'cursor': first['next_cursor']}).get_json()
+        ids = [item['id'] for item in first['items'] + rest['items']]
+        assert new_id not in ids and len(ids) == len(set(ids)) == len(TIMESTAMPS)
+    finally:
+        with db.transaction() as conn:
+            conn.execute('DELETE FROM predictions WHERE id = ?', (new_id,))
+
+
+def test_history_is_per_user(client, history):
+    ids = [item['id'] for item in client.get('/api/predictions/history?limit=500').get_json()['items']]
+    assert not set(ids) & set(expected_ids('predictions', 'created_at', 'user_id = ?', (history,)))
+
+
+def test_filters(history_client, history):
+    body = history_client.get('/api/predictions/history?location=Mombasa').get_json()
+    assert body == {'items': [], 'next_cursor': None}
+
+
+def test_limit_is_clamped(history_client, history, monkeypatch):
+    monkeypatch.setattr(db, 'MAX_HISTORY_PAGE_SIZE', 10)
+    assert len(history_client.get('/api/predictions/history?limit=0').get_json()['items']) == 1
+    assert len(history_client.get('/api/predictions/history?limit=1000').get_json()['items']) == 10
+
+
+def cursor_of(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+
+@pytest.mark.parametrize('cursor', [
+    'not-a-cursor',
+    '!!!',
+    cursor_of({'timestamp': '2026-01-01 10:00:00'}),
+    cursor_of(['2026-01-01 10:00:00']),
+    cursor_of(['2026-01-01 10:00:00', '7']),
+    cursor_of([1767261600, 7]),
+    cursor_of(None),
+])
+def test_bad_cursor(history_client, admin_client, history, cursor):
+    for client, url in ((history_client, '/api/predictions/history'), (admin_client, '/api/admin/login-history')):
+        response = client.get(url, query_string={'cursor': cursor})
+        assert response.status_code == 400
+        assert response.get_json() == {'error': 'Invalid cursor'}
+
+
+def test_login_history_needs_an_admin(client, anonymous_client):
+    assert client.get('/api/admin/login-history').status_code == 403
+    assert anonymous_client.get('/api/admin/login-history').status_code == 401
+    assert anonymous_client.get('/api/predictions/history').status_code == 401
@@ -0,0 +1,186 @@
+import io
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import db
+import ingest
+
+HEADER = 'bedrooms,bathrooms,size_sqft,location,property_type,price\n'
+GOOD = '3,2,1500,Nairobi,House,8500000\n'
+DAMAGED = '"3,2,1500\n'  # unterminated quote
+
+
+def properties_count():
+    with db.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM property_data').fetchone()[0]
+
+
+def csv_file(*lines, header=HEADER):
+    return io.BytesIO((header + ''.join(lines)).encode())
+
+
+def test_chunks(app):
+    before = properties_count()
+    summary = ingest.ingest(csv_file(*[GOOD] * 10), chunk_size=3)
+    assert summary == dict(summary, rows=10, accepted=10, rejected=0, chunks=4, dry_run=False)
+    assert 'error' not in summary
+    assert properties_count() - before == 10
+
+
+def test_chunk_size_that_divides_the_file(app):
+    summary = ingest.ingest(csv_file(*[GOOD] * 6), chunk_size=3)
+    assert summary['chunks'] == 2 and summary['accepted'] == 6
+
+
+def test_rows_are_normalized(app):
+    before = properties_count()
+    ingest.ingest(csv_file(' 4 , 3 , 2100.5 ,  mombasa , APARTMENT , 12000000\n'), added_by=1)
+    assert properties_count() - before == 1
+    with db.connection() as conn:
+        row = conn.execute('''SELECT bedrooms, bathrooms, size_sqft, location, property_type, price, added_by
+                              FROM property_data ORDER BY id DESC LIMIT 1''').fetchone()
+    assert tuple(row) == (4, 3, 2100.5, 'Mombasa', 'Apartment', 12000000.0, 1)
+
+
+def test_header_is_normalized(app):
+    summary = ingest.ingest(csv_file(GOOD, header='Bedrooms, Bathrooms,Size Sqft,LOCATION,Property Type,Price\n'))
+    assert summary['accepted'] == 1
+
+
+@pytest.mark.parametrize('line, reason', [
+    ('3,2,1500,Atlantis,House,8500000\n', 'county'),
+    ('3,2,1500,Nairobi,Castle,8500000\n', 'property type'),
+    ('three,2,1500,Nairobi,House,8500000\n', 'bedrooms'),
+    ('0,2,1500,Nairobi,House,8500000\n', 'bedrooms'),
+    ('3,2,,Nairobi,House,8500000\n', 'size_sqft'),
+    ('5000,2,1500,Nairobi,House,8500000\n', 'bedrooms must be at most 1000'),
+    ('3,2,1e9,Nairobi,House,8500000\n', 'size_sqft must be at most'),
+    ('3,2,1500,Nairobi,House,0\n', 'price must be a number >= 1'),
+    ('3,2,1500,Nairobi,House,abc\n', 'price must be a number >= 1'),
+    ('3,2,1500,Nairobi,House,1e15\n', 'price must be at most'),
+    ('3,2,1500,Nairobi,House,inf\n', 'price must be at most'),
+])
+def test_rejection_reasons(app, line, reason):
+    before = properties_count()
+    summary = ingest.ingest(csv_file(GOOD, line, GOOD))
+    assert summary['accepted'] == 2 and summary['rejected'] == 1
+    [(message, count)] = summary['reasons'].items()
+    assert reason in message and count == 1
+    assert summary['rejections'] == [{'row': 1, 'error': message}]
+    assert properties_count() - before == 2
+
+
+def test_rejections_are_grouped_and_capped(app, monkeypatch):
+    monkeypatch.setattr(ingest, 'MAX_REPORTED_REJECTIONS', 5)
+    bad = '3,2,1500,Atlantis,House,8500000\n'
+    summary = ingest.ingest(csv_file(*([bad, GOOD] * 6), '3,2,1500,Nairobi,House,0\n'), chunk_size=4)
+    assert summary['rejected'] == 7 and summary['accepted'] == 6
+    assert sorted(summary['reasons'].values()) == [1, 6]
+    # Row numbers count across chunks
+    assert [r['row'] for r in summary['rejections']] == [0, 2, 4, 6, 8]
+
+
+def test_dry_run_inserts_nothing(app):
+    before = properties_count()
+    summary = ingest.ingest(csv_file(GOOD, GOOD), dry_run=True)
+    assert summary['accepted'] == 2 and summary['dry_run']
+    assert properties_count() == before
+
+
+@pytest.mark.parametrize('data, message', [
+    (b'', 'empty'),
+    (b'bedrooms,bathrooms\n1,2\n', 'Missing columns: size_sqft'),
+    ((HEADER + DAMAGED).encode(), 'Could not parse CSV'),
+])
+def test_unreadable_files_raise(app, data, message):
+    with pytest.raises(ingest.IngestError, match=message):
+        ingest.ingest(io.BytesIO(data))
+
+
+def test_damaged_file_keeps_earlier_chunks(app):
+    before = properties_count()
+    summary = ingest.ingest(csv_file(*[GOOD] * 4, DAMAGED, GOOD), chunk_size=2)
+    assert summary['error_source'] == 'file'
+    assert 'Could not parse CSV' in summary['error'] and 'after row 4' in summary['error']
+    assert summary['accepted'] == 4 and summary['chunks'] == 2
+    assert properties_count() - before == 4
+
+
+def test_database_error_keeps_earlier_chunks(app, monkeypatch):
+    insert = db.insert_properties
+    calls = []
+
+    def failing_insert(records):
+        calls.append(len(records))
+        if len(calls) == 3:
+            raise sqlite3.OperationalError('database is locked')
+        insert(records)
+
+    monkeypatch.setattr(db, 'insert_properties', failing_insert)
+    before = properties_count()
+    summary = ingest.ingest(csv_file(*[GOOD] * 10), chunk_size=2)
+    assert summary['error_source'] == 'database'
+    assert 'database is locked' in summary['error'] and 'row 4' in summary['error']
+    # It stops at the failed chunk: that one and the rest aren't counted or inserted
+    assert summary == dict(summary, rows=4, accepted=4, chunks=2)
+    assert len(calls) == 3
+    assert properties_count() - before == 4
+
+
+def test_compaction_error_does_not_fail_the_import(app, monkeypatch):
+    import market_stats
+
+    def failing_compact():
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(market_stats, 'compact_if_needed', failing_compact)
+    summary = ingest.ingest(csv_file(GOOD))
+    assert summary['accepted'] == 1 and 'error' not in summary
+
+
+def test_parquet(app, tmp_path):
+    pytest.importorskip('pyarrow')
+    path = tmp_path / 'listings.parquet'
+    pd.DataFrame({'Bedrooms': [3, 4, 2], 'bathrooms': [2, 3, 1], 'size_sqft': [1500.0, 2200.0, 800.0],
+                  'location': ['Nairobi', 'Kisumu', 'Atlantis'], 'property_type': ['House', 'Villa', 'House'],
+                  'price': [8.5e6, 1.4e7, 3e6]}).to_parquet(path)
+    summary = ingest.ingest(str(path), 'parquet', chunk_size=2)
+    assert summary == dict(summary, rows=3, accepted=2, rejected=1, chunks=2)
+
+
+def test_import_endpoint(client):
+    before = properties_count()
+    response = client.post('/api/properties/import', data=HEADER + GOOD * 3, content_type='text/csv')
+    assert response.status_code == 200
+    assert response.get_json()['accepted'] == 3
+    response = client.post('/api/properties/import',
+                           data={'file': (csv_file(GOOD, '3,2,1500,Atlantis,House,1\n'), 'listings.csv')})
+    assert response.status_code == 200
+    assert response.get_json()['rejected'] == 1
+    assert properties_count() - before == 4
+
+
+def test_import_endpoint_errors(client, anonymous_client, monkeypatch):
+    response = client.post('/api/properties/import', data='bedrooms\n1\n', content_type='text/csv')
+    assert response.status_code == 400 and 'Missing columns' in response.get_json()['error']
+
+    monkeypatch.setattr(ingest, 'CHUNK_SIZE', 2)
+    monkeypatch.setattr(ingest.ingest, '__defaults__', ('csv', None, 2, False))
+    response = client.post('/api/properties/import', data=HEADER + GOOD * 2 + DAMAGED,
+                           content_type='text/csv')
+    assert response.status_code == 400
+    assert response.get_json()['accepted'] == 2
+
+    def failing_insert(records):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(db, 'insert_properties', failing_insert)
+    response = client.post('/api/properties/import', data=HEADER + GOOD, content_type='text/csv')
+    assert response.status_code == 500
+    body = response.get_json()
+    assert body['error_source'] == 'database' and body['accepted'] == 0
+
+    assert anonymous_client.post('/api/properties/import', data=HEADER + GOOD,
+                                 content_type='text/csv').status_code == 401
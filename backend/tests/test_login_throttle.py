@@ -0,0 +1,167 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import asgi
+import db
+import login_retention
+from login_throttle import LoginThrottle, MemoryBucketStore, SQLiteBucketStore
+from conftest import TEST_USER
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryBucketStore()
+    return SQLiteBucketStore(str(tmp_path / 'throttle.db'))
+
+
+@pytest.fixture
+def throttle(app, monkeypatch):
+    """A fresh throttle installed in the app, with a small username limit."""
+    import vinnie
+    throttle = LoginThrottle(ip_limit=(20, 3.0), username_limit=(3, 12.0))
+    monkeypatch.setattr(vinnie, 'login_throttle', throttle)
+    return throttle
+
+
+def test_store_burst_then_refill(store):
+    limits = [('ip:a', 3, 2.0)]
+    assert [store.take(limits, 100.0) for _ in range(3)] == [0, 0, 0]
+    assert store.take(limits, 100.0) == pytest.approx(2.0)
+    assert store.take(limits, 101.5) == pytest.approx(0.5)
+    assert store.take(limits, 102.0) == 0
+
+
+def test_store_takes_from_all_buckets_or_none(store):
+    store.take([('b', 1, 10.0)], 0.0)
+    # 'b' is empty, so 'a' must not be charged either
+    assert store.take([('a', 1, 10.0), ('b', 1, 10.0)], 0.0) == pytest.approx(10.0)
+    assert store.take([('a', 1, 10.0)], 0.0) == 0
+
+
+def test_store_zero_cost_only_checks(store):
+    for _ in range(5):
+        assert store.take([('a', 1, 10.0, 0)], 0.0) == 0
+    store.take([('a', 1, 10.0)], 0.0)
+    assert store.take([('a', 1, 10.0, 0)], 0.0) == pytest.approx(10.0)
+
+
+def test_sqlite_store_is_shared(tmp_path):
+    path = str(tmp_path / 'throttle.db')
+    first, second = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    assert first.take([('a', 1, 10.0)], 0.0) == 0
+    assert second.take([('a', 1, 10.0)], 0.0) == pytest.approx(10.0)
+    second.prune(now=10.0)
+    assert first.take([('a', 1, 10.0)], 10.0) == 0
+
+
+def test_memory_store_forgets_oldest_keys():
+    store = MemoryBucketStore(max_keys=2)
+    for key in 'abc':
+        store.take([(key, 1, 10.0)], 0.0)
+    assert len(store) == 2
+    assert store.take([('a', 1, 10.0)], 0.0) == 0
+
+
+def test_only_failures_charge_the_username(store):
+    throttle = LoginThrottle(store, ip_limit=(100, 1.0), username_limit=(2, 60.0))
+    for _ in range(5):
+        assert throttle.attempt('10.0.0.1', 'alice') == 0
+    throttle.failed('10.0.0.1', 'Alice')
+    throttle.failed('10.0.0.1', 'alice')
+    assert throttle.attempt('10.0.0.1', 'ALICE') > 0
+    # Guesses from one address don't lock the user out at another
+    assert throttle.attempt('10.0.0.2', 'alice') == 0
+
+
+def test_429_with_retry_after(app, throttle):
+    client = app.test_client()
+    for _ in range(3):
+        response = client.post('/api/login', json={'username': TEST_USER[0], 'password': 'wrong'})
+        assert response.status_code == 401
+    response = client.post('/api/login', json={'username': TEST_USER[0], 'password': TEST_USER[1]})
+    assert response.status_code == 429
+    assert 0 < int(response.headers['Retry-After']) <= 12
+    response = client.post('/login', data={'username': TEST_USER[0], 'password': TEST_USER[1]})
+    assert response.status_code == 429 and 'Retry-After' in response.headers
+    assert throttle.rejected == 2
+
+
+def test_successful_logins_are_not_throttled(app, throttle):
+    client = app.test_client()
+    for _ in range(6):
+        response = client.post('/api/login', json={'username': TEST_USER[0], 'password': TEST_USER[1]})
+        assert response.status_code == 200
+
+
+def test_attacker_cannot_lock_out_user(app, throttle):
+    attacker = app.test_client()
+    for _ in range(5):
+        attacker.post('/api/login', json={'username': TEST_USER[0], 'password': 'guess'},
+                      environ_base={'REMOTE_ADDR': '203.0.113.9'})
+    user = app.test_client()
+    response = user.post('/api/login', json={'username': TEST_USER[0], 'password': TEST_USER[1]},
+                         environ_base={'REMOTE_ADDR': '198.51.100.7'})
+    assert response.status_code == 200
+
+
+def test_ip_bucket_limits_all_attempts(app, monkeypatch):
+    import vinnie
+    monkeypatch.setattr(vinnie, 'login_throttle', LoginThrottle(ip_limit=(2, 30.0)))
+    client = app.test_client()
+    statuses = [client.post('/api/login', json={'username': TEST_USER[0], 'password': TEST_USER[1]}).status_code
+                for _ in range(3)]
+    assert statuses == [200, 200, 429]
+
+
+@pytest.mark.parametrize('hops, forwarded, expected', [
+    (0, '1.1.1.1', '127.0.0.1'),
+    (1, '1.1.1.1', '1.1.1.1'),
+    (1, '6.6.6.6, 1.1.1.1', '1.1.1.1'),
+    (2, '6.6.6.6, 1.1.1.1, 10.0.0.2', '1.1.1.1'),
+    (2, '1.1.1.1', '127.0.0.1'),
+])
+def test_asgi_client_address(hops, forwarded, expected):
+    scope = {'client': ('127.0.0.1', 5000), 'headers': [(b'x-forwarded-for', forwarded.encode())]}
+    assert asgi.client_address(scope, hops) == expected
+
+
+def add_login_rows(username, when, successes):
+    with db.transaction() as conn:
+        conn.executemany('INSERT INTO login_history (username, login_time, ip_address, user_agent, success) '
+                         'VALUES (?, ?, ?, ?, ?)',
+                         [(username, (when + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S'),
+                           '10.0.0.1', 'pytest', success) for i, success in enumerate(successes)])
+
+
+def raw_rows(username):
+    with db.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM login_history WHERE username = ?', (username,)).fetchone()[0]
+
+
+def test_retention_rollup(app):
+    old = (datetime.now(timezone.utc) - timedelta(days=200)).replace(hour=9, minute=0, second=0, microsecond=0)
+    add_login_rows('retention-user', old, [True, True, False, True, False])
+    add_login_rows('retention-user', old + timedelta(days=1), [True])
+    add_login_rows('retention-user', datetime.now(timezone.utc) - timedelta(days=1), [True, False])
+
+    result = login_retention.compact(days=90, batch_size=2)
+    assert result['removed'] >= 6 and result['batches'] >= 3
+    # Recent rows stay raw
+    assert raw_rows('retention-user') == 2
+    summary = login_retention.daily_summary(username='retention-user')
+    counts = {(row['day'], bool(row['success'])): row['attempts'] for row in summary}
+    day = old.strftime('%Y-%m-%d')
+    next_day = (old + timedelta(days=1)).strftime('%Y-%m-%d')
+    assert counts == {(day, True): 3, (day, False): 2, (next_day, True): 1}
+    first = next(row for row in summary if row['day'] == day and row['success'])
+    assert first['first_time'] == old.strftime('%Y-%m-%d %H:%M:%S')
+
+    # A later run adds to the same day's counts instead of replacing them
+    add_login_rows('retention-user', old + timedelta(hours=2), [True])
+    assert login_retention.compact(days=90)['removed'] == 1
+    counts = {(row['day'], bool(row['success'])): row['attempts']
+              for row in login_retention.daily_summary(username='retention-user')}
+    assert counts[(day, True)] == 4
+    assert login_retention.compact(days=90)['removed'] == 0
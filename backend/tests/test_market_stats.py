@@ -0,0 +1,151 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import db
+import market_stats
+
+LOCATIONS = ['Statsville', 'Sketch Bay', 'Deltaton']
+TYPES = ['House', 'Apartment']
+GROUPINGS = [('location', 'property_type'), ('location',), ('property_type',), ()]
+
+
+def lower_median(values):
+    # The histogram median is the ceil(n/2)-th smallest value, to within a bucket
+    values = np.sort(values)
+    return values[math.ceil(len(values) / 2) - 1]
+
+
+def expected(source, group_by):
+    """The same statistics computed with pandas straight from the base table."""
+    table, price = market_stats.SOURCES[source]
+    with db.connection() as conn:
+        frame = pd.read_sql_query(
+            f'''SELECT COALESCE(location, '') AS location, COALESCE(property_type, '') AS property_type,
+                       {price} AS price, size_sqft FROM {table} WHERE {price} > 0''', conn)
+    frame['ppsf'] = frame['price'] / frame['size_sqft'].where(frame['size_sqft'] > 0)
+    groups = frame.groupby(list(group_by)) if group_by else [((), frame)]
+    results = {}
+    for key, rows in groups:
+        key = key if isinstance(key, tuple) else (key,)
+        ppsf = rows['ppsf'].dropna()
+        results[key] = {
+            'count': len(rows),
+            'mean_price': rows['price'].mean(),
+            'median_price': lower_median(rows['price']),
+            'mean_price_per_sqft': ppsf.mean() if len(ppsf) else None,
+            'median_price_per_sqft': lower_median(ppsf) if len(ppsf) else None,
+        }
+    return results
+
+
+def assert_matches(source='property'):
+    for group_by in GROUPINGS:
+        actual = {tuple(row[c] for c in group_by): row for row in market_stats.query(source, group_by)}
+        wanted = expected(source, group_by)
+        assert actual.keys() == wanted.keys(), group_by
+        for key, row in wanted.items():
+            got = actual[key]
+            assert got['count'] == row['count'], (group_by, key)
+            for name in ('mean_price', 'mean_price_per_sqft'):
+                assert got[name] == pytest.approx(row[name], rel=1e-9), (group_by, key, name)
+            for name in ('median_price', 'median_price_per_sqft'):
+                if row[name] is None:
+                    assert got[name] is None
+                else:
+                    # Buckets are 2% wide and report their geometric midpoint
+                    assert got[name] == pytest.approx(row[name], rel=0.0101), (group_by, key, name)
+
+
+def add_listings(n, seed):
+    rng = np.random.default_rng(seed)
+    rows = [(int(rng.integers(1, 6)), int(rng.integers(1, 4)),
+             float(rng.choice([0.0, rng.uniform(400, 5000)], p=[0.1, 0.9])),
+             str(rng.choice(LOCATIONS)), str(rng.choice(TYPES)), float(rng.uniform(2e6, 9e7)))
+            for _ in range(n)]
+    with db.transaction() as conn:
+        conn.executemany('INSERT INTO property_data (bedrooms, bathrooms, size_sqft, location, property_type, price) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+
+def listing_ids():
+    with db.connection() as conn:
+        return [row[0] for row in conn.execute(
+            'SELECT id FROM property_data WHERE location IN (?, ?, ?) ORDER BY id', LOCATIONS)]
+
+
+def execute(sql, params=()):
+    with db.transaction() as conn:
+        conn.execute(sql, params)
+
+
+def test_inserts_updates_deletes_and_compaction(app):
+    add_listings(300, seed=0)
+    assert_matches()
+
+    ids = listing_ids()
+    # Every tracked column, and rows moving into and out of the counted set
+    execute('UPDATE property_data SET price = price * 1.7 WHERE id IN (?, ?, ?)', ids[:3])
+    execute('UPDATE property_data SET location = ? WHERE id IN (?, ?)', ('Sketch Bay', *ids[3:5]))
+    execute('UPDATE property_data SET property_type = ? WHERE id = ?', ('Villa', ids[5]))
+    execute('UPDATE property_data SET size_sqft = 0 WHERE id = ?', (ids[6],))
+    execute('UPDATE property_data SET size_sqft = 2500 WHERE size_sqft = 0 AND id IN (%s)'
+            % ','.join('?' * 20), ids[20:40])
+    execute('UPDATE property_data SET price = NULL WHERE id = ?', (ids[7],))
+    execute('UPDATE property_data SET price = 0 WHERE id = ?', (ids[8],))
+    execute('UPDATE property_data SET price = 4500000 WHERE id = ?', (ids[8],))
+    execute('UPDATE property_data SET location = NULL WHERE id = ?', (ids[9],))
+    execute('UPDATE property_data SET location = ?, property_type = ?, price = ?, size_sqft = ? WHERE id = ?',
+            ('Deltaton', 'Apartment', 7.5e6, 900.0, ids[10]))
+    # Columns the aggregates don't use don't fire the triggers
+    execute('UPDATE property_data SET bedrooms = bedrooms + 1 WHERE id IN (?, ?)', ids[11:13])
+    assert_matches()
+
+    execute('DELETE FROM property_data WHERE id IN (%s)' % ','.join('?' * 50), ids[50:100])
+    assert_matches()
+
+    market_stats.compact()
+    with db.connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM market_sketch_delta').fetchone()[0] == 0
+    assert_matches()
+
+    add_listings(50, seed=1)
+    execute('UPDATE property_data SET price = price / 2 WHERE id IN (?, ?)', ids[100:102])
+    assert_matches()
+
+
+def test_rebuild_agrees_with_triggers(app):
+    add_listings(100, seed=2)
+    execute('UPDATE property_data SET location = ? WHERE id = ?', ('Statsville', listing_ids()[-1]))
+    before = market_stats.query('property', ())
+    market_stats.rebuild()
+    after = market_stats.query('property', ())
+    assert after[0]['count'] == before[0]['count']
+    for name in ('mean_price', 'median_price', 'mean_price_per_sqft', 'median_price_per_sqft'):
+        assert after[0][name] == pytest.approx(before[0][name], rel=1e-9)
+
+
+def test_prediction_updates(app, client):
+    row = {'bedrooms': 3, 'bathrooms': 2, 'size_sqft': 1500, 'location': 'Nairobi', 'property_type': 'House'}
+    for bedrooms in (2, 3, 4):
+        assert client.post('/api/predict', json=dict(row, bedrooms=bedrooms)).status_code == 200
+    assert_matches('prediction')
+    execute('UPDATE predictions SET predicted_price = predicted_price * 3, location = ? '
+            'WHERE id = (SELECT MAX(id) FROM predictions)', ('Mombasa',))
+    assert_matches('prediction')
+
+
+def test_missing_update_triggers_are_added_with_a_backfill(app):
+    add_listings(20, seed=3)
+    with db.transaction() as conn:
+        for name in ('update_old', 'update_new'):
+            conn.execute(f'DROP TRIGGER market_stats_property_{name}')
+        # A database from before the update triggers: this change is never counted
+        conn.execute('UPDATE property_data SET price = price * 10 WHERE id = ?', (listing_ids()[0],))
+    with db.transaction() as conn:
+        market_stats.create_schema(conn)
+        names = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    assert {'market_stats_property_update_old', 'market_stats_property_update_new'} <= names
+    assert_matches()
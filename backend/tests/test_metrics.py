@@ -0,0 +1,43 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def token(monkeypatch):
+    import vinnie
+    monkeypatch.setattr(vinnie, 'METRICS_TOKEN', 'scrape-secret')
+    return 'scrape-secret'
+
+
+def test_local_scrape_without_a_token(anonymous_client):
+    response = anonymous_client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    assert b'smart_assets_prediction_cache_hits' in response.data
+
+
+def test_remote_scrape_without_a_token_is_refused(anonymous_client):
+    response = anonymous_client.get('/metrics', environ_base={'REMOTE_ADDR': '203.0.113.5'})
+    assert response.status_code == 403
+    assert b'smart_assets' not in response.data
+
+
+@pytest.mark.parametrize('authorization', [None, 'Bearer wrong', 'Basic scrape-secret', 'scrape-secret', 'Bearer'])
+def test_token_required(anonymous_client, token, authorization):
+    headers = {'Authorization': authorization} if authorization else {}
+    response = anonymous_client.get('/metrics', headers=headers)
+    assert response.status_code == 401
+    assert response.headers['WWW-Authenticate'].startswith('Bearer')
+
+
+def test_token_accepted_from_anywhere(anonymous_client, token):
+    response = anonymous_client.get('/metrics', headers={'Authorization': f'bearer {token}'},
+                                    environ_base={'REMOTE_ADDR': '203.0.113.5'})
+    assert response.status_code == 200
+    assert b'smart_assets' in response.data
+
+
+def test_model_status_page(client):
+    response = client.get('/ml/status')
+    assert response.status_code == 200
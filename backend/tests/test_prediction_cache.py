@@ -0,0 +1,153 @@
+import sqlite3
+
+import pytest
+
+import prediction_cache
+from prediction_cache import PredictionCache, SQLiteCacheBackend, normalize_key
+
+
+class Clock:
+    """Stands in for the time module inside prediction_cache."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(prediction_cache, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def shared_path(tmp_path):
+    return str(tmp_path / 'cache.db')
+
+
+def test_normalize_key():
+    key = normalize_key(3, 2, 1500, 'Nairobi', 'House')
+    assert key == (3, 2, 1500.0, 'Nairobi', 'House')
+    assert normalize_key('3', 2.0, '1500.001', ' Nairobi ', 'House\n') == key
+    assert normalize_key(3, 2, 1500.01, 'Nairobi', 'House') != key
+
+
+def test_hit_and_miss():
+    cache = PredictionCache()
+    calls = []
+    compute = lambda: calls.append(1) or (1.0, 2.0, 3.0, 4.0)
+    assert cache.get_or_compute('v1', ('a',), compute) == (1.0, 2.0, 3.0, 4.0)
+    assert cache.get_or_compute('v1', ('a',), compute) == (1.0, 2.0, 3.0, 4.0)
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_ttl_expiry(clock):
+    cache = PredictionCache(ttl=10)
+    cache.put('v1', 'a', 1.0)
+    clock.now += 9.9
+    assert cache.get('v1', 'a') == 1.0
+    clock.now += 0.2
+    assert cache.get('v1', 'a') is None
+    assert cache.expirations == 1 and cache.stats()['size'] == 0
+
+
+def test_lru_eviction():
+    cache = PredictionCache(max_entries=2)
+    cache.put('v1', 'a', 1.0)
+    cache.put('v1', 'b', 2.0)
+    assert cache.get('v1', 'a') == 1.0   # 'b' is now the least recently used
+    cache.put('v1', 'c', 3.0)
+    assert cache.get('v1', 'b') is None
+    assert cache.get('v1', 'a') == 1.0 and cache.get('v1', 'c') == 3.0
+    assert cache.evictions == 1
+
+
+def test_new_version_never_serves_old_values():
+    cache = PredictionCache()
+    cache.put('v1', 'a', 1.0)
+    assert cache.get('v2', 'a') is None
+    assert cache.invalidations == 1 and cache.stats()['size'] == 0
+    cache.put('v2', 'a', 2.0)
+    assert cache.get('v2', 'a') == 2.0
+
+
+def test_shared_entries_reach_other_processes(shared_path):
+    first = PredictionCache(shared=SQLiteCacheBackend(shared_path))
+    second = PredictionCache(shared=SQLiteCacheBackend(shared_path))
+    first.put('v1', (3, 2, 1500.0, 'Nairobi', 'House'), (1.0, 2.0, 3.0, 4.0))
+    # Read back through JSON, as the same tuple
+    assert second.get('v1', (3, 2, 1500.0, 'Nairobi', 'House')) == (1.0, 2.0, 3.0, 4.0)
+    assert second.shared_hits == 1
+    assert second.get('v2', (3, 2, 1500.0, 'Nairobi', 'House')) is None
+
+
+def test_shared_versions_coexist_during_a_rolling_reload(shared_path):
+    # Regression: a worker that saw a new version used to delete every other version's rows
+    old_worker = PredictionCache(shared=SQLiteCacheBackend(shared_path))
+    new_worker = PredictionCache(shared=SQLiteCacheBackend(shared_path))
+    old_worker.put('v1', 'a', 1.0)
+    new_worker.put('v2', 'a', 2.0)
+    old_worker.put('v1', 'b', 1.5)
+    reader = PredictionCache(shared=SQLiteCacheBackend(shared_path))
+    assert reader.get('v1', 'a') == 1.0 and reader.get('v1', 'b') == 1.5
+    reader = PredictionCache(shared=SQLiteCacheBackend(shared_path))
+    assert reader.get('v2', 'a') == 2.0
+
+
+def test_shared_entries_age_out(shared_path, clock):
+    backend = SQLiteCacheBackend(shared_path)
+    PredictionCache(shared=backend).put('v1', 'a', 1.0)
+    clock.now += prediction_cache.SHARED_MAX_AGE + 1
+    PredictionCache(shared=backend).put('v1', 'b', 2.0)
+    # Seeing a version for the first time prunes only the stale row
+    PredictionCache(shared=backend).get('v2', 'c')
+    reader = PredictionCache(shared=backend)
+    assert reader.get('v1', 'a') is None and reader.get('v1', 'b') == 2.0
+
+
+def test_shared_ttl(shared_path, clock):
+    PredictionCache(ttl=10, shared=SQLiteCacheBackend(shared_path)).put('v1', 'a', 1.0)
+    clock.now += 11
+    assert PredictionCache(ttl=10, shared=SQLiteCacheBackend(shared_path)).get('v1', 'a') is None
+
+
+def test_old_shared_layout_is_replaced(shared_path):
+    conn = sqlite3.connect(shared_path)
+    conn.execute('CREATE TABLE prediction_cache (key TEXT PRIMARY KEY, version TEXT, value REAL, created REAL)')
+    conn.execute("INSERT INTO prediction_cache VALUES ('a', 'v1', 1.0, 0)")
+    conn.commit()
+    conn.close()
+    cache = PredictionCache(shared=SQLiteCacheBackend(shared_path))
+    assert cache.get('v1', 'a') is None
+    cache.put('v1', 'a', 2.0)
+    assert PredictionCache(shared=SQLiteCacheBackend(shared_path)).get('v1', 'a') == 2.0
+
+
+def test_shared_errors_fall_back_to_computing(shared_path):
+    backend = SQLiteCacheBackend(shared_path)
+    backend._connection().execute('DROP TABLE prediction_cache')
+    cache = PredictionCache(shared=backend)
+    assert cache.get_or_compute('v1', 'a', lambda: 1.0) == 1.0
+    assert cache.get('v1', 'a') == 1.0
+
+
+def test_cached_and_uncached_predictions_match(app, monkeypatch):
+    # Regression: a miss used to predict on the raw input and a hit return the normalized entry
+    import vinnie
+    monkeypatch.setattr(vinnie, 'prediction_cache', PredictionCache())
+    bundle = vinnie.model_registry.get()
+    variants = [(3, 2, 1500.004, ' Nairobi', 'House '), (3, 2, 1500.0, 'Nairobi', 'House'),
+                ('3', '2', '1500.001', 'Nairobi ', ' House')]
+    cached = [vinnie.cached_prediction(bundle, *listing) for listing in variants]
+    assert vinnie.prediction_cache.misses == 1 and vinnie.prediction_cache.hits == 2
+    for listing in variants:
+        vinnie.prediction_cache.clear()
+        assert vinnie.cached_prediction(bundle, *listing) == cached[0]
+    assert cached == [cached[0]] * len(variants)
@@ -0,0 +1,143 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from write_behind import WriteBehindQueue
+
+INSERT = 'INSERT INTO audit (id, note) VALUES (?, ?)'
+UPDATE = 'UPDATE audit SET note = ? WHERE id = ?'
+
+
+class Database:
+    """A scratch table, with a switch to make the next few batches fail as busy."""
+
+    def __init__(self, path):
+        self.path = path
+        self.busy_failures = 0
+        with sqlite3.connect(path) as conn:
+            conn.execute('CREATE TABLE audit (id INTEGER PRIMARY KEY, note TEXT NOT NULL)')
+
+    @contextmanager
+    def transaction(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            if self.busy_failures:
+                self.busy_failures -= 1
+                raise sqlite3.OperationalError('database is locked')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def rows(self):
+        with sqlite3.connect(self.path) as conn:
+            return conn.execute('SELECT id, note FROM audit ORDER BY id').fetchall()
+
+
+@pytest.fixture
+def database(tmp_path):
+    return Database(str(tmp_path / 'audit.db'))
+
+
+def make_queue(database, **options):
+    options = {'flush_size': 100, 'flush_interval': 0.05, 'retry_delay': 0.001, **options}
+    return WriteBehindQueue(database.transaction, **options)
+
+
+def test_stop_flushes_the_queue(database):
+    writer = make_queue(database, flush_interval=10.0).start()
+    for i in range(50):
+        writer.submit(INSERT, (i, 'queued'))
+    writer.stop()
+    assert len(database.rows()) == 50
+    assert writer.stats()['depth'] == 0
+    assert writer.written == 50 and writer.dropped == 0
+
+
+def test_writer_thread_writes_in_batches(database):
+    writer = make_queue(database, flush_size=10).start()
+    for i in range(35):
+        writer.submit(INSERT, (i, 'queued'))
+    deadline = time.monotonic() + 5
+    while writer.written < 35 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.stop()
+    assert writer.written == 35
+    assert writer.flushes >= 4
+
+
+def test_statement_order_is_kept(database):
+    writer = make_queue(database)
+    writer.submit(INSERT, (1, 'first'))
+    writer.submit(UPDATE, ('second', 1))
+    writer.submit(INSERT, (2, 'first'))
+    writer.submit(UPDATE, ('second', 2))
+    writer.flush()
+    assert database.rows() == [(1, 'second'), (2, 'second')]
+
+
+def test_busy_batch_is_retried(database):
+    writer = make_queue(database, retries=3)
+    database.busy_failures = 2
+    for i in range(5):
+        writer.submit(INSERT, (i, 'queued'))
+    writer.flush()
+    assert len(database.rows()) == 5
+    assert writer.retried == 2 and writer.errors == 0 and writer.dropped == 0
+
+
+def test_failing_batch_is_written_row_by_row(database):
+    writer = make_queue(database)
+    writer.submit(INSERT, (1, 'ok'))
+    writer.submit(INSERT, (2, None))       # NOT NULL: can never be written
+    writer.submit(INSERT, (3, 'ok'))
+    writer.submit(INSERT, (1, 'duplicate'))
+    writer.submit(INSERT, (4, 'ok'))
+    writer.flush()
+    assert database.rows() == [(1, 'ok'), (3, 'ok'), (4, 'ok')]
+    assert writer.errors == 1 and writer.retried == 0
+    assert writer.written == 3 and writer.dropped == 2
+    assert writer.stats()['dropped'] == 2
+
+
+def test_still_busy_after_retries_falls_back_to_single_rows(database):
+    writer = make_queue(database, retries=2)
+    database.busy_failures = 3             # the first try and both retries
+    for i in range(4):
+        writer.submit(INSERT, (i, 'queued'))
+    writer.flush()
+    assert len(database.rows()) == 4
+    assert writer.retried == 2 and writer.errors == 1 and writer.dropped == 0
+
+
+def test_full_queue_writes_synchronously(database):
+    writer = make_queue(database, max_queue=2, put_timeout=0.01)
+    for i in range(3):
+        writer.submit(INSERT, (i, 'queued'))
+    assert writer.sync_writes == 1 and writer.enqueued == 2
+    assert database.rows() == [(2, 'queued')]
+    writer.flush()
+    assert len(database.rows()) == 3
+
+
+def test_scheduled_tasks_run_on_the_writer_thread(database):
+    writer = make_queue(database, flush_interval=0.01)
+    ran = threading.Event()
+    threads = []
+
+    def task():
+        threads.append(threading.current_thread().name)
+        ran.set()
+
+    def failing():
+        raise RuntimeError('task failed')
+
+    writer.schedule(failing, 0.01)
+    writer.schedule(task, 0.01)
+    writer.start()
+    assert ran.wait(5)
+    writer.stop()
+    assert threads[0] == 'write-behind'
@@ -1,212 +1,221 @@
 import os
 import json
+import math
+import logging
 import sqlite3
-import pandas as pd
-import numpy as np
-from datetime import datetime
-from io import BytesIO
-import base64
-import joblib
 import secrets
-from flask import Flask, request, render_template, redirect, url_for, session, flash
-from werkzeug.security import generate_password_hash, check_password_hash
+import shutil
+import tempfile
+from flask import Flask, request, render_template, redirect, url_for, session, flash, jsonify, Response, stream_with_context
+from werkzeug.security import check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from functools import wraps
-from sklearn.model_selection import train_test_split
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.metrics import mean_squared_error, r2_score
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.linear_model import Ridge
+from typing import NamedTuple
+from constants import KENYAN_COUNTIES, PROPERTY_TYPES
+from features import UnknownCategoryError
+import db
+import assets
+from db import init_db, get_user_by_username, create_user, record_login
+from model_registry import ModelRegistry, DEFAULT_ENCODERS_DIR, MODEL_FILE
+import batch_predict
+import comparables
+import export
+import forest_eval
+import ingest
+import market_stats
+from prediction_cache import PredictionCache, SQLiteCacheBackend, normalize_key
+from login_throttle import LoginThrottle, SQLiteBucketStore
+import metrics
+from metrics import span
+
+# Leveled logging; debug lines cost only a level check unless SMART_ASSETS_LOG_LEVEL=DEBUG
+logging.basicConfig(level=os.environ.get('SMART_ASSETS_LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
+# Workers forked from one master share the generated key; set SMART_ASSETS_SECRET_KEY
+# when sessions must survive restarts or span separately started processes
+# (gunicorn without --preload, uvicorn --workers); wsgi.create_app() warns if it's missing
+app.secret_key = os.environ.get('SMART_ASSETS_SECRET_KEY') or secrets.token_hex(16)
 app.config['SESSION_TYPE'] = 'filesystem'
+# Reverse proxies in front of the app; their X-Forwarded-For/-Proto headers are trusted
+# for this many hops, so the login throttle sees client addresses rather than the proxy's
+PROXY_HOPS = int(os.environ.get('SMART_ASSETS_PROXY_HOPS', 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
+# Scrapers send this as a bearer token to read /metrics; without it, only local clients may
+METRICS_TOKEN = os.environ.get('SMART_ASSETS_METRICS_TOKEN')
+# Development defaults: edits to templates and static files show up on reload.
+# wsgi.create_app() turns these off for production.
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # Disable caching
 app.jinja_env.auto_reload = True
-app.config['TEMPLATES_AUTO_RELOAD'] = True
+metrics.init_app(app)
+# Fingerprinted, precompressed static files, linked from templates with asset_url()
+static_assets = assets.init_app(app, auto_reload=True)
 
 # Get the base directory
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-ENCODERS_DIR = os.path.join(os.path.dirname(BASE_DIR), 'Encoders')
-
-# List of all 47 Kenyan counties
-KENYAN_COUNTIES = [
-    'Baringo', 'Bomet', 'Bungoma', 'Busia', 'Elgeyo-Marakwet',
-    'Embu', 'Garissa', 'Homa Bay', 'Isiolo', 'Kajiado',
-    'Kakamega', 'Kericho', 'Kiambu', 'Kilifi', 'Kirinyaga',
-    'Kisii', 'Kisumu', 'Kitui', 'Kwale', 'Laikipia',
-    'Lamu', 'Machakos', 'Makueni', 'Mandera', 'Meru',
-    'Migori', 'Marsabit', 'Mombasa', 'Murang\'a', 'Nairobi',
-    'Nakuru', 'Nandi', 'Narok', 'Nyamira', 'Nyandarua',
-    'Nyeri', 'Samburu', 'Siaya', 'Taita-Taveta', 'Tana River',
-    'Tharaka-Nithi', 'Trans Nzoia', 'Turkana', 'Uasin Gishu',
-    'Vihiga', 'Wajir', 'West Pokot'
-]
-
-# Property types
-PROPERTY_TYPES = ['House', 'Apartment', 'Villa', 'Townhouse', 'Bungalow']
-
-# Database setup
-def init_db():
-    db_path = os.path.join(BASE_DIR, 'users.db')
-    print(f"Initializing database at: {db_path}")  # Debug print
-    
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    
-    # Enable foreign key constraints
-    c.execute('PRAGMA foreign_keys = ON')
-    
-    # Users table
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                name TEXT,
-                email TEXT,
-                is_admin BOOLEAN DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_login TIMESTAMP)''')
-    
-    # Login history table
-    c.execute('''CREATE TABLE IF NOT EXISTS login_history
-                (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                username TEXT,
-                login_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                ip_address TEXT,
-                user_agent TEXT,
-                success BOOLEAN,
-                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE)''')
-    
-    # Property data table
-    c.execute('''CREATE TABLE IF NOT EXISTS property_data
-                (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                bedrooms INTEGER,
-                bathrooms INTEGER,
-                size_sqft REAL,
-                location TEXT,
-                property_type TEXT,
-                price REAL,
-                added_by INTEGER,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(added_by) REFERENCES users(id) ON DELETE CASCADE)''')
-    
-    # Predictions table
-    c.execute('''CREATE TABLE IF NOT EXISTS predictions
-                (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                location TEXT,
-                property_type TEXT,
-                bedrooms INTEGER,
-                bathrooms INTEGER,
-                size_sqft REAL,
-                predicted_price REAL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE)''')
-    
-    # Create admin user if not exists
-    admin_exists = c.execute('SELECT 1 FROM users WHERE username = "admin"').fetchone()
-    if not admin_exists:
-        admin_password = generate_password_hash("admin123")
-        c.execute('INSERT INTO users (username, password, name, email, is_admin) VALUES (?, ?, ?, ?, ?)',
-                 ('admin', admin_password, 'Admin User', 'admin@example.com', 1))
-    
-    conn.commit()
-    conn.close()
-    print("Database initialization complete")  # Debug print
-
-# Database helper functions
-def get_db_connection():
-    db_path = os.path.join(BASE_DIR, 'users.db')
-    print(f"Connecting to database at: {db_path}")  # Debug print
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    # Enable foreign key constraints
-    conn.execute('PRAGMA foreign_keys = ON')
-    return conn
-
-def get_user_by_username(username):
-    conn = get_db_connection()
-    user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-    conn.close()
-    return dict(user) if user else None
-
-def create_user(name, email, username, password):
-    conn = get_db_connection()
-    try:
-        # Check if username already exists
-        existing_user = conn.execute('SELECT 1 FROM users WHERE username = ?', (username,)).fetchone()
-        if existing_user:
-            print(f"Username {username} already exists")  # Debug print
-            return False
-            
-        # Insert new user
-        conn.execute('INSERT INTO users (name, email, username, password) VALUES (?, ?, ?, ?)',
-                    (name, email, username, generate_password_hash(password)))
-        conn.commit()
-        print(f"User {username} created successfully")  # Debug print
-        return True
-    except sqlite3.Error as e:
-        print(f"Database error in create_user: {e}")  # Debug print
-        return False
-    finally:
-        conn.close()
-
-def record_login(user_id, username, ip_address, user_agent, success=True):
-    conn = get_db_connection()
-    try:
-        conn.execute('''INSERT INTO login_history 
-                      (user_id, username, ip_address, user_agent, success) 
-                      VALUES (?, ?, ?, ?, ?)''',
-                   (user_id, username, ip_address, user_agent, success))
-        if success and user_id:
-            conn.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', 
-                        (user_id,))
-        conn.commit()
-        print(f"Login recorded for user {username}")  # Debug print
-    except Exception as e:
-        print(f"Error recording login: {e}")  # Debug print
-    finally:
-        conn.close()
+ENCODERS_DIR = DEFAULT_ENCODERS_DIR
+
+# Prediction backend: 'compiled' (flattened tree arrays) or 'sklearn' (model.predict)
+PREDICT_BACKEND = os.environ.get('SMART_ASSETS_PREDICT_BACKEND', 'compiled')
+
+# Process-wide model registry; artifacts are loaded once and hot-swapped on change
+model_registry = ModelRegistry(ENCODERS_DIR, backend=PREDICT_BACKEND)
+
+# Nearest-neighbour index over property_data for the comparables shown next to predictions
+comparables_index = comparables.ComparablesIndex()
+
+# Prediction cache keyed by (model version, normalized inputs). Set
+# SMART_ASSETS_SHARED_CACHE to a SQLite file path to share results between workers.
+_cache_ttl = os.environ.get('SMART_ASSETS_CACHE_TTL')
+_shared_cache_path = os.environ.get('SMART_ASSETS_SHARED_CACHE')
+prediction_cache = PredictionCache(
+    max_entries=int(os.environ.get('SMART_ASSETS_CACHE_SIZE', 10000)),
+    ttl=float(_cache_ttl) if _cache_ttl else None,
+    shared=SQLiteCacheBackend(_shared_cache_path) if _shared_cache_path else None)
+
+# Login attempt limits per client IP and per failed username. Set SMART_ASSETS_LOGIN_THROTTLE_DB
+# to a SQLite file path to enforce them across worker processes, or
+# SMART_ASSETS_LOGIN_THROTTLE=0 to turn them off (load tests).
+_throttle_path = os.environ.get('SMART_ASSETS_LOGIN_THROTTLE_DB')
+login_throttle = None
+if os.environ.get('SMART_ASSETS_LOGIN_THROTTLE', '1') != '0':
+    login_throttle = LoginThrottle(SQLiteBucketStore(_throttle_path) if _throttle_path else None)
+
+# Values owned by other components, read when /metrics is scraped
+metrics.registry.gauge('smart_assets_comparables_rows', 'Listings in the comparables index.',
+                       lambda: comparables_index.size())
+metrics.registry.gauge('smart_assets_model_loads', 'Times the model artifacts have been loaded.',
+                       lambda: model_registry.load_count)
+metrics.registry.gauge('smart_assets_prediction_cache_hits', 'Prediction cache hits.',
+                       lambda: prediction_cache.hits)
+metrics.registry.gauge('smart_assets_prediction_cache_misses', 'Prediction cache misses.',
+                       lambda: prediction_cache.misses)
+metrics.registry.gauge('smart_assets_write_queue_depth', 'Audit rows waiting to be written.',
+                       lambda: (db.write_behind_stats() or {}).get('depth'))
+metrics.registry.gauge('smart_assets_write_dropped', 'Audit rows that could not be written, even one at a time.',
+                       lambda: (db.write_behind_stats() or {}).get('dropped'))
+metrics.registry.gauge('smart_assets_write_flush_seconds_avg', 'Average write-behind flush latency.',
+                       lambda: (db.write_behind_stats() or {}).get('avg_flush_seconds'))
+
+
+class PriceEstimate(NamedTuple):
+    """Forest prediction for one listing, with the spread of its trees.
+
+    `low` and `high` are forest_eval.INTERVAL_QUANTILES of the per-tree
+    predictions: how much the trees disagree, not a calibrated interval.
+    """
+    price: float
+    std: float
+    low: float
+    high: float
+
+
+def cached_prediction(bundle, bedrooms, bathrooms, size_sqft, location, property_type):
+    """PriceEstimate of one listing under `bundle`, computed only on a prediction cache miss.
+
+    Raises UnknownCategoryError for a county or property type the model doesn't know.
+    """
+    # Predict on the normalized inputs themselves, so a cache hit and a miss give the same price
+    key = normalize_key(bedrooms, bathrooms, size_sqft, location, property_type)
+    bedrooms, bathrooms, size_sqft, location, property_type = key
+
+    # Encode in model feature order (rejecting unknown categories) and predict
+    def compute():
+        with span('encode'):
+            input_data = bundle.schema.encode_row(bedrooms, bathrooms, size_sqft, location, property_type)
+        with span('predict'):
+            # Point prediction and interval from one pass over the trees
+            dist = forest_eval.tree_distribution(forest_eval.tree_values(bundle.predictor, input_data))
+            return (float(dist.mean[0]), float(dist.std[0]),
+                    float(dist.quantiles[0, 0]), float(dist.quantiles[0, -1]))
+
+    return PriceEstimate(*prediction_cache.get_or_compute(bundle.version, key, compute))
 
 def predict_price(bedrooms, bathrooms, size_sqft, location, property_type='House'):
     try:
-        # Load models and encoders using relative paths
-        model_path = os.path.join(ENCODERS_DIR, 'rf_model_compressed_lvl2.pkl')
-        location_encoder_path = os.path.join(ENCODERS_DIR, 'location_encoder.joblib')
-        property_encoder_path = os.path.join(ENCODERS_DIR, 'property_encoder.joblib')
-        
-        model = joblib.load(model_path)
-        le_location = joblib.load(location_encoder_path)
-        le_property = joblib.load(property_encoder_path)
-
-        # Validate inputs
-        if location not in KENYAN_COUNTIES:
-            raise ValueError(f"Invalid county: {location}")
-        if property_type not in PROPERTY_TYPES:
-            raise ValueError(f"Invalid property type: {property_type}")
-
-        # Prepare input data
-        input_data = pd.DataFrame({
-            'bedrooms': [bedrooms],
-            'bathrooms': [bathrooms],
-            'size_sqft': [size_sqft],
-            'location_encoded': [le_location.transform([location])[0]],
-            'property_type_encoded': [le_property.transform([property_type])[0]]
-        })
-
-        # Predict the price
-        return model.predict(input_data)[0]
+        # Use the shared model bundle instead of loading artifacts per call
+        with span('model_load'):
+            bundle = model_registry.get()
+        estimate = cached_prediction(bundle, bedrooms, bathrooms, size_sqft, location, property_type)
+        metrics.predictions_total.labels('function').inc()
+        return estimate.price
     except FileNotFoundError as e:
-        print(f"Error: {e}")
+        logger.error("Model artifacts missing: %s", e)
         return None
     except Exception as e:
-        print(f"Prediction error: {e}")
+        logger.warning("Prediction error: %s", e)
         return None
 
+# Shared by the JSON endpoints here and the async app in asgi.py
+def parse_listing(data):
+    """(bedrooms, bathrooms, size_sqft, location, property_type) from a JSON object; raises ValueError."""
+    try:
+        listing = (int(data['bedrooms']), int(data['bathrooms']), float(data['size_sqft']),
+                   str(data['location']).strip(), str(data['property_type']).strip())
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('bedrooms, bathrooms, size_sqft, location and property_type are required')
+    if min(listing[:3]) < 1:
+        raise ValueError('bedrooms, bathrooms and size_sqft must be at least 1')
+    return listing
+
+def predict_listing(user_id, listing, source):
+    """Predict one parsed listing and record it for user_id; returns (PriceEstimate, model version)."""
+    bedrooms, bathrooms, size_sqft, location, property_type = listing
+    with span('model_load'):
+        bundle = model_registry.get()
+    estimate = cached_prediction(bundle, *listing)
+    metrics.predictions_total.labels(source).inc()
+    try:
+        with span('db'):
+            db.insert_prediction(user_id, location, property_type, bedrooms, bathrooms, size_sqft, *estimate)
+    except sqlite3.Error as e:
+        logger.error("Database error recording prediction: %s", e)
+    return estimate, bundle.version
+
+def estimate_json(estimate, version):
+    """JSON body for one prediction, shared with asgi.py."""
+    return {'predicted_price': estimate.price, 'predicted_std': estimate.std,
+            'interval_low': estimate.low, 'interval_high': estimate.high,
+            'interval': list(forest_eval.INTERVAL_QUANTILES), 'model_version': version}
+
+def throttle_login(ip_address, username):
+    """Seconds a login attempt must wait, or 0 if it may go ahead."""
+    wait = login_throttle.attempt(ip_address, username) if login_throttle is not None else 0
+    if wait:
+        metrics.logins_total.labels('throttled').inc()
+        logger.info("Throttled login for %s from %s", username, ip_address)
+    return math.ceil(wait)
+
+def check_login(username, password):
+    """Look up `username` and check the password; returns (user or None, valid)."""
+    with span('db'):
+        user = get_user_by_username(username)
+    with span('password_hash'):
+        valid = bool(user) and check_password_hash(user['password'], password)
+    return user, valid
+
+def finish_login(user, username, ip_address, user_agent, valid):
+    """Record the attempt in login_history, the login counter and, if it failed, the throttle."""
+    if valid:
+        # The dashboard the user lands on next reads this instead of SQLite
+        db.cache_user_profile(user)
+    elif login_throttle is not None:
+        login_throttle.failed(ip_address, username)
+    with span('db'):
+        record_login(user['id'] if user else None, username, ip_address, user_agent, success=valid)
+    metrics.logins_total.labels('success' if valid else 'failure').inc()
+    if not valid:
+        logger.info("Failed login for %s from %s", username, ip_address)
+
+def session_for(user):
+    """Session keys set by a successful login."""
+    return {'user_id': user['id'], 'username': user['username'], 'is_admin': bool(user.get('is_admin', False))}
+
 # Authentication decorator
 def login_required(f):
     @wraps(f)
@@ -217,21 +226,49 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Admin-only pages
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            flash('Please login to access this page')
+            return redirect(url_for('login'))
+        if not session.get('is_admin'):
+            flash('Administrator access required', 'error')
+            return redirect(url_for('home'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Authentication decorator for JSON endpoints; answers 401 instead of redirecting
+def api_login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
+
+def api_admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+        if not session.get('is_admin'):
+            return jsonify({'error': 'Administrator access required'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 # Routes
 @app.route('/')
 @login_required
 def home():
     try:
-        conn = get_db_connection()
-        user = conn.execute('SELECT * FROM users WHERE id = ?', (session['user_id'],)).fetchone()
-        conn.close()
+        with span('db'):
+            user_dict = db.get_user_profile(session['user_id'])
         
-        if not user:
+        if not user_dict:
             flash('User not found. Please login again.', 'error')
             return redirect(url_for('logout'))
-            
-        # Convert user to dict for template
-        user_dict = dict(user)
         
         # Add welcome message for first-time login
         if not user_dict.get('last_login'):
@@ -239,8 +276,10 @@ def home():
         else:
             flash('Welcome back!', 'success')
             
-        return render_template('index.html', user=user_dict)
+        with span('render'):
+            return render_template('index.html', user=user_dict)
     except Exception as e:
+        logger.exception("Error loading dashboard: %s", e)
         flash('An error occurred while loading your dashboard. Please try again.', 'error')
         return redirect(url_for('logout'))
 
@@ -254,34 +293,27 @@ def login():
             flash('Please enter both username and password', 'error')
             return redirect(url_for('login'))
 
-        # Fetch user details by username
-        user = get_user_by_username(username)
-
-        # Prepare login details for recording
-        login_details = {
-            'user_id': user['id'] if user else None,
-            'username': username,
-            'ip_address': request.remote_addr,
-            'user_agent': request.headers.get('User-Agent', 'Unknown')
-        }
-
-        # Validate user credentials
-        if user and check_password_hash(user['password'], password):
-            # Successful login
-            session['user_id'] = user['id']
-            session['username'] = user['username']
-            session['is_admin'] = bool(user.get('is_admin', False))
-
-            # Record successful login
-            record_login(**login_details, success=True)
-
+        # Reject bursts before the password hash and the login_history insert
+        wait = throttle_login(request.remote_addr, username)
+        if wait:
+            flash(f'Too many login attempts. Please try again in {wait} seconds.', 'error')
+            response = Response(_render_login(), status=429)
+            response.headers['Retry-After'] = str(wait)
+            return response
+
+        # Validate user credentials and record the attempt
+        user, valid = check_login(username, password)
+        finish_login(user, username, request.remote_addr, request.headers.get('User-Agent', 'Unknown'), valid)
+        if valid:
+            session.update(session_for(user))
             flash('Login successful! Welcome back!', 'success')
             return redirect(url_for('home'))
 
-        # Record failed login attempt
-        record_login(**login_details, success=False)
         flash('Invalid username or password. Please try again.', 'error')
 
+    return _render_login()
+
+def _render_login():
     return render_template('login.html',
                          form_action=url_for('login'),
                          auth_title="Login",
@@ -356,58 +388,59 @@ def predict():
                 flash('Please enter valid numbers for all fields', 'error')
                 return redirect(url_for('predict'))
             
-            # Load the model and encoders
+            # Get the loaded model and encoders from the registry
             try:
-                model = joblib.load('Encoders/rf_model_compressed_lvl2.pkl')
-                location_encoder = joblib.load('Encoders/location_encoder.joblib')
-                property_encoder = joblib.load('Encoders/property_encoder.joblib')
+                with span('model_load'):
+                    bundle = model_registry.get()
             except Exception as e:
-                print(f"Error loading model or encoders: {e}")  # Debug print
+                logger.error("Error loading model or encoders: %s", e)
                 flash('Error loading prediction model', 'error')
                 return redirect(url_for('predict'))
             
             # Prepare input data
             try:
-                location_encoded = location_encoder.transform([location])[0]
-                property_encoded = property_encoder.transform([property_type])[0]
-                input_data = [[bedrooms, bathrooms, size_sqft, location_encoded, property_encoded]]
-                
-                # Make prediction
-                predicted_price = model.predict(input_data)[0]
+                # Make prediction, reusing a cached result for repeated queries
+                estimate = cached_prediction(bundle, bedrooms, bathrooms, size_sqft, location, property_type)
+                metrics.predictions_total.labels('form').inc()
                 
                 # Record prediction in database
-                conn = get_db_connection()
                 try:
-                    print(f"Recording prediction for user {session['user_id']}")  # Debug print
-                    conn.execute('''INSERT INTO predictions 
-                                  (user_id, location, property_type, bedrooms, bathrooms, size_sqft, predicted_price)
-                                  VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                                 (session['user_id'], location, property_type, bedrooms, bathrooms, size_sqft, predicted_price))
-                    conn.commit()
-                    print("Prediction recorded successfully")  # Debug print
+                    with span('db'):
+                        db.insert_prediction(session['user_id'], location, property_type,
+                                             bedrooms, bathrooms, size_sqft, *estimate)
                 except sqlite3.Error as e:
-                    print(f"Database error recording prediction: {e}")  # Debug print
+                    logger.error("Database error recording prediction: %s", e)
                     flash('Error recording prediction', 'error')
-                finally:
-                    conn.close()
                 
-                return render_template('predict.html',
-                                     prediction=predicted_price,
-                                     form_data=request.form,
-                                     counties=KENYAN_COUNTIES,
-                                     property_types=PROPERTY_TYPES)
+                try:
+                    with span('comparables'):
+                        similar = comparables_index.query(location, property_type, bedrooms, bathrooms, size_sqft)
+                except Exception as e:
+                    logger.warning("Error finding comparables: %s", e)
+                    similar = []
+
+                with span('render'):
+                    return render_template('predict.html',
+                                         prediction=estimate,
+                                         comparables=similar,
+                                         form_data=request.form,
+                                         counties=KENYAN_COUNTIES,
+                                         property_types=PROPERTY_TYPES)
                 
+            except UnknownCategoryError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('predict'))
             except Exception as e:
-                print(f"Error making prediction: {e}")  # Debug print
+                logger.exception("Error making prediction: %s", e)
                 flash('Error making prediction', 'error')
                 return redirect(url_for('predict'))
                 
         except ValueError as e:
-            print(f"Value error in predict: {e}")  # Debug print
+            logger.debug("Value error in predict: %s", e)
             flash('Please enter valid numbers for all fields', 'error')
             return redirect(url_for('predict'))
         except Exception as e:
-            print(f"Unexpected error in predict: {e}")  # Debug print
+            logger.exception("Unexpected error in predict: %s", e)
             flash(f'Error making prediction: {str(e)}', 'error')
             return redirect(url_for('predict'))
     
@@ -415,20 +448,116 @@ def predict():
                          counties=KENYAN_COUNTIES,
                          property_types=PROPERTY_TYPES)
 
+@app.route('/api/login', methods=['POST'])
+def api_login():
+    data = request.get_json(silent=True) or {}
+    username = str(data.get('username', '')).strip()
+    password = str(data.get('password', '')).strip()
+    if not username or not password:
+        return jsonify({'error': 'username and password are required'}), 400
+
+    wait = throttle_login(request.remote_addr, username)
+    if wait:
+        return jsonify({'error': 'Too many login attempts'}), 429, {'Retry-After': str(wait)}
+    user, valid = check_login(username, password)
+    finish_login(user, username, request.remote_addr, request.headers.get('User-Agent', 'Unknown'), valid)
+    if not valid:
+        return jsonify({'error': 'Invalid username or password'}), 401
+    session.update(session_for(user))
+    return jsonify({'username': user['username'], 'is_admin': session['is_admin']})
+
+@app.route('/api/predict', methods=['POST'])
+@api_login_required
+def api_predict():
+    try:
+        listing = parse_listing(request.get_json(silent=True) or {})
+        estimate, version = predict_listing(session['user_id'], listing, 'api')
+    except (ValueError, UnknownCategoryError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error making prediction: %s", e)
+        return jsonify({'error': 'Prediction failed'}), 500
+    return jsonify(estimate_json(estimate, version))
+
+@app.route('/api/predict/batch', methods=['POST'])
+@api_login_required
+def predict_batch():
+    try:
+        frame = batch_predict.read_batch(request.get_data(), request.content_type)
+    except batch_predict.BatchInputError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        with span('model_load'):
+            bundle = model_registry.get()
+    except Exception as e:
+        logger.error("Error loading model or encoders: %s", e)
+        return jsonify({'error': 'Prediction model is not available'}), 503
+
+    # Respond in CSV if asked for it explicitly or if the batch was sent as CSV
+    output_format = request.args.get('format')
+    if output_format is None:
+        output_format = 'csv' if 'csv' in (request.content_type or '') else 'json'
+
+    def record(rows):
+        # One statement per chunk, written before the chunk goes out
+        metrics.predictions_total.labels('batch').inc(len(rows))
+        try:
+            with span('db'):
+                db.insert_predictions(rows)
+        except sqlite3.Error as e:
+            logger.error("Database error recording batch predictions: %s", e)
+
+    summary = {'rows': 0, 'predicted': 0, 'errors': 0, 'model_version': bundle.version}
+    chunks = batch_predict.record_predictions(session['user_id'], batch_predict.predict_batch(frame, bundle),
+                                              record)
+
+    def generate():
+        if output_format == 'csv':
+            yield from batch_predict.stream_csv(chunks, summary)
+        else:
+            yield from batch_predict.stream_json(chunks, summary)
+
+    mimetype = 'text/csv' if output_format == 'csv' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
 @app.route('/ml/status')
 @login_required
 def ml_status():
-    model_exists = os.path.exists('kenya_house_predictor.joblib')
-    metrics = {}
-    if model_exists and os.path.exists('model_metrics.json'):
+    model_exists = os.path.exists(os.path.join(ENCODERS_DIR, MODEL_FILE))
+    model_metrics = {}
+    metrics_path = os.path.join(ENCODERS_DIR, 'model_metrics.json')
+    if model_exists and os.path.exists(metrics_path):
         try:
-            with open('model_metrics.json', 'r') as f:
-                metrics = json.load(f)
-        except:
+            with open(metrics_path, 'r') as f:
+                model_metrics = json.load(f)
+        except (OSError, ValueError):
             pass
     return render_template('model_status.html',
                          model_exists=model_exists,
-                         metrics=metrics)
+                         metrics=model_metrics,
+                         registry=model_registry.status(),
+                         cache=prediction_cache.stats(),
+                         write_behind=db.write_behind_stats(),
+                         retrain_job=retrain_job.status() if retrain_job else None)
+
+# Background retraining; created on first use so serving never imports the training code
+retrain_job = None
+
+@app.route('/ml/retrain', methods=['POST'])
+@admin_required
+def ml_retrain():
+    global retrain_job
+    from retrain import RetrainJob
+    if retrain_job is None:
+        retrain_job = RetrainJob(ENCODERS_DIR)
+
+    incremental = request.form.get('mode') == 'incremental'
+    if retrain_job.start(incremental=incremental):
+        flash(f"{'Incremental' if incremental else 'Full'} retraining started", 'success')
+    else:
+        flash('A retraining job is already running', 'error')
+    return redirect(url_for('ml_status'))
 
 @app.route('/add-property', methods=['GET', 'POST'])
 @login_required
@@ -451,29 +580,24 @@ def add_property():
                 flash('Please enter valid numbers for all fields', 'error')
                 return redirect(url_for('add_property'))
             
-            conn = get_db_connection()
             try:
-                print(f"Adding property data for user {session['user_id']}")  # Debug print
-                conn.execute('''INSERT INTO property_data 
-                              (bedrooms, bathrooms, size_sqft, location, property_type, price, added_by)
-                              VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                             (bedrooms, bathrooms, size_sqft, location, property_type, price, session['user_id']))
-                conn.commit()
-                print("Property data added successfully")  # Debug print
+                with span('db'):
+                    db.insert_property(bedrooms, bathrooms, size_sqft, location, property_type,
+                                       price, session['user_id'])
+                # Index the new listing in the background
+                comparables_index.refresh(wait=False)
                 flash('Property data added successfully!', 'success')
                 return redirect(url_for('home'))
             except sqlite3.Error as e:
-                print(f"Database error in add_property: {e}")  # Debug print
+                logger.error("Database error in add_property: %s", e)
                 flash(f'Database error: {str(e)}', 'error')
                 return redirect(url_for('add_property'))
-            finally:
-                conn.close()
         except ValueError as e:
-            print(f"Value error in add_property: {e}")  # Debug print
+            logger.debug("Value error in add_property: %s", e)
             flash('Please enter valid numbers for all fields', 'error')
             return redirect(url_for('add_property'))
         except Exception as e:
-            print(f"Unexpected error in add_property: {e}")  # Debug print
+            logger.exception("Unexpected error in add_property: %s", e)
             flash(f'Error adding property: {str(e)}', 'error')
             return redirect(url_for('add_property'))
     
@@ -482,24 +606,158 @@ def add_property():
                          counties=KENYAN_COUNTIES,
                          property_types=PROPERTY_TYPES)
 
-# Initialize database and models
-with app.app_context():
+@app.route('/api/properties/import', methods=['POST'])
+@api_login_required
+def import_properties():
+    # Multipart uploads are spooled to a temporary file by Werkzeug; a raw body is read as a stream
+    upload = request.files.get('file')
+    if upload is not None:
+        source, filename, content_type = upload.stream, upload.filename, upload.content_type
+    else:
+        source, filename, content_type = request.stream, None, request.content_type
+    fmt = request.args.get('format') or ingest.detect_format(filename, content_type)
+    if fmt == 'parquet' and upload is None:
+        # Parquet readers need to seek; spool the body (to disk past 8 MB)
+        spooled = tempfile.SpooledTemporaryFile(max_size=8 * 2**20)
+        shutil.copyfileobj(request.stream, spooled)
+        spooled.seek(0)
+        source = spooled
+
+    try:
+        summary = ingest.ingest(source, fmt, added_by=session['user_id'],
+                                dry_run=request.args.get('dry_run') == '1')
+    except ingest.IngestError as e:
+        return jsonify({'error': str(e)}), 400
+    except sqlite3.Error as e:
+        logger.error("Database error importing properties: %s", e)
+        return jsonify({'error': 'Database error'}), 500
+    logger.info("Imported %d of %d property rows for user %s",
+                summary['accepted'], summary['rows'], session['user_id'])
+    if summary['accepted'] and not summary.get('dry_run'):
+        comparables_index.refresh(wait=False)
+    if 'error' in summary:
+        # Part of the file was imported before it failed; say how much
+        logger.warning("Import for user %s stopped early: %s", session['user_id'], summary['error'])
+        return jsonify(summary), 500 if summary['error_source'] == 'database' else 400
+    return jsonify(summary)
+
+@app.route('/api/market-stats')
+@api_login_required
+def api_market_stats():
+    source = request.args.get('source', 'property')
+    if source not in market_stats.SOURCES:
+        return jsonify({'error': f"source must be one of: {', '.join(market_stats.SOURCES)}"}), 400
+    group_by = [c for c in request.args.get('group_by', 'location,property_type').split(',') if c]
+    unknown = [c for c in group_by if c not in market_stats.GROUP_COLUMNS]
+    if unknown:
+        return jsonify({'error': f"Cannot group by: {', '.join(unknown)}"}), 400
+    with span('db'):
+        stats = market_stats.query(source, group_by, location=request.args.get('location'),
+                                   property_type=request.args.get('property_type'))
+    return jsonify({'source': source, 'group_by': group_by, 'stats': stats})
+
+@app.route('/api/comparables')
+@api_login_required
+def api_comparables():
+    try:
+        bedrooms, bathrooms, size_sqft, location, property_type = parse_listing(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if location not in KENYAN_COUNTIES:
+        return jsonify({'error': f'Unknown county: {location}'}), 400
+    if property_type not in PROPERTY_TYPES:
+        return jsonify({'error': f'Unknown property type: {property_type}'}), 400
+    k = request.args.get('k', str(comparables.DEFAULT_K)).strip()
+    if not k.isdigit() or not 1 <= int(k) <= comparables.MAX_K:
+        return jsonify({'error': f'k must be a whole number between 1 and {comparables.MAX_K}'}), 400
+    k = int(k)
+    with span('comparables'):
+        found = comparables_index.query(location, property_type, bedrooms, bathrooms, size_sqft, k)
+    return jsonify({'comparables': found})
+
+def _history_response(fetch, **filters):
+    limit = request.args.get('limit', db.HISTORY_PAGE_SIZE, type=int)
+    try:
+        with span('db'):
+            rows, next_cursor = fetch(limit=limit, cursor=request.args.get('cursor'), **filters)
+    except db.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'items': rows, 'next_cursor': next_cursor})
+
+@app.route('/api/predictions/history')
+@api_login_required
+def prediction_history():
+    return _history_response(db.get_prediction_history, user_id=session['user_id'],
+                             location=request.args.get('location'),
+                             property_type=request.args.get('property_type'))
+
+@app.route('/api/admin/login-history')
+@api_admin_required
+def login_history():
+    return _history_response(db.get_login_history, username=request.args.get('username'))
+
+@app.route('/api/admin/export/<table>')
+@api_admin_required
+def export_table(table):
+    fmt = request.args.get('format', 'csv')
+    summary = {'rows': 0}
+    try:
+        chunks = export.export(table, fmt, summary=summary,
+                               since=request.args.get('since'), until=request.args.get('until'),
+                               user=request.args.get('user'), location=request.args.get('location'),
+                               property_type=request.args.get('property_type'))
+    except export.ExportError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        yield from chunks
+        logger.info("Exported %d %s rows as %s for %s", summary['rows'], table, fmt, session['username'])
+
+    filename = f"{table}.{fmt}"
+    return Response(stream_with_context(generate()), content_type=export.CONTENT_TYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if METRICS_TOKEN:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not secrets.compare_digest(token.strip(), METRICS_TOKEN):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain',
+                            headers={'WWW-Authenticate': 'Bearer realm="metrics"'})
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    return Response(metrics.registry.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+def initialize(preload_model=True, write_behind=True):
+    """Create the schema, start the audit writer, load the model and build the comparables index.
+
+    Nothing here runs at import time, so the entry points (wsgi.create_app,
+    serve.py, the dev server below) decide what happens in which process.
+    """
     init_db()
-    os.makedirs('templates', exist_ok=True)
-    os.makedirs('static', exist_ok=True)
-
-# Load the pre-trained model
-try:
-    model_path = os.path.join(ENCODERS_DIR, 'rf_model_compressed_lvl2.pkl')
-    model = joblib.load(model_path)
-    print("Compressed model loaded successfully.")
-except Exception as e:
-    print(f"Error loading compressed model: {e}")
-    model = None
+    # Write login history and predictions from a background thread in batches
+    if write_behind and os.environ.get('SMART_ASSETS_WRITE_BEHIND', '1') != '0':
+        db.start_write_behind()
+    if preload_model:
+        # Load the model now so the first request doesn't pay for it
+        try:
+            bundle = model_registry.warm_up()
+            logger.info("Compressed model loaded successfully (version %s, %s backend)",
+                        bundle.version, bundle.backend)
+        except Exception as e:
+            logger.error("Error loading compressed model: %s", e)
+    # Built even without the model: it doesn't depend on it, and a worker that had to
+    # build it lazily would read all of property_data on its first /predict request
+    try:
+        comparables_index.build()
+    except sqlite3.Error as e:
+        logger.error("Error building comparables index: %s", e)
+    # Compile every template up front; in a prefork master workers then share the code
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    return app
 
 if __name__ == '__main__':
-    # Create necessary directories
-    os.makedirs('templates', exist_ok=True)
-    os.makedirs('static', exist_ok=True)
-    # Run the app
-    app.run(debug=True, use_reloader=False)
\ No newline at end of file
+    # Development server; use serve.py (or wsgi.create_app) in production
+    initialize()
+    app.run(debug=True, use_reloader=False)
@@ -0,0 +1,192 @@
+import logging
+import time
+import queue
+import sqlite3
+import threading
+from itertools import groupby
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Background writer that batches audit INSERT/UPDATE statements.
+
+    Producers call submit(sql, params) and return immediately. A single
+    writer thread drains the queue whenever `flush_size` statements are
+    waiting or `flush_interval` seconds have passed, and writes each batch in
+    one transaction, using executemany for consecutive runs of the same
+    statement so statement order is preserved.
+
+    The queue is bounded: when it is full, submit() blocks for up to
+    `put_timeout` seconds and then writes the statement synchronously, so
+    producers slow down instead of losing rows.
+
+    A batch that fails because the database is busy is retried `retries`
+    times with exponential backoff. If it still fails (or fails for any
+    other reason) its statements are written one at a time, so only the
+    ones that can't be written are dropped; those are counted in
+    `dropped` and logged.
+
+    Periodic write work (see schedule()) runs on the same thread, between
+    batches, so it never competes with this process's audit writes.
+    """
+
+    def __init__(self, transaction, flush_size=200, flush_interval=0.5,
+                 max_queue=10000, put_timeout=1.0, retries=3, retry_delay=0.1):
+        self._transaction = transaction
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._tasks = []  # [task, interval, next run]
+        self.enqueued = 0
+        self.written = 0
+        self.flushes = 0
+        self.sync_writes = 0
+        self.errors = 0
+        self.retried = 0
+        self.dropped = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+        return self
+
+    def schedule(self, task, interval):
+        """Call task() on the writer thread about every `interval` seconds."""
+        self._tasks.append([task, interval, time.monotonic() + interval])
+
+    def _run_tasks(self):
+        now = time.monotonic()
+        for entry in self._tasks:
+            task, interval, due = entry
+            if now < due:
+                continue
+            entry[2] = now + interval
+            try:
+                task()
+            except Exception as e:
+                logger.error("Error in scheduled write task %s: %s", getattr(task, '__name__', task), e)
+
+    def submit(self, sql, params):
+        try:
+            self._queue.put((sql, params), timeout=self.put_timeout)
+            self.enqueued += 1
+        except queue.Full:
+            # Backpressure: the writer can't keep up, so pay for this write here
+            self.sync_writes += 1
+            self._write([(sql, params)])
+
+    def _drain(self, first):
+        batch = [first]
+        while len(batch) < self.flush_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._run_tasks()
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # Collect until the batch is full or the oldest row has waited flush_interval
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+        self.flush()
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        self._write(batch)
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.last_flush_seconds = elapsed
+        self.total_flush_seconds += elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    def _write_batch(self, batch):
+        with self._transaction() as conn:
+            for sql, group in groupby(batch, key=lambda item: item[0]):
+                conn.executemany(sql, [params for _, params in group])
+
+    def _write(self, batch):
+        for attempt in range(self.retries + 1):
+            try:
+                self._write_batch(batch)
+                self.written += len(batch)
+                return
+            except sqlite3.OperationalError as e:
+                # Locked or busy: likely to succeed later
+                error = e
+                if attempt < self.retries:
+                    self.retried += 1
+                    time.sleep(self.retry_delay * 2 ** attempt)
+            except sqlite3.Error as e:
+                error = e
+                break
+        self.errors += 1
+        logger.warning("Error writing %d queued statements (%s); writing them one at a time", len(batch), error)
+        dropped = 0
+        for item in batch:
+            try:
+                self._write_batch([item])
+                self.written += 1
+            except sqlite3.Error as e:
+                dropped += 1
+                error = e
+        if dropped:
+            self.dropped += dropped
+            logger.error("Dropped %d of %d queued statements: %s", dropped, len(batch), error)
+
+    def flush(self):
+        """Write everything that is queued right now on the calling thread."""
+        while True:
+            try:
+                first = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self._flush(self._drain(first))
+
+    def stop(self, timeout=5.0):
+        """Stop the writer thread after writing out the queue."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def stats(self):
+        return {
+            'depth': self._queue.qsize(),
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'flushes': self.flushes,
+            'sync_writes': self.sync_writes,
+            'errors': self.errors,
+            'retried': self.retried,
+            'dropped': self.dropped,
+            'last_flush_seconds': self.last_flush_seconds,
+            'max_flush_seconds': self.max_flush_seconds,
+            'avg_flush_seconds': self.total_flush_seconds / self.flushes if self.flushes else 0.0,
+        }
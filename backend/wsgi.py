@@ -0,0 +1,72 @@
+"""WSGI entry point.
+
+    SMART_ASSETS_SECRET_KEY=... gunicorn -w 4 'wsgi:create_app()'   # each worker loads its own model
+    python serve.py --workers 4           # model loaded once, shared by workers
+
+serve.py calls create_app() in its master process, then pre_fork() once
+and post_fork() in every worker.
+
+Without SMART_ASSETS_SECRET_KEY every process that imports the app makes
+up its own session key. That is fine when the workers are forked from the
+process that called create_app() (serve.py, gunicorn --preload), but with
+gunicorn's default of importing in each worker, a session cookie issued by
+one worker is rejected by all the others.
+"""
+import gc
+import os
+import logging
+
+logger = logging.getLogger('wsgi')
+
+
+def create_app(preload_model=True, write_behind=True, secret_key_shared=False):
+    """Initialize the Smart Assets app for production and return it.
+
+    Unlike `python vinnie.py` this turns off template and static file
+    auto-reload and compiles every template up front, so nothing on disk
+    is checked again for the life of the process.
+
+    Pass secret_key_shared=True when every process serving the app is
+    forked from this one (or there is only one); otherwise a missing
+    SMART_ASSETS_SECRET_KEY is warned about.
+    """
+    if not os.environ.get('SMART_ASSETS_SECRET_KEY') and not secret_key_shared:
+        logger.warning("SMART_ASSETS_SECRET_KEY is not set, so this process uses a random session key. "
+                       "If workers start the app separately (gunicorn without --preload, uvicorn "
+                       "--workers), logins will only work on the worker that issued them; set it.")
+    import vinnie
+
+    app = vinnie.app
+    app.config['TEMPLATES_AUTO_RELOAD'] = False
+    app.config['SEND_FILE_MAX_AGE_DEFAULT'] = None  # let clients revalidate /static/ with ETags
+    app.jinja_env.auto_reload = False
+    vinnie.static_assets.auto_reload = False
+    return vinnie.initialize(preload_model=preload_model, write_behind=write_behind)
+
+
+def pre_fork():
+    """Prepare the master for forking workers.
+
+    Closes the master's SQLite connections, then moves every object that
+    exists now (model, encoders, compiled templates, static assets) into the permanent GC
+    generation. The collector never visits those again, so it doesn't write
+    to their pages and the workers keep sharing them copy-on-write.
+    """
+    import db
+    db.close_connections()
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(load_model=False):
+    """Per-worker setup; the audit writer thread doesn't survive fork().
+
+    With load_model=True the worker loads its own copy of the model, for
+    masters that were created with preload_model=False.
+    """
+    import db
+    import vinnie
+    if os.environ.get('SMART_ASSETS_WRITE_BEHIND', '1') != '0':
+        db.start_write_behind()
+    if load_model:
+        vinnie.model_registry.warm_up()